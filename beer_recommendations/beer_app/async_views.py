@@ -0,0 +1,187 @@
+from abc import ABCMeta, abstractmethod
+from django.http import HttpResponse
+from django.views import View
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from beer_app.queries import (beer_list_queryset, beer_detail_queryset, beer_review_queryset,
+                              beer_recommendation_queryset)
+from beer_app.event_log import log_impressions
+from beer_app.metrics import request_phase
+from beer_app.renderers import ORJSONRenderer
+from beer_app.routers import read_alias, areplica_alias_for
+from beer_app.serializers import (BeerListValuesSerializer, BeerDetailValuesSerializer,
+                                  BeerReviewListValuesSerializer, BeerRecommendationValuesSerializer)
+
+# ASGI-native versions of the read endpoints. Queries run on the async ORM, so under an ASGI
+# server one worker keeps many slow clients open without a thread per request.
+# Responses match the sync views in beer_app.views (same querysets and values serializers).
+
+
+class AsyncTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication with token lookup on the async ORM, same header format and errors.
+    """
+
+    async def aauthenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            raise exceptions.NotAuthenticated()
+        if len(auth) == 1:
+            raise exceptions.AuthenticationFailed('Invalid token header. No credentials provided.')
+        if len(auth) > 2:
+            raise exceptions.AuthenticationFailed('Invalid token header. Token string should not contain spaces.')
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed('Invalid token header. Token string should not contain invalid characters.')
+
+        model = self.get_model()
+        try:
+            token = await model.objects.select_related('user').aget(key=key)
+        except model.DoesNotExist:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return token.user
+
+
+class AsyncAPIView(View, metaclass=ABCMeta):
+    """
+    Authenticated GET endpoint rendering get_data() result with ORJSONRenderer,
+    API exceptions are rendered like rest_framework does. Subclasses implement get_data().
+    """
+    http_method_names = ['get', 'options']
+    authentication = AsyncTokenAuthentication()
+    renderer = ORJSONRenderer()
+    values_serializer_class = None
+    # read from REPLICA_DATABASE after authentication, same as ReplicaReadMixin
+    read_replica = False
+
+    async def get(self, request, *args, **kwargs):
+        token = None
+        try:
+            with request_phase(request, 'auth'):
+                request.user = await self.authentication.aauthenticate(request)
+            if self.read_replica:
+                token = read_alias.set(await areplica_alias_for(request))
+            data = await self.get_data(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            return self.handle_exception(exc)
+        finally:
+            if token is not None:
+                read_alias.reset(token)
+        with request_phase(request, 'render'):
+            return self.render(data)
+
+    @abstractmethod
+    async def get_data(self, request, *args, **kwargs):
+        """ Data of response, raises APIException to render an error """
+
+    def get_serializer(self, request):
+        return self.values_serializer_class(context={'request': request})
+
+    def render(self, data, status=200):
+        return HttpResponse(self.renderer.render(data), status=status, content_type=self.renderer.media_type)
+
+    def handle_exception(self, exc):
+        if isinstance(exc.detail, (list, dict)):
+            data = exc.detail
+        else:
+            data = {'detail': exc.detail}
+        response = self.render(data, status=exc.status_code)
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            # same as rest_framework with TokenAuthentication first in authentication classes
+            response['WWW-Authenticate'] = self.authentication.authenticate_header(None)
+        return response
+
+
+class AsyncListView(AsyncAPIView):
+    """
+    Page number pagination with the same envelope, parameters and links as PageNumberPagination.
+    Subclasses implement get_queryset().
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_query_param = 'page'
+
+    @abstractmethod
+    def get_queryset(self, request):
+        """ Queryset of listed objects, rows are read with values_list of values_serializer_class fields """
+
+    def get_page_number(self, request, count):
+        last_page = max((count + self.page_size - 1) // self.page_size, 1)
+        page_number = request.GET.get(self.page_query_param, 1)
+        if page_number == 'last':
+            return last_page
+        try:
+            page_number = int(page_number)
+        except (TypeError, ValueError):
+            raise exceptions.NotFound('Invalid page.')
+        if page_number < 1 or page_number > last_page:
+            raise exceptions.NotFound('Invalid page.')
+        return page_number
+
+    def get_page_link(self, request, page_number):
+        url = request.build_absolute_uri()
+        if page_number == 1:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, page_number)
+
+    async def get_data(self, request, *args, **kwargs):
+        serializer = self.get_serializer(request)
+        queryset = self.get_queryset(request).values_list(*serializer.values_fields())
+        count = await queryset.acount()
+        page_number = self.get_page_number(request, count)
+        offset = (page_number - 1) * self.page_size
+        rows = [row async for row in queryset[offset:offset + self.page_size]]
+        has_next = offset + self.page_size < count
+        return {
+            'count': count,
+            'next': self.get_page_link(request, page_number + 1) if has_next else None,
+            'previous': self.get_page_link(request, page_number - 1) if page_number > 1 else None,
+            'results': serializer.serialize(rows),
+        }
+
+
+class BeerList(AsyncListView):
+    values_serializer_class = BeerListValuesSerializer
+    read_replica = True
+
+    def get_queryset(self, request):
+        return beer_list_queryset(request.GET.get('beer_name', None), request.GET.get('beer_style', None))
+
+
+class BeerDetail(AsyncAPIView):
+    values_serializer_class = BeerDetailValuesSerializer
+    read_replica = True
+
+    async def get_data(self, request, *args, **kwargs):
+        serializer = self.get_serializer(request)
+        queryset = beer_detail_queryset(request.user).filter(pk=kwargs['pk']).values_list(*serializer.values_fields())
+        row = await queryset.afirst()
+        if row is None:
+            # same message as get_object_or_404 in sync view
+            raise exceptions.NotFound('No Beer matches the given query.')
+        return serializer.serialize([row])[0]
+
+
+class BeerReviewList(AsyncListView):
+    values_serializer_class = BeerReviewListValuesSerializer
+
+    def get_queryset(self, request):
+        return beer_review_queryset(request.user)
+
+
+class BeerRecommendationDetail(AsyncListView):
+    values_serializer_class = BeerRecommendationValuesSerializer
+
+    def get_queryset(self, request):
+        return beer_recommendation_queryset(request.user).order_by('id')
+
+    async def get_data(self, request, *args, **kwargs):
+        data = await super().get_data(request, *args, **kwargs)
+        # appending to event buffer doesn't block
+        for recommendation in data['results']:
+            log_impressions(request.user, 'async_beer_recs', [recommendation['top{}_beer'.format(i)] for i in range(1, 11)])
+        return data
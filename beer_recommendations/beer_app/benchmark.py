@@ -0,0 +1,200 @@
+import json
+import random
+import threading
+import time
+from contextlib import ExitStack
+from django.db import connections
+from django.urls.resolvers import RoutePattern
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from beer_app.loadtest import percentile
+from beer_app.models import BeerReview
+from beer_app.synthetic import PASSWORD
+
+# In-process benchmark of API routes: every thread drives the full Django stack through its own
+# test client as one synthetic user, with its own database connection. Each request is timed
+# and its SQL statements on every database alias are counted with connection.execute_wrapper.
+
+REVIEW = {'review_overall': 3.5, 'review_aroma': 3, 'review_appearance': 4, 'review_palate': 3, 'review_taste': 4}
+IMPORT_ROWS = 100
+
+
+class Session:
+    """
+    Client of one benchmark thread, authenticated by token as user who has reviews of review_beer_ids.
+    """
+
+    def __init__(self, number, user, beer_ids, seed=0):
+        self.number = number
+        self.user = user
+        # server errors are counted like other error responses instead of stopping the benchmark
+        self.client = APIClient(raise_request_exception=False)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.get_or_create(user=user)[0].key)
+        self.rng = random.Random('session{}_{}'.format(seed, number))
+        self.beer_ids = beer_ids
+        self.reviews = list(BeerReview.objects.filter(review_user=user).order_by('id').values_list('id', 'review_beer'))
+        reviewed = {beer_id for _, beer_id in self.reviews}
+        # beer_review_post needs a beer not reviewed yet for every request
+        self.unreviewed = [beer_id for beer_id in beer_ids if beer_id not in reviewed]
+        self.rng.shuffle(self.unreviewed)
+        self.sequence = 0
+
+    def next_number(self):
+        self.sequence += 1
+        return self.sequence
+
+    def review(self):
+        return self.rng.choice(self.reviews)
+
+
+def _put_data(session):
+    review_id, beer_id = session.review()
+    return dict(REVIEW, id=review_id, review_beer=beer_id)
+
+
+def _import_body(session):
+    rows = [dict(REVIEW, review_user=session.user.id, review_beer=beer_id)
+            for _, beer_id in session.rng.sample(session.reviews, min(IMPORT_ROWS, len(session.reviews)))]
+    return '\n'.join(json.dumps(row) for row in rows)
+
+
+# route of beer_app.urls -> function of session returning (client method, path, request kwargs)
+SCENARIOS = {
+    'beer': lambda session: ('get', '/beer', {}),
+    'beer/<int:pk>': lambda session: ('get', '/beer/{}'.format(session.rng.choice(session.beer_ids)), {}),
+    'beer/<int:pk>/review': lambda session: (
+        'put', '/beer/{}/review'.format(session.review()[1]), {'data': REVIEW, 'format': 'json'}),
+    'beer_rates': lambda session: ('get', '/beer_rates', {}),
+    'beer_review': lambda session: ('get', '/beer_review', {}),
+    'beer_review_put': lambda session: ('put', '/beer_review_put', {'data': _put_data(session), 'format': 'json'}),
+    'beer_review_post': lambda session: (
+        'post', '/beer_review_post', {'data': dict(REVIEW, review_beer=session.unreviewed.pop()), 'format': 'json'}),
+    'beer_review/<int:pk>': lambda session: ('get', '/beer_review/{}'.format(session.review()[0]), {}),
+    'beer_review_import': lambda session: (
+        'post', '/beer_review_import', {'data': _import_body(session), 'content_type': 'application/x-ndjson'}),
+    'beer_review_export': lambda session: ('get', '/beer_review_export', {}),
+    'beer_recs': lambda session: ('get', '/beer_recs', {}),
+    'beer_recs/rerank': lambda session: ('get', '/beer_recs/rerank?max_per_brewery=2&diversity=0.3', {}),
+    'onboarding': lambda session: ('get', '/onboarding', {}),
+    'trending': lambda session: ('get', '/trending', {}),
+    'async/beer': lambda session: ('get', '/async/beer', {}),
+    'async/beer/<int:pk>': lambda session: ('get', '/async/beer/{}'.format(session.rng.choice(session.beer_ids)), {}),
+    'async/beer_review': lambda session: ('get', '/async/beer_review', {}),
+    'async/beer_recs': lambda session: ('get', '/async/beer_recs', {}),
+    'registration': lambda session: (
+        'post', '/registration', {'data': {'email': 'benchmark_{}_{}@example.com'.format(session.number, session.next_number()),
+                                           'password': PASSWORD}, 'format': 'json'}),
+    'api-token-auth': lambda session: (
+        'post', '/api-token-auth', {'data': {'username': session.user.username, 'password': PASSWORD}, 'format': 'json'}),
+    'metrics': lambda session: ('get', '/metrics', {}),
+}
+
+
+def routes(urlpatterns):
+    """ Routes declared with path(), without format suffix variants """
+    return [str(pattern.pattern) for pattern in urlpatterns
+            if isinstance(pattern.pattern, RoutePattern) and 'format' not in pattern.pattern.converters]
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.queries += 1
+
+
+def measure(scenario, sessions, requests):
+    """
+    Run requests of scenario from one thread per session.
+    Returns throughput, latency percentiles in milliseconds and queries per request.
+    """
+    latencies = []
+    queries = []
+    query_seconds = []
+    errors = []
+    failures = []
+    lock = threading.Lock()
+    remaining = [requests]
+    # clock starts once every thread has connected to database
+    ready = threading.Barrier(len(sessions) + 1)
+
+    def take():
+        with lock:
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+            return True
+
+    def worker(session):
+        counter = QueryCounter()
+        local_latencies = []
+        local_queries = []
+        local_query_seconds = []
+        local_errors = 0
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    connection.ensure_connection()
+                    stack.enter_context(connection.execute_wrapper(counter))
+                ready.wait()
+                while take():
+                    method, path, kwargs = scenario(session)
+                    counter.queries = 0
+                    counter.seconds = 0.0
+                    start = time.perf_counter()
+                    response = getattr(session.client, method)(path, **kwargs)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    local_latencies.append(time.perf_counter() - start)
+                    local_queries.append(counter.queries)
+                    local_query_seconds.append(counter.seconds)
+                    if response.status_code >= 400:
+                        local_errors += 1
+        except Exception as error:
+            ready.abort()
+            with lock:
+                failures.append(error)
+        finally:
+            connections.close_all()
+        with lock:
+            latencies.extend(local_latencies)
+            queries.extend(local_queries)
+            query_seconds.extend(local_query_seconds)
+            errors.append(local_errors)
+
+    threads = [threading.Thread(target=worker, args=(session,)) for session in sessions]
+    for thread in threads:
+        thread.start()
+    try:
+        ready.wait()
+    except threading.BrokenBarrierError:
+        pass
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    if failures:
+        # other threads fail on aborted barrier
+        raise next((error for error in failures if not isinstance(error, threading.BrokenBarrierError)), failures[0])
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'seconds': round(seconds, 3),
+        'requests_per_second': round(len(latencies) / seconds, 1) if seconds else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else 0.0,
+        'max_queries': max(queries, default=0),
+        'query_ms_per_request': round(sum(query_seconds) * 1000 / len(query_seconds), 2) if query_seconds else 0.0,
+    }
@@ -0,0 +1,105 @@
+import csv
+import json
+import timeit
+from itertools import islice
+from django.contrib.auth.models import User
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+from beer_app.models import Beer, BeerReview
+from beer_app.serializers import BeerReviewImportSerializer
+
+
+DEFAULT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+
+def read_ndjson(lines):
+    """
+    Yield (line number, row) pairs from newline delimited JSON lines.
+    """
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError:
+            yield line_number, None
+
+
+def read_csv(lines):
+    """
+    Yield (line number, row) pairs from CSV lines with header.
+    """
+    reader = csv.DictReader(lines)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def _existing_ids(model, ids):
+    return set(model.objects.filter(pk__in=ids).values_list('pk', flat=True))
+
+
+def _validate_batch(batch, errors):
+    serializer = BeerReviewImportSerializer()
+    valid = []
+    for line_number, row in batch:
+        if not isinstance(row, dict):
+            errors.append({'line': line_number, 'errors': {'non_field_errors': ['Invalid row.']}})
+            continue
+        try:
+            valid.append((line_number, serializer.run_validation(row)))
+        except ValidationError as error:
+            errors.append({'line': line_number, 'errors': error.detail})
+
+    # foreign keys are checked with one query per model for the whole batch
+    users = _existing_ids(User, {review['review_user'] for _, review in valid})
+    beers = _existing_ids(Beer, {review['review_beer'] for _, review in valid})
+    reviews = []
+    for line_number, review in valid:
+        row_errors = {}
+        if review['review_user'] not in users:
+            row_errors['review_user'] = ['Invalid pk "{}" - object does not exist.'.format(review['review_user'])]
+        if review['review_beer'] not in beers:
+            row_errors['review_beer'] = ['Invalid pk "{}" - object does not exist.'.format(review['review_beer'])]
+        if row_errors:
+            errors.append({'line': line_number, 'errors': row_errors})
+        else:
+            reviews.append(review)
+    return reviews
+
+
+def import_reviews(rows, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Validate and upsert (line number, row) pairs batch by batch.
+    Every batch is written with one statement in its own transaction.
+    """
+    start = timeit.default_timer()
+    imported = created = rejected = received = 0
+    errors = []
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        batch_errors = []
+        reviews = _validate_batch(batch, batch_errors)
+        batch_errors.sort(key=lambda error: error['line'])
+        with transaction.atomic():
+            batch_created, batch_written = BeerReview.objects.bulk_upsert(reviews)
+        # duplicates of a user and beer in batch are written once
+        created += batch_created
+        imported += batch_written
+        received += len(batch)
+        rejected += len(batch_errors)
+        errors.extend(batch_errors[:MAX_REPORTED_ERRORS - len(errors)])
+    seconds = timeit.default_timer() - start
+    return {
+        'imported': imported,
+        'created': created,
+        'updated': imported - created,
+        'rejected': rejected,
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(received / seconds, 1) if seconds else None,
+    }
@@ -0,0 +1,127 @@
+import atexit
+import logging
+import os
+import threading
+from collections import deque
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from beer_app.models import RecommendationEvent
+
+# Recommendation exposure log. Request path only appends tuples to an in-memory buffer,
+# a daemon thread of each worker process inserts them with bulk_create every FLUSH_SECONDS
+# or as soon as BATCH_SIZE events are waiting (settings.RECOMMENDATION_LOG).
+# Buffer is bounded by MAX_BUFFER, oldest events are dropped when database can't keep up.
+
+logger = logging.getLogger(__name__)
+
+
+class EventLog:
+
+    def __init__(self, flush_seconds=2.0, batch_size=1000, max_buffer=100000, background=True):
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.background = background
+        # (user id, beer id, event, source, position, created)
+        self.buffer = deque(maxlen=max_buffer)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.written = 0
+        self.dropped = 0
+        self._thread = None
+        self._pid = None
+
+    def add(self, events):
+        with self.lock:
+            self.dropped += max(len(self.buffer) + len(events) - self.buffer.maxlen, 0)
+            self.buffer.extend(events)
+            waiting = len(self.buffer)
+        if self.background:
+            self._ensure_thread()
+            if waiting >= self.batch_size:
+                self.wakeup.set()
+
+    def flush(self):
+        """
+        Write buffered events, returns number of written events.
+        """
+        with self.lock:
+            events = list(self.buffer)
+            self.buffer.clear()
+        if not events:
+            return 0
+        try:
+            RecommendationEvent.objects.bulk_create(
+                [RecommendationEvent(user_id=user_id, beer_id=beer_id, event=event, source=source,
+                                     position=position, created=created)
+                 for user_id, beer_id, event, source, position, created in events],
+                batch_size=self.batch_size)
+        except Exception:
+            logger.exception('Dropped %d recommendation events', len(events))
+            with self.lock:
+                self.dropped += len(events)
+            return 0
+        with self.lock:
+            self.written += len(events)
+        return len(events)
+
+    def clear(self):
+        with self.lock:
+            self.buffer.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'buffered': len(self.buffer), 'written': self.written, 'dropped': self.dropped}
+
+    def _ensure_thread(self):
+        # thread of parent process doesn't exist in forked worker
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self.lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='recommendation-event-log', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.flush_seconds)
+            self.wakeup.clear()
+            self.flush()
+            # connection of this thread follows CONN_MAX_AGE like request threads
+            close_old_connections()
+
+
+_event_log = None
+_event_log_lock = threading.Lock()
+
+
+def get_event_log():
+    global _event_log
+    if _event_log is None:
+        with _event_log_lock:
+            if _event_log is None:
+                options = settings.RECOMMENDATION_LOG
+                _event_log = EventLog(flush_seconds=options['FLUSH_SECONDS'], batch_size=options['BATCH_SIZE'],
+                                      max_buffer=options['MAX_BUFFER'], background=options['BACKGROUND'])
+                # events of last interval are written on clean shutdown
+                atexit.register(_event_log.flush)
+    return _event_log
+
+
+def log_impressions(user, source, beer_ids):
+    """
+    Record beer_ids served to user by source endpoint, in served order.
+    """
+    if not settings.RECOMMENDATION_LOG['ENABLED'] or not beer_ids:
+        return
+    created = timezone.now()
+    get_event_log().add([(user.pk, beer_id, RecommendationEvent.IMPRESSION, source, position, created)
+                         for position, beer_id in enumerate(beer_ids, 1)])
+
+
+def log_review(user, beer_id):
+    if not settings.RECOMMENDATION_LOG['ENABLED']:
+        return
+    get_event_log().add([(user.pk, beer_id, RecommendationEvent.REVIEW, '', None, timezone.now())])
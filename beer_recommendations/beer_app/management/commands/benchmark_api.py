@@ -0,0 +1,107 @@
+import json
+import random
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Max
+from django.test.utils import setup_databases, teardown_databases, setup_test_environment, teardown_test_environment
+from rest_framework.throttling import ScopedRateThrottle
+from beer_app import urls
+from beer_app.benchmark import SCENARIOS, Session, measure, routes
+from beer_app.event_log import get_event_log
+from beer_app.models import BeerCandidates, BeerReview
+from beer_app.popularity import build_popularity
+from beer_app.rerank import pack, reset_catalog
+from beer_app.synthetic import MAX_USER_SHARE, load_dataset
+from beer_app.trending import refresh
+
+
+class Command(BaseCommand):
+    help = ('Benchmark every API route against a synthetic dataset in a test database: throughput, '
+            'latency percentiles and queries per request, e.g. --reviews 1000000 --concurrency 16 --output bench.json')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='synthetic users')
+        parser.add_argument('--beers', type=int, default=5000, help='synthetic beers')
+        parser.add_argument('--reviews', type=int, default=100000, help='synthetic reviews')
+        parser.add_argument('--seed', type=int, default=0, help='dataset and request sequence seed')
+        parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients, one user each')
+        parser.add_argument('--requests', type=int, default=200, help='measured requests per route')
+        parser.add_argument('--warmup', type=int, default=20, help='requests per route not measured')
+        parser.add_argument('--route', action='append', help='benchmark only this route of beer_app.urls, can be repeated')
+        parser.add_argument('--output', help='write JSON report to this file')
+
+    def handle(self, *args, **options):
+        all_routes = routes(urls.urlpatterns)
+        selected = options['route'] or [route for route in all_routes if route in SCENARIOS]
+        unknown = [route for route in selected if route not in SCENARIOS]
+        if unknown:
+            raise CommandError('No benchmark scenario for route(s): {}'.format(', '.join(unknown)))
+        if options['concurrency'] < 1 or options['requests'] < 1 or options['warmup'] < 0:
+            raise CommandError('--concurrency and --requests must be positive, --warmup must not be negative')
+        if options['users'] < options['concurrency'] or options['beers'] < 10 or options['reviews'] < options['users'] \
+                or options['reviews'] > options['users'] * int(options['beers'] * MAX_USER_SHARE):
+            raise CommandError('Dataset needs at least --concurrency users, 10 beers and a review per user, '
+                               'users can review at most {:.0%} of beers'.format(MAX_USER_SHARE))
+
+        report = {
+            'dataset': {key: options[key] for key in ['users', 'beers', 'reviews', 'seed']},
+            'concurrency': options['concurrency'],
+            'requests': options['requests'],
+            'endpoints': {},
+            # routes a scenario has to be written for
+            'skipped': [route for route in all_routes if route not in SCENARIOS],
+        }
+        # events are written between routes by this thread, background writer connection
+        # would outlive test database
+        settings.RECOMMENDATION_LOG['BACKGROUND'] = False
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            sessions = self.prepare(options)
+            # throttling is kept in request path but must not reject benchmark requests
+            rates = {scope: '1000000/s' for scope in ScopedRateThrottle.THROTTLE_RATES}
+            with mock.patch.object(ScopedRateThrottle, 'THROTTLE_RATES', rates):
+                self.stdout.write('{:<24}{:>10}{:>8}{:>10}{:>10}{:>10}{:>10}'.format(
+                    'route', 'req/s', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'))
+                for route in selected:
+                    if options['warmup']:
+                        measure(SCENARIOS[route], sessions, options['warmup'])
+                    result = measure(SCENARIOS[route], sessions, options['requests'])
+                    get_event_log().flush()
+                    report['endpoints'][route] = result
+                    self.stdout.write('{:<24}{:>10.1f}{:>8}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}'.format(
+                        route, result['requests_per_second'], result['errors'], result['p50_ms'],
+                        result['p95_ms'], result['p99_ms'], result['queries_per_request']))
+        finally:
+            connection.close()
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                json.dump(report, report_file, indent=2, sort_keys=True)
+            self.stdout.write('Report written to {}'.format(options['output']))
+
+    def prepare(self, options):
+        """ Load synthetic dataset and derived tables, returns one session per client thread """
+        user_ids, beer_ids = load_dataset(connection, options['users'], options['beers'], options['reviews'],
+                                          options['seed'])
+        build_popularity()
+        newest = BeerReview.objects.aggregate(newest=Max('review_time'))['newest']
+        refresh(now=newest.timestamp() + 1)
+        reset_catalog()
+
+        users = list(User.objects.filter(id__in=user_ids[:options['concurrency']]).order_by('id'))
+        # beer_review_import is allowed to admins only
+        User.objects.filter(id__in=[user.id for user in users]).update(is_staff=True)
+        rng = random.Random('candidates{}'.format(options['seed']))
+        candidates = []
+        for user in users:
+            candidate_ids = rng.sample(beer_ids, min(100, len(beer_ids)))
+            scores = sorted((rng.uniform(1.0, 5.0) for _ in candidate_ids), reverse=True)
+            candidates.append(BeerCandidates(user=user, beer_ids=pack(candidate_ids, 'i'), scores=pack(scores, 'f')))
+        BeerCandidates.objects.bulk_create(candidates)
+        return [Session(number, user, beer_ids, options['seed']) for number, user in enumerate(users)]
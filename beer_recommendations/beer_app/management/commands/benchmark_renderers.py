@@ -0,0 +1,55 @@
+import gzip
+import timeit
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from beer_app import renderers, views
+from beer_app.middleware import brotli
+
+
+class Command(BaseCommand):
+    help = 'Compare renderers and compression on /beer and /beer_review payloads'
+
+    endpoints = {
+        'beer': views.BeerList,
+        'beer_review': views.BeerReviewList,
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='rows in rendered payload')
+        parser.add_argument('--repeat', type=int, default=5, help='runs per renderer, best is reported')
+        parser.add_argument('--username', default='stcules', help='user whose reviews are rendered')
+
+    def get_renderers(self):
+        result = [('rest_framework JSONRenderer', JSONRenderer())]
+        if renderers.orjson is not None:
+            result.append(('ORJSONRenderer', renderers.ORJSONRenderer()))
+        if renderers.msgpack is not None:
+            result.append(('MessagePackRenderer', renderers.MessagePackRenderer()))
+        return result
+
+    def get_payload(self, view_class, user, rows):
+        view = view_class()
+        request = Request(RequestFactory().get('/', SERVER_NAME='localhost'))
+        request.user = user
+        view.request = request
+        view.format_kwarg = None
+        serializer = view.values_serializer_class(context=view.get_serializer_context())
+        queryset = view.get_queryset().values_list(*serializer.values_fields())[:rows]
+        # same envelope as paginated responses
+        return {'count': rows, 'next': None, 'previous': None, 'results': serializer.serialize(queryset)}
+
+    def handle(self, *args, **options):
+        from django.contrib.auth.models import User
+        user = User.objects.get(username=options['username'])
+        for name, view_class in self.endpoints.items():
+            data = self.get_payload(view_class, user, options['rows'])
+            self.stdout.write('{} ({} rows)'.format(name, len(data['results'])))
+            for label, renderer in self.get_renderers():
+                best = min(timeit.repeat(lambda: renderer.render(data), number=1, repeat=options['repeat']))
+                content = renderer.render(data)
+                sizes = ['{} B'.format(len(content)), 'gzip {} B'.format(len(gzip.compress(content)))]
+                if brotli is not None:
+                    sizes.append('br {} B'.format(len(brotli.compress(content, quality=5))))
+                self.stdout.write('  {:<28}{:>10.2f} ms  {}'.format(label, best * 1000, ', '.join(sizes)))
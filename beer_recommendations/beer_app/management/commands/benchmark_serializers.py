@@ -0,0 +1,48 @@
+import timeit
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from rest_framework.request import Request
+from beer_app import views
+
+
+class Command(BaseCommand):
+    help = 'Compare rows/sec of ModelSerializer and values_list serializers for list endpoints'
+
+    endpoints = {
+        'beer': views.BeerList,
+        'beer_rates': views.BeerRatingList,
+        'beer_review': views.BeerReviewList,
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='rows serialized per run')
+        parser.add_argument('--repeat', type=int, default=5, help='runs per serializer, best is reported')
+        parser.add_argument('--username', default='stcules', help='user whose reviews are serialized')
+
+    def handle(self, *args, **options):
+        from django.contrib.auth.models import User
+        user = User.objects.get(username=options['username'])
+        for name, view_class in self.endpoints.items():
+            view = view_class()
+            request = Request(RequestFactory().get('/' + name, SERVER_NAME='localhost'))
+            request.user = user
+            view.request = request
+            view.format_kwarg = None
+            context = view.get_serializer_context()
+
+            # rows are fetched once, only serialization is measured
+            queryset = view.get_queryset()
+            instances = list(queryset[:options['rows']])
+            values_serializer = view.values_serializer_class(context=context)
+            rows = list(queryset.values_list(*values_serializer.values_fields())[:options['rows']])
+
+            def model_serializer():
+                return view.serializer_class(instances, many=True, context=context).data
+
+            def values_list_serializer():
+                return values_serializer.serialize(rows)
+
+            self.stdout.write('{} ({} rows)'.format(name, len(rows)))
+            for label, run in [('ModelSerializer', model_serializer), ('ValuesListSerializer', values_list_serializer)]:
+                best = min(timeit.repeat(run, number=1, repeat=options['repeat']))
+                self.stdout.write('  {:<22}{:>12.0f} rows/sec'.format(label, len(rows) / best if best else float('inf')))
@@ -0,0 +1,18 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from beer_app.popularity import build_popularity, PRIOR_REVIEWS
+
+
+class Command(BaseCommand):
+    help = 'Rebuild cold start popularity rankings of beers overall, per style and per brewery'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prior-reviews', type=int, default=PRIOR_REVIEWS,
+                            help='reviews of global mean score added to every beer')
+
+    def handle(self, *args, **options):
+        if options['prior_reviews'] < 0:
+            raise CommandError('--prior-reviews must not be negative')
+        start = time.perf_counter()
+        beers = build_popularity(prior_reviews=options['prior_reviews'])
+        self.stdout.write('Ranked {} beers in {:.2f} s'.format(beers, time.perf_counter() - start))
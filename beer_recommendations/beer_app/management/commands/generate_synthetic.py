@@ -0,0 +1,49 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from beer_app.synthetic import BEER_SKEW, USER_SKEW, DatabaseWriter, FileWriter, SyntheticDataset, write_dataset
+
+
+class Command(BaseCommand):
+    help = ('Generate synthetic users, beers, reviews and recommendations with power law activity and popularity, '
+            'COPY them into database or write test_data like CSV files with --output, '
+            'e.g. --users 1000000 --beers 200000 --reviews 300000000 --workers 8')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--beers', type=int, default=50000)
+        parser.add_argument('--reviews', type=int, default=10000000)
+        parser.add_argument('--seed', type=int, default=0, help='same seed and sizes generate same rows')
+        parser.add_argument('--user-skew', type=float, default=USER_SKEW,
+                            help='Zipf exponent of reviews per user, 0 spreads reviews evenly')
+        parser.add_argument('--beer-skew', type=float, default=BEER_SKEW,
+                            help='Zipf exponent of reviews per beer, 0 makes all beers equally popular')
+        parser.add_argument('--workers', type=int, default=1, help='processes generating reviews')
+        parser.add_argument('--output', help='write CSV files to this directory instead of database, '
+                                             'ids are those of empty tables')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be positive')
+        if options['user_skew'] < 0 or options['beer_skew'] < 0:
+            raise CommandError('Skews must not be negative')
+        try:
+            dataset = SyntheticDataset(options['users'], options['beers'], options['reviews'], options['seed'],
+                                       options['user_skew'], options['beer_skew'])
+        except ValueError as error:
+            raise CommandError(error)
+
+        start = time.perf_counter()
+        if options['output']:
+            write_dataset(FileWriter(options['output']), dataset, self.log, options['workers'])
+        else:
+            # usernames contain seed, loading the same seed twice fails on unique username
+            with transaction.atomic(using=options['database']), connections[options['database']].cursor() as cursor:
+                write_dataset(DatabaseWriter(cursor), dataset, self.log, options['workers'])
+                cursor.execute('ANALYZE')
+        self.stdout.write('Generated {} users, {} beers and {} reviews in {:.1f} s'.format(
+            dataset.users, dataset.beers, dataset.reviews, time.perf_counter() - start))
+
+    def log(self, table, rows, seconds):
+        self.stdout.write('{:<28}{:>12} rows{:>10.1f} s'.format(table, rows, seconds))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from beer_app.media import make_thumbnail, thumbnail_name
+from beer_app.models import Beer
+
+
+class Command(BaseCommand):
+    help = 'Generate list thumbnails for beers uploaded before thumbnails existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='regenerate existing thumbnails')
+
+    def handle(self, *args, **options):
+        queryset = Beer.objects.exclude(beer_image='')
+        if not options['force']:
+            queryset = queryset.filter(Q(beer_thumbnail__isnull=True) | Q(beer_thumbnail=''))
+        # default image is shared by many beers, so every distinct image is resized once
+        names = queryset.order_by().values_list('beer_image', flat=True).distinct()
+        storage = Beer._meta.get_field('beer_image').storage
+        thumbnail_field = Beer._meta.get_field('beer_thumbnail')
+        generated = 0
+        for name in names.iterator():
+            if not storage.exists(name):
+                self.stderr.write('Missing image {}'.format(name))
+                continue
+            with storage.open(name, 'rb') as image_file:
+                thumbnail = thumbnail_field.storage.save(
+                    thumbnail_field.generate_filename(None, thumbnail_name(name)), make_thumbnail(image_file))
+            queryset.filter(beer_image=name).update(beer_thumbnail=thumbnail)
+            generated += 1
+        self.stdout.write('Generated {} thumbnails'.format(generated))
@@ -0,0 +1,38 @@
+import json
+import os
+from django.core.management.base import BaseCommand, CommandError
+from beer_app.bulk_import import import_reviews, read_csv, read_ndjson, DEFAULT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Bulk import beer reviews from CSV or NDJSON file'
+
+    readers = {
+        'csv': read_csv,
+        'ndjson': read_ndjson,
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=sorted(self.readers), default=None,
+                            help='input format, guessed from file extension by default')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format']
+        if file_format is None:
+            extension = os.path.splitext(path)[1].lower().lstrip('.')
+            file_format = 'ndjson' if extension in ('ndjson', 'jsonl') else extension
+        if file_format not in self.readers:
+            raise CommandError('Unknown input format "{}", use --format'.format(file_format))
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        with open(path, newline='', encoding='utf-8') as f:
+            result = import_reviews(self.readers[file_format](f), batch_size=options['batch_size'])
+
+        for error in result['errors']:
+            self.stderr.write('line {}: {}'.format(error['line'], json.dumps(error['errors'])))
+        self.stdout.write('Imported {imported} reviews ({created} created, {updated} updated), '
+                          'rejected {rejected} rows in {seconds} s, {rows_per_second} rows/sec'.format(**result))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from beer_app.loadtest import run_load
+
+
+class Command(BaseCommand):
+    help = ('Load test running servers at fixed concurrency, e.g. compare WSGI and ASGI deployments: '
+            '--target wsgi=http://127.0.0.1:8000/beer --target asgi=http://127.0.0.1:8001/async/beer')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', action='append', required=True, help='name=url, can be repeated')
+        parser.add_argument('--token', help='auth token sent as "Authorization: Token <token>"')
+        parser.add_argument('--concurrency', type=int, default=50, help='concurrent clients')
+        parser.add_argument('--requests', type=int, default=1000, help='requests per target')
+        parser.add_argument('--warmup', type=int, default=50, help='requests per target not measured')
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options['target']:
+            name, sep, url = target.partition('=')
+            if not sep or not url:
+                raise CommandError('Target must be name=url, got "{}".'.format(target))
+            targets.append((name, url))
+        headers = {}
+        if options['token']:
+            headers['Authorization'] = 'Token {}'.format(options['token'])
+
+        self.stdout.write('{:<12}{:>10}{:>8}{:>10}{:>10}{:>10}'.format('target', 'req/s', 'errors', 'p50 ms', 'p95 ms', 'p99 ms'))
+        for name, url in targets:
+            if options['warmup']:
+                run_load(url, options['warmup'], min(options['concurrency'], options['warmup']), headers)
+            result = run_load(url, options['requests'], options['concurrency'], headers)
+            self.stdout.write('{:<12}{:>10.1f}{:>8}{:>10.2f}{:>10.2f}{:>10.2f}'.format(
+                name, result['requests_per_second'], result['errors'],
+                result['p50_ms'], result['p95_ms'], result['p99_ms']))
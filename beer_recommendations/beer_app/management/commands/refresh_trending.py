@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from beer_app.trending import refresh
+
+
+class Command(BaseCommand):
+    help = 'Count reviews since previous run into trending window and store ranked trending beers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='keep running and refresh every this many seconds, 0 refreshes once')
+
+    def handle(self, *args, **options):
+        if options['interval'] < 0:
+            raise CommandError('--interval must not be negative')
+        while True:
+            start = time.perf_counter()
+            added = refresh()
+            self.stdout.write('Counted {} new reviews in {:.2f} s'.format(added, time.perf_counter() - start))
+            if not options['interval']:
+                return
+            close_old_connections()
+            time.sleep(options['interval'])
@@ -0,0 +1,48 @@
+import os
+from io import BytesIO
+from PIL import Image
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.utils.encoding import filepath_to_uri
+
+
+def media_base_url(request=None):
+    """
+    Absolute base for media urls: MEDIA_BASE_URL setting (e.g. CDN) if configured,
+    otherwise built from request once and cached on it.
+    """
+    if settings.MEDIA_BASE_URL:
+        return settings.MEDIA_BASE_URL
+    if request is None:
+        return settings.MEDIA_URL
+    base_url = getattr(request, '_media_base_url', None)
+    if base_url is None:
+        base_url = request.build_absolute_uri(settings.MEDIA_URL)
+        request._media_base_url = base_url
+    return base_url
+
+
+def media_url(name, request=None):
+    return media_base_url(request) + filepath_to_uri(name)
+
+
+def thumbnail_name(name):
+    base_name = os.path.splitext(os.path.basename(name))[0]
+    return '{}_thumbnail.jpg'.format(base_name)
+
+
+def make_thumbnail(image_file, size=None):
+    """
+    Resize image to fit BEER_THUMBNAIL_SIZE keeping aspect ratio, returns JPEG content.
+    """
+    size = size or settings.BEER_THUMBNAIL_SIZE
+    image_file.seek(0)
+    image = Image.open(image_file)
+    image.thumbnail(size)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    content = BytesIO()
+    image.save(content, format='JPEG', quality=85, optimize=True)
+    # original file is saved right after thumbnail
+    image_file.seek(0)
+    return ContentFile(content.getvalue())
@@ -0,0 +1,210 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from rest_framework.authentication import TokenAuthentication
+
+# Request metrics of this process in Prometheus text format. MetricsMiddleware splits every
+# request into exclusive phases, time of a phase stops while a nested one runs:
+#   middleware     request processing of middlewares before the view
+#   auth           token authentication
+#   db             SQL statements on any database alias (connection.execute_wrapper)
+#   serialization  view code besides auth and queries, mostly serializers
+#   render         response rendering and response middlewares (compression)
+# Content of streaming responses is produced after the request is measured.
+# Each thread counts into its own shard without locks, /metrics merges the shards.
+# Every worker process has its own metrics, a scrape sees the worker which answered it.
+
+PHASES = ['middleware', 'auth', 'db', 'serialization', 'render']
+
+
+class PhaseTimer:
+    """
+    Wall time of a request by exclusive phase, switch() closes the running phase.
+    """
+
+    def __init__(self, phase='middleware'):
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.phase = phase
+        self.queries = 0
+        self.started = self.mark = time.perf_counter()
+
+    def switch(self, phase):
+        now = time.perf_counter()
+        self.phases[self.phase] += now - self.mark
+        self.phase = phase
+        self.mark = now
+        return now
+
+    @contextmanager
+    def measure(self, phase):
+        previous = self.phase
+        self.switch(phase)
+        try:
+            yield
+        finally:
+            self.switch(previous)
+
+    def __call__(self, execute, sql, params, many, context):
+        # execute_wrapper of every database alias
+        self.queries += 1
+        with self.measure('db'):
+            return execute(sql, params, many, context)
+
+    def stop(self):
+        return self.switch(self.phase) - self.started
+
+
+@contextmanager
+def request_phase(request, phase):
+    """ Count block into phase of request measured by MetricsMiddleware, if any """
+    timer = getattr(request, 'metrics_timer', None)
+    if timer is None:
+        yield
+    else:
+        with timer.measure(phase):
+            yield
+
+
+class Histogram:
+    __slots__ = ['counts', 'sum']
+
+    def __init__(self, buckets):
+        # last count is of values above all buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, buckets, value):
+        self.counts[bisect_left(buckets, value)] += 1
+        self.sum += value
+
+
+class Shard:
+    """ Metrics counted by one thread, only that thread writes them """
+
+    def __init__(self):
+        # (view, method, status) -> requests
+        self.requests = {}
+        # (view, phase) -> Histogram
+        self.durations = {}
+        # view -> statements
+        self.queries = {}
+
+
+class MetricsRegistry:
+
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self.shards = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = self.local.shard = Shard()
+            # shards of finished threads are kept, counters never go back
+            with self.lock:
+                self.shards.append(shard)
+        return shard
+
+    def observe(self, view, method, status, timer, total):
+        shard = self.shard()
+        key = (view, method, status)
+        shard.requests[key] = shard.requests.get(key, 0) + 1
+        shard.queries[view] = shard.queries.get(view, 0) + timer.queries
+        for phase, seconds in [('total', total)] + list(timer.phases.items()):
+            histogram = shard.durations.get((view, phase))
+            if histogram is None:
+                histogram = shard.durations[(view, phase)] = Histogram(self.buckets)
+            histogram.observe(self.buckets, seconds)
+
+    def collect(self):
+        """ Shards merged into (requests, durations as (counts, sum), queries) """
+        requests = {}
+        durations = {}
+        queries = {}
+        with self.lock:
+            shards = list(self.shards)
+        for shard in shards:
+            # copies are taken in one step, owner threads may add keys meanwhile
+            for key, count in list(shard.requests.items()):
+                requests[key] = requests.get(key, 0) + count
+            for key, count in list(shard.queries.items()):
+                queries[key] = queries.get(key, 0) + count
+            for key, histogram in list(shard.durations.items()):
+                counts, total = durations.get(key, ([0] * len(histogram.counts), 0.0))
+                durations[key] = ([a + b for a, b in zip(counts, histogram.counts)], total + histogram.sum)
+        return requests, durations, queries
+
+    def render(self):
+        requests, durations, queries = self.collect()
+        lines = [
+            '# HELP beer_requests_total Requests by view route, method and status.',
+            '# TYPE beer_requests_total counter',
+        ]
+        for (view, method, status), count in sorted(requests.items()):
+            lines.append('beer_requests_total{{view="{}",method="{}",status="{}"}} {}'.format(
+                escape(view), method, status, count))
+        lines += [
+            '# HELP beer_db_queries_total SQL statements by view route.',
+            '# TYPE beer_db_queries_total counter',
+        ]
+        for view, count in sorted(queries.items()):
+            lines.append('beer_db_queries_total{{view="{}"}} {}'.format(escape(view), count))
+        lines += [
+            '# HELP beer_request_duration_seconds Request time by view route and phase, phases add up to total.',
+            '# TYPE beer_request_duration_seconds histogram',
+        ]
+        bounds = ['{:g}'.format(bound) for bound in self.buckets] + ['+Inf']
+        for (view, phase), (counts, total) in sorted(durations.items()):
+            labels = 'view="{}",phase="{}"'.format(escape(view), phase)
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append('beer_request_duration_seconds_bucket{{{},le="{}"}} {}'.format(labels, bound, cumulative))
+            lines.append('beer_request_duration_seconds_sum{{{}}} {:.6f}'.format(labels, total))
+            lines.append('beer_request_duration_seconds_count{{{}}} {}'.format(labels, cumulative))
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = MetricsRegistry(settings.REQUEST_METRICS['BUCKETS'])
+    return _registry
+
+
+def reset_registry():
+    global _registry
+    with _registry_lock:
+        _registry = None
+
+
+class TimedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication counted into auth phase of request metrics.
+    """
+
+    def authenticate(self, request):
+        with request_phase(request._request, 'auth'):
+            return super().authenticate(request)
+
+
+def metrics_view(request):
+    allowed_ips = settings.REQUEST_METRICS['ALLOWED_IPS']
+    if allowed_ips and request.META.get('REMOTE_ADDR') not in allowed_ips:
+        return HttpResponseForbidden()
+    return HttpResponse(get_registry().render(), content_type='text/plain; version=0.0.4; charset=utf-8')
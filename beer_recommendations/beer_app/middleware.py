@@ -0,0 +1,98 @@
+import re
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from beer_app.metrics import PhaseTimer, get_registry
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+re_accepts_brotli = re.compile(r'\bbr\b')
+# other methods are labelled OTHER, clients can't create new metric series
+METRICS_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+class BrotliMiddleware(MiddlewareMixin):
+    """
+    Compress responses with brotli for clients that accept it. Must be placed
+    after GZipMiddleware, which then leaves already encoded responses untouched.
+    Disabled if brotli package is not installed.
+    """
+    min_length = 200
+
+    def __init__(self, get_response):
+        if brotli is None:
+            raise MiddlewareNotUsed('brotli is not installed')
+        super().__init__(get_response)
+
+    def process_response(self, request, response):
+        # streaming responses are left to GZipMiddleware
+        if response.streaming or len(response.content) < self.min_length:
+            return response
+        if response.has_header('Content-Encoding'):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        if not re_accepts_brotli.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            return response
+
+        compressed_content = brotli.compress(response.content, quality=settings.BROTLI_QUALITY)
+        if len(compressed_content) >= len(response.content):
+            return response
+        response.content = compressed_content
+        response['Content-Length'] = str(len(response.content))
+
+        # same ETag handling as GZipMiddleware, content changed so strong ETag is weakened
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = 'br'
+        return response
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    """
+    Time requests by phase (see beer_app.metrics) into histograms per view route.
+    Must be first in MIDDLEWARE, so every other middleware is measured.
+    Disabled if settings.REQUEST_METRICS['ENABLED'] is false.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_METRICS['ENABLED']:
+            raise MiddlewareNotUsed('request metrics are disabled')
+        super().__init__(get_response)
+
+    def process_request(self, request):
+        request.metrics_timer = timer = PhaseTimer()
+        # statements are counted on connections of the thread running the request,
+        # under ASGI that is the thread of its synchronous parts, async ORM included
+        request.metrics_queries = stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timer))
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_timer.switch('serialization')
+
+    def process_template_response(self, request, response):
+        # rest_framework responses are rendered after this
+        request.metrics_timer.switch('render')
+        return response
+
+    def process_response(self, request, response):
+        timer = getattr(request, 'metrics_timer', None)
+        if timer is None:
+            return response
+        request.metrics_queries.close()
+        total = timer.stop()
+        match = request.resolver_match
+        view = match.route if match is not None else 'unmatched'
+        method = request.method if request.method in METRICS_METHODS else 'OTHER'
+        get_registry().observe(view, method, response.status_code, timer, total)
+        return response
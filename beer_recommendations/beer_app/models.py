@@ -1,5 +1,7 @@
-from django.db import models
+from django.db import models, connections, router
 from django.contrib.auth.models import User
+from django.utils import timezone
+from beer_app.media import make_thumbnail, thumbnail_name
 
 
 class Beer(models.Model):
@@ -8,6 +10,70 @@ class Beer(models.Model):
     brewery_name = models.CharField(max_length=100)
     beer_abv = models.DecimalField(max_digits=5, decimal_places=2)
     beer_image = models.ImageField(upload_to='beer', default='images.jpg', max_length=254)
+    # smaller variant of beer_image used by list endpoints
+    beer_thumbnail = models.ImageField(upload_to='beer/thumbnails', null=True, blank=True, max_length=254, editable=False)
+
+    def save(self, *args, **kwargs):
+        # new image is uploaded, generate thumbnail once instead of resizing on every request
+        if self.beer_image and not self.beer_image._committed:
+            self.beer_thumbnail.save(thumbnail_name(self.beer_image.name), make_thumbnail(self.beer_image), save=False)
+        super().save(*args, **kwargs)
+
+class BeerReviewManager(models.Manager):
+    UPSERT_FIELDS = ['review_overall', 'review_aroma', 'review_appearance', 'review_palate', 'review_taste']
+
+    def _upsert_rows(self, rows):
+        """
+        Insert rows of (review_user_id, review_beer_id, review_time, *UPSERT_FIELDS)
+        replacing existing reviews of the same user and beer.
+        Returns list of (id, created) in rows order.
+        """
+        columns = ', '.join(self.UPSERT_FIELDS)
+        placeholders = '({})'.format(', '.join(['%s'] * (len(self.UPSERT_FIELDS) + 3)))
+        updates = ', '.join('{0} = EXCLUDED.{0}'.format(field) for field in ['review_time'] + self.UPSERT_FIELDS)
+        request = """
+                  INSERT INTO {table} (review_user_id, review_beer_id, review_time, {columns})
+                  VALUES {values}
+                  ON CONFLICT ON CONSTRAINT unique_user_beer_review
+                  DO UPDATE SET {updates}
+                  RETURNING id, (xmax = 0) AS created;
+                  """.format(table=self.model._meta.db_table, columns=columns,
+                             values=', '.join([placeholders] * len(rows)), updates=updates)
+        params = [value for row in rows for value in row]
+        with connections[router.db_for_write(self.model)].cursor() as cursor:
+            cursor.execute(request, params)
+            return cursor.fetchall()
+
+    def upsert(self, review_user, review_beer, **values):
+        """
+        Create or update review of review_beer by review_user in one statement.
+        Returned review has extra `created` attribute.
+        """
+        review_time = timezone.now()
+        row = [review_user.pk, review_beer, review_time] + [values[field] for field in self.UPSERT_FIELDS]
+        [(review_id, created)] = self._upsert_rows([row])
+        review = self.model(id=review_id, review_user=review_user, review_beer_id=review_beer,
+                            review_time=review_time, **values)
+        review.created = created
+        return review
+
+    def bulk_upsert(self, reviews):
+        """
+        Create or update many reviews (dicts with review_user and review_beer ids)
+        with one statement. Later duplicates of the same user and beer win.
+        Returns (created, written) numbers of reviews, duplicates are written once.
+        """
+        review_time = timezone.now()
+        rows = {}
+        for review in reviews:
+            key = (review['review_user'], review['review_beer'])
+            rows[key] = [review['review_user'], review['review_beer'], review.get('review_time') or review_time] + \
+                        [review[field] for field in self.UPSERT_FIELDS]
+        if not rows:
+            return 0, 0
+        written = self._upsert_rows(list(rows.values()))
+        return sum(created for _, created in written), len(written)
+
 
 class BeerReview(models.Model):
     review_user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -19,6 +85,22 @@ class BeerReview(models.Model):
     review_palate = models.IntegerField()
     review_taste = models.IntegerField()
 
+    objects = BeerReviewManager()
+
+    class Meta:
+        constraints = [
+            # one review per user and beer, also serves BeerDetail.is_reviewed lookups
+            models.UniqueConstraint(fields=['review_user', 'review_beer'], name='unique_user_beer_review'),
+        ]
+        indexes = [
+            # user review history ordered by time (BeerReviewList, BeerReviewDetail)
+            models.Index(fields=['review_user', '-review_time'], name='beerreview_user_time_idx'),
+            # per beer averages can be computed with index only scans
+            models.Index(fields=['review_beer', 'review_overall'], name='beerreview_beer_overall_idx'),
+            # reviews since last trending refresh
+            models.Index(fields=['review_time'], name='beerreview_time_idx'),
+        ]
+
 class BeerRecommendation(models.Model):
     recommendation_user = models.ForeignKey(User, on_delete=models.CASCADE)
     top1_beer = models.ForeignKey(Beer, related_name='top1_beer', on_delete=models.CASCADE)
@@ -31,3 +113,87 @@ class BeerRecommendation(models.Model):
     top8_beer = models.ForeignKey(Beer, related_name='top8_beer', on_delete=models.CASCADE)
     top9_beer = models.ForeignKey(Beer, related_name='top9_beer', on_delete=models.CASCADE)
     top10_beer = models.ForeignKey(Beer, related_name='top10_beer', on_delete=models.CASCADE)
+
+class BeerCandidates(models.Model):
+    """
+    Ranked candidates behind BeerRecommendation, written by cron_job publish stage and
+    re-ranked per request (see beer_app.rerank). Best first, as little-endian arrays.
+    """
+    user = models.OneToOneField(User, primary_key=True, on_delete=models.CASCADE)
+    # int32 beer ids
+    beer_ids = models.BinaryField()
+    # float32 model scores
+    scores = models.BinaryField()
+
+class BeerPopularity(models.Model):
+    """
+    Cold start rankings rebuilt by build_popularity command, see beer_app.popularity.
+    Style and brewery are copied from beer so rankings are read from this table alone.
+    """
+    beer = models.OneToOneField(Beer, primary_key=True, on_delete=models.CASCADE)
+    beer_style = models.CharField(max_length=100)
+    brewery_name = models.CharField(max_length=100)
+    review_count = models.IntegerField()
+    average_rate = models.FloatField()
+    # Bayesian average of review_overall
+    score = models.FloatField()
+    # time of build_popularity run which wrote the row, newest one is version of rankings
+    built = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['built'], name='popularity_built_idx'),
+            models.Index(fields=['beer_style', '-score'], name='popularity_style_score_idx'),
+            models.Index(fields=['brewery_name', '-score'], name='popularity_brewery_score_idx'),
+        ]
+
+class TrendingBeer(models.Model):
+    """
+    Beers of overall and per style trending rankings, rewritten by refresh_trending command,
+    see beer_app.trending. Style and brewery are copied from beer like in BeerPopularity.
+    """
+    beer = models.OneToOneField(Beer, primary_key=True, on_delete=models.CASCADE)
+    beer_style = models.CharField(max_length=100)
+    brewery_name = models.CharField(max_length=100)
+    # reviews in window
+    reviews = models.IntegerField()
+    # reviews weighted by age
+    score = models.FloatField()
+    # time of refresh which wrote the row, newest one is version of rankings
+    refreshed = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['refreshed'], name='trending_refreshed_idx'),
+        ]
+
+class TrendingWindowState(models.Model):
+    """
+    Review counts of trending window kept between refresh_trending runs, single row of TrendingWindow.state().
+    """
+    state = models.JSONField()
+
+class RecommendationEvent(models.Model):
+    """
+    Served recommendations and later reviews, written in batches by beer_app.event_log.
+    """
+    IMPRESSION = 'impression'
+    REVIEW = 'review'
+    EVENT_CHOICES = [(IMPRESSION, 'Impression'), (REVIEW, 'Review')]
+
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    beer = models.ForeignKey(Beer, on_delete=models.CASCADE)
+    event = models.CharField(max_length=10, choices=EVENT_CHOICES)
+    # endpoint which served the impression, empty for reviews
+    source = models.CharField(max_length=20, blank=True)
+    # 1-based position in served list
+    position = models.PositiveSmallIntegerField(null=True)
+    # time of request, not of the batch insert
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'beer'], name='recevent_user_beer_idx'),
+            models.Index(fields=['created'], name='recevent_created_idx'),
+        ]
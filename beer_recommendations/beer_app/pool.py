@@ -0,0 +1,131 @@
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of DB-API connections, one instance per worker process.
+
+    connect() opens a new connection, at most max_size are open at once and acquire()
+    waits up to timeout seconds for a free one. Idle connections are checked with
+    health_check(conn) before reuse if they have been idle for check_interval seconds,
+    connections idle longer than max_idle are closed down to min_size.
+    """
+
+    def __init__(self, connect, min_size=0, max_size=10, timeout=30.0, max_idle=600.0,
+                 check_interval=30.0, health_check=None, clock=time.monotonic):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError('Pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1.')
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check_interval = check_interval
+        self.health_check = health_check
+        self.clock = clock
+        # (connection, released at), most recently released on the right
+        self._idle = deque()
+        self._size = 0
+        self._condition = threading.Condition()
+
+    def fill(self):
+        """
+        Open connections until min_size are available.
+        """
+        while True:
+            with self._condition:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                connection = self.connect()
+            except BaseException:
+                self._discarded()
+                raise
+            with self._condition:
+                self._idle.append((connection, self.clock()))
+                self._condition.notify()
+
+    def acquire(self):
+        deadline = self.clock() + self.timeout
+        while True:
+            with self._condition:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - self.clock()
+                    if remaining <= 0:
+                        raise PoolTimeout('No connection available in {:.1f}s, pool size is {}.'.format(self.timeout, self.max_size))
+                    self._condition.wait(remaining)
+                if self._idle:
+                    # last released connection is the most likely to be alive and warm
+                    connection, released_at = self._idle.pop()
+                else:
+                    connection, released_at = None, None
+                    self._size += 1
+
+            if connection is None:
+                try:
+                    return self.connect()
+                except BaseException:
+                    self._discarded()
+                    raise
+            if self.health_check is None or self.clock() - released_at < self.check_interval or self._check(connection):
+                return connection
+            self._close(connection)
+            self._discarded()
+
+    def release(self, connection, discard=False):
+        if discard:
+            self._close(connection)
+            self._discarded()
+            return
+        now = self.clock()
+        expired = []
+        with self._condition:
+            self._idle.append((connection, now))
+            # oldest idle connections are on the left
+            while self._size > self.min_size and self._idle and now - self._idle[0][1] > self.max_idle:
+                expired.append(self._idle.popleft()[0])
+                self._size -= 1
+            self._condition.notify()
+        for connection in expired:
+            self._close(connection)
+
+    def close_all(self):
+        """
+        Close idle connections, connections in use are closed when released with discard.
+        """
+        with self._condition:
+            idle = [connection for connection, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for connection in idle:
+            self._close(connection)
+
+    def stats(self):
+        with self._condition:
+            return {'size': self._size, 'idle': len(self._idle), 'in_use': self._size - len(self._idle),
+                    'max_size': self.max_size}
+
+    def _check(self, connection):
+        try:
+            return bool(self.health_check(connection))
+        except Exception:
+            return False
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _discarded(self):
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
@@ -0,0 +1,140 @@
+import heapq
+import itertools
+import threading
+import time
+from django.db import transaction
+from django.db.models import Count, F, FloatField, Max, Sum, Value
+from django.db.models.functions import Cast
+from django.utils import timezone
+from beer_app.models import BeerReview, BeerPopularity
+
+# Cold start rankings. Beers are ranked by Bayesian average of review_overall:
+#   score = (sum of review_overall + PRIOR_REVIEWS * global mean) / (review_count + PRIOR_REVIEWS)
+# so a beer needs many good reviews to rise far above global mean.
+# build_popularity command stores scores in BeerPopularity, each worker process keeps
+# global, per style and per brewery top RANKING_DEPTH in memory.
+
+PRIOR_REVIEWS = 100
+RANKING_DEPTH = 100
+# workers compare time of latest build in BeerPopularity with their table at most this often
+VERSION_CHECK_SECONDS = 60
+
+
+def build_popularity(prior_reviews=PRIOR_REVIEWS, batch_size=5000):
+    """
+    Replace BeerPopularity rows with scores of all reviewed beers, returns number of beers.
+    """
+    rows = list(BeerReview.objects.order_by().values_list('review_beer', 'review_beer__beer_style', 'review_beer__brewery_name')
+                                  .annotate(review_count=Count('id'), review_sum=Sum('review_overall')))
+    global_mean = float(sum(review_sum for *_, review_sum in rows)) / max(sum(review_count for *_, review_count, _ in rows), 1)
+    built = timezone.now()
+    with transaction.atomic():
+        BeerPopularity.objects.all().delete()
+        BeerPopularity.objects.bulk_create(
+            (BeerPopularity(beer_id=beer_id, beer_style=beer_style, brewery_name=brewery_name,
+                            review_count=review_count, average_rate=float(review_sum) / review_count,
+                            score=(float(review_sum) + prior_reviews * global_mean) / (review_count + prior_reviews),
+                            built=built)
+             for beer_id, beer_style, brewery_name, review_count, review_sum in rows),
+            batch_size=batch_size)
+    reset_table()
+    return len(rows)
+
+
+def compute_top(count, prior_reviews=PRIOR_REVIEWS):
+    """
+    Overall best beer ids with the same score computed from reviews, used until build_popularity has run.
+    """
+    totals = BeerReview.objects.aggregate(review_count=Count('id'), review_sum=Sum('review_overall'))
+    global_mean = float(totals['review_sum'] or 0) / max(totals['review_count'], 1)
+    score = (Cast(Sum('review_overall'), FloatField()) + Value(prior_reviews * global_mean)) / \
+            (Cast(Count('id'), FloatField()) + Value(float(prior_reviews)))
+    queryset = BeerReview.objects.order_by().values('review_beer').annotate(score=score)
+    return list(queryset.order_by('-score', 'review_beer').values_list('review_beer', flat=True)[:count])
+
+
+class PopularityTable:
+    """
+    Rankings as lists of (-score, beer id) in ascending order, so sorted rankings merge with heapq.merge.
+    beers holds public fields of every ranked beer by id.
+    """
+
+    def __init__(self, rows, depth=RANKING_DEPTH):
+        self.beers = {}
+        self.overall = []
+        self.by_style = {}
+        self.by_brewery = {}
+        # rows are ordered by descending score
+        for beer in rows:
+            entry = (-beer['score'], beer['id'])
+            ranked = False
+            for ranking in (self.overall, self.by_style.setdefault(beer['beer_style'], []),
+                            self.by_brewery.setdefault(beer['brewery_name'], [])):
+                if len(ranking) < depth:
+                    ranking.append(entry)
+                    ranked = True
+            if ranked:
+                self.beers[beer['id']] = beer
+
+    def top(self, count, beer_styles=(), brewery_names=()):
+        """
+        Best count beer ids of chosen styles and breweries, topped up with overall best ones.
+        """
+        rankings = [self.by_style.get(style, []) for style in beer_styles] + \
+                   [self.by_brewery.get(name, []) for name in brewery_names]
+        result = []
+        seen = set()
+        for _, beer_id in itertools.chain(heapq.merge(*rankings), self.overall):
+            if len(result) == count:
+                break
+            if beer_id not in seen:
+                seen.add(beer_id)
+                result.append(beer_id)
+        return result
+
+
+def load_table():
+    rows = BeerPopularity.objects.order_by('-score', 'beer_id').values(
+        'beer_style', 'brewery_name', 'review_count', 'average_rate', 'score',
+        id=F('beer_id'), beer_name=F('beer__beer_name'))
+    return PopularityTable(rows.iterator(chunk_size=5000))
+
+
+_table = None
+_version = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def get_table():
+    """
+    Popularity table of this process, reloaded once build_popularity has run in any process.
+    """
+    global _table, _version, _checked_at
+    if _table is not None and time.monotonic() - _checked_at < VERSION_CHECK_SECONDS:
+        return _table
+    with _lock:
+        if _table is None or time.monotonic() - _checked_at >= VERSION_CHECK_SECONDS:
+            # index only lookup, None until first build
+            version = BeerPopularity.objects.aggregate(built=Max('built'))['built']
+            if _table is None or version != _version:
+                _table = load_table()
+                _version = version
+            _checked_at = time.monotonic()
+    return _table
+
+
+def reset_table():
+    global _table
+    with _lock:
+        _table = None
+
+
+def top_beer_ids(count):
+    """
+    Overall best beer ids for users without reviews.
+    """
+    beer_ids = get_table().top(count)
+    if len(beer_ids) < count:
+        beer_ids = compute_top(count)
+    return beer_ids
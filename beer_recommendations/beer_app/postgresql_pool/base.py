@@ -0,0 +1,85 @@
+import threading
+from django.db.backends.postgresql import base, creation
+from beer_app.pool import ConnectionPool
+
+# PostgreSQL backend taking connections from a per-process ConnectionPool.
+# Use with CONN_MAX_AGE = 0, closing a connection at the end of a request returns it to the pool.
+# Pool is configured by POOL_OPTIONS in the database settings, e.g.
+# {'MIN_SIZE': 2, 'MAX_SIZE': 10, 'TIMEOUT': 10, 'MAX_IDLE': 600, 'CHECK_INTERVAL': 30}.
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, connect, options):
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(connect,
+                                  min_size=options.get('MIN_SIZE', 0),
+                                  max_size=options.get('MAX_SIZE', 10),
+                                  timeout=options.get('TIMEOUT', 30.0),
+                                  max_idle=options.get('MAX_IDLE', 600.0),
+                                  check_interval=options.get('CHECK_INTERVAL', 30.0),
+                                  health_check=is_usable)
+            _pools[key] = pool
+    return pool
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_all()
+
+
+def is_usable(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+    return True
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # idle pooled connections to test database would block DROP DATABASE
+        close_pools()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+    def _clone_test_db(self, suffix, verbosity, keepdb=False):
+        # template database must have no other sessions
+        close_pools()
+        super()._clone_test_db(suffix, verbosity, keepdb)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_pool(self, conn_params):
+        key = (self.alias, tuple(sorted((name, repr(value)) for name, value in conn_params.items())))
+        # new connections get isolation level and jsonb setup from postgresql backend
+        connect = lambda: super(DatabaseWrapper, self).get_new_connection(conn_params)
+        return get_pool(key, connect, self.settings_dict.get('POOL_OPTIONS', {}))
+
+    def get_new_connection(self, conn_params):
+        self.pool = self.get_pool(conn_params)
+        self.pool.fill()
+        connection = self.pool.acquire()
+        # reused connection, set what postgresql backend sets on connect
+        self.isolation_level = base.IsolationLevel(
+            self.settings_dict['OPTIONS'].get('isolation_level', base.IsolationLevel.READ_COMMITTED))
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        connection = self.connection
+        discard = bool(connection.closed)
+        if not discard:
+            try:
+                # leave connection idle and in autocommit mode for next user
+                connection.rollback()
+                connection.autocommit = True
+            except base.Database.Error:
+                discard = True
+        self.pool.release(connection, discard=discard)
@@ -0,0 +1,51 @@
+from django.db import models
+from django.db.models import Avg, F, OuterRef, Value, Q, Subquery
+from django.db.models.functions import Coalesce, NullIf
+from beer_app.models import Beer, BeerReview, BeerRecommendation
+
+# Querysets shared by sync (beer_app.views) and async (beer_app.async_views) endpoints
+
+
+def list_image(prefix=''):
+    """
+    Thumbnail of beer image if it exists, beers saved without upload store empty thumbnail name.
+    """
+    return Coalesce(NullIf(prefix + 'beer_thumbnail', Value(''), output_field=models.CharField()),
+                    prefix + 'beer_image', output_field=models.CharField())
+
+
+def beer_list_queryset(beer_name=None, beer_style=None):
+    queryset = Beer.objects.all().annotate(average_rate=Avg('beerreview__review_overall')).order_by(F('id').asc(nulls_last=True))
+    queryset = queryset.annotate(list_image=list_image())
+    if beer_name is not None:
+        queryset = queryset.filter(beer_name__icontains=beer_name)
+    if beer_style is not None:
+        queryset = queryset.filter(beer_style__icontains=beer_style)
+    return queryset
+
+
+def beer_detail_queryset(user):
+    queryset = Beer.objects.all().annotate(average_rate=Avg('beerreview__review_overall')).order_by(F('id').desc(nulls_last=True))
+    queryset = queryset.annotate(average_aroma=Avg('beerreview__review_aroma'))
+    queryset = queryset.annotate(average_appearance=Avg('beerreview__review_appearance'))
+    queryset = queryset.annotate(average_palate=Avg('beerreview__review_palate'))
+    queryset = queryset.annotate(average_taste=Avg('beerreview__review_taste'))
+    related_model = BeerReview.objects.filter(Q(review_user=user))
+    related_model_subquery = related_model.filter(review_beer=OuterRef('pk'))
+    queryset = queryset.annotate(is_reviewed=Subquery(related_model_subquery.values('id')))
+    return queryset
+
+
+def beer_rating_queryset():
+    return Beer.objects.all().annotate(average_rate=Avg('beerreview__review_overall'), list_image=list_image()).order_by(F('average_rate').desc(nulls_last=True))
+
+
+def beer_review_queryset(user):
+    queryset = BeerReview.objects.all().filter(review_user=user).order_by(F('review_time').desc(nulls_last=True))
+    queryset = queryset.annotate(beer_name=F('review_beer__beer_name'), beer_style=F('review_beer__beer_style'),
+                                 beer_image=F('review_beer__beer_image'), list_image=list_image('review_beer__'))
+    return queryset
+
+
+def beer_recommendation_queryset(user):
+    return BeerRecommendation.objects.all().filter(recommendation_user=user)
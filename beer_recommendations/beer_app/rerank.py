@@ -0,0 +1,162 @@
+import sys
+import threading
+import time
+from array import array
+from beer_app.models import Beer
+
+# Request time re-ranking of stored candidates (BeerCandidates) or popularity rankings.
+# Beer attributes are held in memory of each worker process as parallel arrays,
+# so filtering and diversification need no queries besides reading the candidates row.
+
+# catalog is reloaded for unknown candidate beers at most this often
+CATALOG_RELOAD_SECONDS = 60
+
+
+def unpack(data, typecode):
+    """ array of little-endian values stored by cron_job publish stage """
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def pack(values, typecode):
+    values = array(typecode, values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+class Catalog:
+    """
+    Beer attributes by position, position of beer id is index[beer_id].
+    Styles and breweries are stored as codes into styles and breweries lists.
+    """
+
+    def __init__(self, rows):
+        self.index = {}
+        self.ids = array('i')
+        self.names = []
+        self.style_codes = array('I')
+        self.brewery_codes = array('I')
+        self.abv = array('f')
+        styles = {}
+        breweries = {}
+        for beer_id, beer_name, beer_style, brewery_name, beer_abv in rows:
+            self.index[beer_id] = len(self.ids)
+            self.ids.append(beer_id)
+            self.names.append(beer_name)
+            self.style_codes.append(styles.setdefault(beer_style, len(styles)))
+            self.brewery_codes.append(breweries.setdefault(brewery_name, len(breweries)))
+            self.abv.append(float(beer_abv))
+        self.styles = list(styles)
+        self.breweries = list(breweries)
+
+    def match_styles(self, terms):
+        """ Codes of styles containing any of terms, case insensitive like beer_style filter of beer list """
+        terms = [term.lower() for term in terms]
+        return {code for code, style in enumerate(self.styles) if any(term in style.lower() for term in terms)}
+
+    def beer(self, position, score):
+        return {
+            'id': self.ids[position],
+            'beer_name': self.names[position],
+            'beer_style': self.styles[self.style_codes[position]],
+            'brewery_name': self.breweries[self.brewery_codes[position]],
+            'beer_abv': round(self.abv[position], 2),
+            'score': round(score, 4),
+        }
+
+
+def load_catalog():
+    rows = Beer.objects.order_by('id').values_list('id', 'beer_name', 'beer_style', 'brewery_name', 'beer_abv')
+    return Catalog(rows.iterator(chunk_size=5000))
+
+
+_catalog = None
+_loaded_at = 0.0
+_lock = threading.Lock()
+
+
+def get_catalog(beer_ids=()):
+    """
+    Catalog of this process, reloaded if some of beer_ids were added after it was loaded.
+    """
+    global _catalog, _loaded_at
+    catalog = _catalog
+    if catalog is not None and (all(beer_id in catalog.index for beer_id in beer_ids) or
+                                time.monotonic() - _loaded_at < CATALOG_RELOAD_SECONDS):
+        return catalog
+    with _lock:
+        if _catalog is catalog:
+            _catalog = load_catalog()
+            _loaded_at = time.monotonic()
+        return _catalog
+
+
+def reset_catalog():
+    global _catalog
+    with _lock:
+        _catalog = None
+
+
+def rerank(catalog, beer_ids, scores, count=10, beer_styles=(), exclude_styles=(), min_abv=None, max_abv=None,
+           max_per_brewery=None, diversity=0.0):
+    """
+    Best count of candidates (beer_ids with scores, best first) passing style and ABV filters,
+    at most max_per_brewery beers of one brewery.
+
+    With diversity > 0 beers are picked by maximal marginal relevance:
+    (1 - diversity) * relevance - diversity * similarity to already picked beers,
+    relevance is score scaled to [0, 1], similarity is 1 for picked style and 0.5 for picked brewery.
+    Returns list of (catalog position, score).
+    """
+    included = catalog.match_styles(beer_styles) if beer_styles else None
+    excluded = catalog.match_styles(exclude_styles) if exclude_styles else set()
+    eligible = []
+    for beer_id, score in zip(beer_ids, scores):
+        position = catalog.index.get(beer_id)
+        if position is None:
+            continue
+        style = catalog.style_codes[position]
+        abv = catalog.abv[position]
+        if (included is not None and style not in included) or style in excluded or \
+                (min_abv is not None and abv < min_abv) or (max_abv is not None and abv > max_abv):
+            continue
+        eligible.append((position, score))
+    if not eligible:
+        return []
+
+    high = max(score for _, score in eligible)
+    low = min(score for _, score in eligible)
+    spread = high - low or 1.0
+    picked = []
+    picked_styles = set()
+    brewery_counts = {}
+
+    def marginal_relevance(candidate):
+        position, score = candidate
+        if catalog.style_codes[position] in picked_styles:
+            similarity = 1.0
+        elif catalog.brewery_codes[position] in brewery_counts:
+            similarity = 0.5
+        else:
+            similarity = 0.0
+        return (1 - diversity) * (score - low) / spread - diversity * similarity
+
+    remaining = eligible
+    while len(picked) < count:
+        if max_per_brewery is not None:
+            remaining = [candidate for candidate in remaining
+                         if brewery_counts.get(catalog.brewery_codes[candidate[0]], 0) < max_per_brewery]
+        if not remaining:
+            break
+        # candidates are ordered by score, max() keeps the first of equal values
+        best = max(remaining, key=marginal_relevance) if diversity else remaining[0]
+        picked.append(best)
+        picked_styles.add(catalog.style_codes[best[0]])
+        brewery = catalog.brewery_codes[best[0]]
+        brewery_counts[brewery] = brewery_counts.get(brewery, 0) + 1
+        remaining = [candidate for candidate in remaining if candidate is not best]
+    return picked
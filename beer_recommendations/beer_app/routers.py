@@ -0,0 +1,76 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import caches
+
+# Alias reads are routed to in current request/task, None means default database
+read_alias = ContextVar('read_alias', default=None)
+
+
+@contextmanager
+def read_from(alias):
+    token = read_alias.set(alias)
+    try:
+        yield
+    finally:
+        read_alias.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Sends reads to read_alias when set, writes and migrations always go to default.
+    Replica is a copy of default, so relations between objects loaded from either are allowed.
+    """
+
+    def db_for_read(self, model, **hints):
+        return read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+# Read-your-writes: user who has just written reads from default until replica has caught up.
+# Writes are marked by user in 'shared' cache, so token clients and every worker see them.
+# Signed cookie of the user spares cache lookups of clients that send cookies back.
+
+STICKY_COOKIE = 'replica_sticky'
+
+
+def sticky_key(user):
+    return 'replica_sticky_{}'.format(user.pk)
+
+
+def mark_written(response, user):
+    if settings.REPLICA_DATABASE != 'default':
+        caches['shared'].set(sticky_key(user), True, settings.REPLICA_STICKY_SECONDS)
+        response.set_signed_cookie(STICKY_COOKIE, str(user.pk), salt=STICKY_COOKIE,
+                                   max_age=settings.REPLICA_STICKY_SECONDS, httponly=True, samesite='Lax')
+
+
+def _has_sticky_cookie(request):
+    # signature holds time the cookie was set, older cookies are rejected as clients may keep them
+    written_by = request.get_signed_cookie(STICKY_COOKIE, default=None, salt=STICKY_COOKIE,
+                                           max_age=settings.REPLICA_STICKY_SECONDS)
+    return written_by is not None and written_by == str(request.user.pk)
+
+
+def replica_alias_for(request):
+    if settings.REPLICA_DATABASE == 'default' or _has_sticky_cookie(request):
+        return None
+    if caches['shared'].get(sticky_key(request.user)) is not None:
+        return None
+    return settings.REPLICA_DATABASE
+
+
+async def areplica_alias_for(request):
+    if settings.REPLICA_DATABASE == 'default' or _has_sticky_cookie(request):
+        return None
+    if await caches['shared'].aget(sticky_key(request.user)) is not None:
+        return None
+    return settings.REPLICA_DATABASE
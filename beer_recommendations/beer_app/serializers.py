@@ -1,15 +1,31 @@
 from rest_framework import serializers
 from beer_app.models import Beer, BeerReview, BeerRecommendation
 from django.conf import settings
-from django.db.models import Avg, Count, F
+from django.db import transaction
 from django.contrib.auth.models import User
-from random import randint
 from rest_framework.validators import UniqueValidator
+from beer_app.media import media_url, media_base_url
+from beer_app.popularity import top_beer_ids
+from rest_framework.settings import api_settings
+from django.utils import timezone
+from django.utils.encoding import filepath_to_uri
+import decimal
 
 
+class MediaURLField(serializers.ReadOnlyField):
+    """
+    Absolute url of media file name, base url is computed once per request.
+    """
+    def to_representation(self, value):
+        name = getattr(value, 'name', value)
+        if not name:
+            return None
+        return media_url(name, self.context.get('request'))
+
 
 class BeerListSerializer(serializers.ModelSerializer):
     average_rate = serializers.DecimalField(max_digits=2, decimal_places=1)
+    beer_image = MediaURLField(source='list_image')
     class Meta:
         model = Beer
         fields = [
@@ -27,6 +43,7 @@ class BeerDetailSerializer(serializers.ModelSerializer):
     average_palate = serializers.DecimalField(max_digits=2, decimal_places=1)
     average_taste = serializers.DecimalField(max_digits=2, decimal_places=1)
     is_reviewed = serializers.IntegerField()
+    beer_image = MediaURLField()
     class Meta:
         model = Beer
         fields = [
@@ -46,6 +63,7 @@ class BeerDetailSerializer(serializers.ModelSerializer):
 
 class BeerRatingSerializer(serializers.ModelSerializer):
     average_rate = serializers.DecimalField(max_digits=2, decimal_places=1)
+    beer_image = MediaURLField(source='list_image')
     class Meta:
         model = Beer
         fields = [
@@ -61,7 +79,7 @@ class BeerRatingSerializer(serializers.ModelSerializer):
 class BeerReviewListSerializer(serializers.ModelSerializer):
     beer_name = serializers.CharField(max_length=100)
     beer_style = serializers.CharField(max_length=100)
-    beer_image = serializers.SerializerMethodField('get_image_url')
+    beer_image = MediaURLField(source='list_image')
     class Meta:
         model = BeerReview
         fields = [
@@ -74,9 +92,6 @@ class BeerReviewListSerializer(serializers.ModelSerializer):
                     'review_overall'
                  ]
 
-    def get_image_url(self, obj):
-        return self.context['request'].build_absolute_uri(settings.MEDIA_URL + obj.beer_image)
-
 class BeerReviewPutPostSerializer(serializers.ModelSerializer):
     class Meta:
         model = BeerReview
@@ -91,10 +106,45 @@ class BeerReviewPutPostSerializer(serializers.ModelSerializer):
                     'review_taste'
                  ]
 
+class BeerReviewUpsertSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BeerReview
+        fields = [
+                    'id',
+                    'review_beer',
+                    'review_time',
+                    'review_overall',
+                    'review_aroma',
+                    'review_appearance',
+                    'review_palate',
+                    'review_taste'
+                 ]
+        read_only_fields = ['id', 'review_beer', 'review_time']
+
+class BeerReviewImportSerializer(serializers.ModelSerializer):
+    # plain ids, existence is checked once per batch
+    review_user = serializers.IntegerField()
+    review_beer = serializers.IntegerField()
+    review_time = serializers.DateTimeField(required=False)
+    class Meta:
+        model = BeerReview
+        fields = [
+                    'review_user',
+                    'review_beer',
+                    'review_time',
+                    'review_overall',
+                    'review_aroma',
+                    'review_appearance',
+                    'review_palate',
+                    'review_taste'
+                 ]
+        # rows of reviewed beers are updates, upsert keeps a review per user and beer
+        validators = []
+
 class BeerReviewDetailSerializer(serializers.ModelSerializer):
     beer_name = serializers.CharField(max_length=100)
     beer_style = serializers.CharField(max_length=100)
-    beer_image = serializers.SerializerMethodField('get_image_url')
+    beer_image = MediaURLField()
     class Meta:
         model = BeerReview
         fields = [
@@ -111,9 +161,6 @@ class BeerReviewDetailSerializer(serializers.ModelSerializer):
                     'review_taste'
                  ]
 
-    def get_image_url(self, obj):
-        return self.context['request'].build_absolute_uri(settings.MEDIA_URL + obj.beer_image)
-
 class BeerRecommendationSerializer(serializers.ModelSerializer):
     recommendation_user = serializers.ReadOnlyField(source='recommendation_user.username')
     class Meta:
@@ -146,24 +193,156 @@ class UserSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         user = User(email=validated_data['email'], username=validated_data['email'])
         user.set_password(validated_data['password'])
-        # queryset = Beer.objects.all().annotate(count=Count('beerreview__review_overall')).filter(count__gt=1000).annotate(average_rate=Avg('beerreview__review_overall')).order_by(F('average_rate').desc(nulls_last=True))[:10]
-        queryset = BeerReview.objects.all().values('review_beer').annotate(count=Count('review_overall')).filter(count__gt=1000).values('review_beer').annotate(average_rate=Avg('review_overall')).order_by(F('average_rate').desc(nulls_last=True)).values_list('review_beer')[:10]
-        # queryset = Beer.objects.all()
-        # count = queryset.aggregate(count=Count('id'))['count']
-        # top_beers = []
-        # for i in range(10):
-        #   random_index = randint(0, count - 1)
-        #   top_beers.append(queryset[random_index])
-        recommendations = BeerRecommendation(recommendation_user=user, top1_beer=Beer.objects.get(id=queryset[0][0]),
-                                                                       top2_beer=Beer.objects.get(id=queryset[1][0]),
-                                                                       top3_beer=Beer.objects.get(id=queryset[2][0]),
-                                                                       top4_beer=Beer.objects.get(id=queryset[3][0]),
-                                                                       top5_beer=Beer.objects.get(id=queryset[4][0]),
-                                                                       top6_beer=Beer.objects.get(id=queryset[5][0]),
-                                                                       top7_beer=Beer.objects.get(id=queryset[6][0]),
-                                                                       top8_beer=Beer.objects.get(id=queryset[7][0]),
-                                                                       top9_beer=Beer.objects.get(id=queryset[8][0]),
-                                                                       top10_beer=Beer.objects.get(id=[9][0]))
-        user.save()
-        recommendations.save()
+        # best beers overall until user has reviews of their own
+        top_beers = top_beer_ids(10)
+        with transaction.atomic():
+            user.save()
+            BeerRecommendation.objects.create(recommendation_user=user,
+                                              **{'top{}_beer_id'.format(i): beer_id for i, beer_id in enumerate(top_beers, 1)})
         return user
+
+
+def decimal_converter(max_digits, decimal_places):
+    """
+    Same output as serializers.DecimalField.to_representation.
+    """
+    def factory(context):
+        decimal_context = decimal.getcontext().copy()
+        decimal_context.prec = max_digits
+        exponent = decimal.Decimal('.1') ** decimal_places
+        coerce_to_string = api_settings.COERCE_DECIMAL_TO_STRING
+
+        def convert(value):
+            if value is None:
+                return '' if coerce_to_string else None
+            if not isinstance(value, decimal.Decimal):
+                value = decimal.Decimal(str(value).strip())
+            value = value.quantize(exponent, context=decimal_context)
+            return '{:f}'.format(value) if coerce_to_string else value
+        return convert
+    return factory
+
+
+def datetime_converter(context):
+    """
+    Same output as serializers.DateTimeField.to_representation with default format.
+    """
+    current_timezone = timezone.get_current_timezone()
+
+    def convert(value):
+        if not value:
+            return None
+        value = value.astimezone(current_timezone).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return convert
+
+
+def media_url_converter(context):
+    """
+    Same output as MediaURLField.to_representation.
+    """
+    base_url = media_base_url(context.get('request'))
+
+    def convert(value):
+        if not value:
+            return None
+        return base_url + filepath_to_uri(value)
+    return convert
+
+
+class ValuesListSerializer:
+    """
+    Read-only list serializer working on queryset.values_list() rows.
+    Converters are built once per serialize call instead of per field and row.
+    """
+    # (output field, queryset field, converter factory or None)
+    fields = []
+
+    def __init__(self, context=None):
+        self.context = context or {}
+
+    @classmethod
+    def values_fields(cls):
+        return [source for _, source, _ in cls.fields]
+
+    def serialize(self, rows):
+        names = [name for name, _, _ in self.fields]
+        converters = [(index, factory(self.context)) for index, (_, _, factory) in enumerate(self.fields)
+                      if factory is not None]
+        data = []
+        for row in rows:
+            row = list(row)
+            for index, convert in converters:
+                row[index] = convert(row[index])
+            data.append(dict(zip(names, row)))
+        return data
+
+
+class BeerListValuesSerializer(ValuesListSerializer):
+    fields = [
+                ('id', 'id', None),
+                ('beer_name', 'beer_name', None),
+                ('beer_style', 'beer_style', None),
+                ('average_rate', 'average_rate', decimal_converter(2, 1)),
+                ('beer_image', 'list_image', media_url_converter)
+             ]
+
+
+class BeerRatingValuesSerializer(ValuesListSerializer):
+    fields = [
+                ('id', 'id', None),
+                ('beer_name', 'beer_name', None),
+                ('beer_style', 'beer_style', None),
+                ('brewery_name', 'brewery_name', None),
+                ('beer_abv', 'beer_abv', decimal_converter(5, 2)),
+                ('average_rate', 'average_rate', decimal_converter(2, 1)),
+                ('beer_image', 'list_image', media_url_converter)
+             ]
+
+
+class BeerReviewListValuesSerializer(ValuesListSerializer):
+    fields = [
+                ('id', 'id', None),
+                ('review_beer', 'review_beer', None),
+                ('review_time', 'review_time', datetime_converter),
+                ('beer_name', 'beer_name', None),
+                ('beer_style', 'beer_style', None),
+                ('beer_image', 'list_image', media_url_converter),
+                ('review_overall', 'review_overall', decimal_converter(2, 1))
+             ]
+
+
+class BeerDetailValuesSerializer(ValuesListSerializer):
+    fields = [
+                ('id', 'id', None),
+                ('beer_name', 'beer_name', None),
+                ('beer_style', 'beer_style', None),
+                ('brewery_name', 'brewery_name', None),
+                ('beer_abv', 'beer_abv', decimal_converter(5, 2)),
+                ('average_rate', 'average_rate', decimal_converter(2, 1)),
+                ('average_aroma', 'average_aroma', decimal_converter(2, 1)),
+                ('average_appearance', 'average_appearance', decimal_converter(2, 1)),
+                ('average_palate', 'average_palate', decimal_converter(2, 1)),
+                ('average_taste', 'average_taste', decimal_converter(2, 1)),
+                ('beer_image', 'beer_image', media_url_converter),
+                ('is_reviewed', 'is_reviewed', None)
+             ]
+
+
+class BeerRecommendationValuesSerializer(ValuesListSerializer):
+    fields = [
+                ('id', 'id', None),
+                ('recommendation_user', 'recommendation_user__username', None),
+                ('top1_beer', 'top1_beer', None),
+                ('top2_beer', 'top2_beer', None),
+                ('top3_beer', 'top3_beer', None),
+                ('top4_beer', 'top4_beer', None),
+                ('top5_beer', 'top5_beer', None),
+                ('top6_beer', 'top6_beer', None),
+                ('top7_beer', 'top7_beer', None),
+                ('top8_beer', 'top8_beer', None),
+                ('top9_beer', 'top9_beer', None),
+                ('top10_beer', 'top10_beer', None)
+             ]
@@ -0,0 +1,387 @@
+import csv
+import io
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+from itertools import islice
+import numpy as np
+from django.contrib.auth.hashers import make_password
+
+# Synthetic users, beers, reviews and recommendations with the columns of test_data CSVs.
+# Like in production a few users write most reviews and a few beers get most of them: review
+# counts of users and popularity of beers follow Zipf laws (weight of rank r is r ** -skew).
+# Reviews are generated for chunks of users at a time, memory depends on numbers of users and
+# beers, not of reviews. Rows depend only on sizes, skews and seed.
+
+PASSWORD = 'synthetic'
+BEER_STYLES = [
+    'American IPA', 'American Pale Ale (APA)', 'American Double / Imperial IPA', 'American Porter',
+    'American Amber / Red Ale', 'Russian Imperial Stout', 'Belgian Strong Dark Ale', 'Belgian Pale Ale',
+    'German Pilsener', 'Hefeweizen', 'Witbier', 'Saison / Farmhouse Ale', 'Fruit / Vegetable Beer',
+    'English Brown Ale', 'Irish Dry Stout', 'Märzen / Oktoberfest', 'Czech Pilsener', 'Tripel',
+]
+BEERS_PER_BREWERY = 20
+USER_SKEW = 1.0
+BEER_SKEW = 1.0
+# a user reviews at most this share of beers, distinct beers of a user are drawn by rejection
+MAX_USER_SHARE = 0.5
+# draws by popularity before rejected beers of a user are replaced by uniformly drawn ones
+POPULAR_ROUNDS = 3
+NEWEST_REVIEW = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+REVIEW_DAYS = 3 * 365
+# reviews generated at once, rows are formatted and written COPY_CHUNK_ROWS at a time
+CHUNK_REVIEWS = 1000000
+COPY_CHUNK_ROWS = 50000
+
+USER_COLUMNS = ['username', 'email', 'password', 'is_superuser', 'is_staff', 'is_active', 'first_name', 'last_name',
+                'date_joined']
+BEER_COLUMNS = ['beer_name', 'beer_style', 'brewery_name', 'beer_abv', 'beer_image']
+REVIEW_COLUMNS = ['review_time', 'review_overall', 'review_aroma', 'review_appearance', 'review_palate', 'review_taste',
+                  'review_user_id', 'review_beer_id']
+RECOMMENDATION_COLUMNS = ['recommendation_user_id'] + ['top{}_beer_id'.format(rank) for rank in range(1, 11)]
+
+# review_overall as text by number of half points, aspects by value
+OVERALL_TEXT = np.array(['{:.1f}'.format(half / 2) for half in range(11)])
+ASPECT_TEXT = np.array([str(value) for value in range(6)])
+
+
+def zipf_weights(count, skew):
+    """ Weight of rank 1..count """
+    return np.arange(1, count + 1, dtype=np.float64) ** -skew
+
+
+def review_counts(users, reviews, skew, limit, rng):
+    """
+    Reviews of every user: at least one, the rest shared by Zipf weight of user rank,
+    at most limit. Ranks are shuffled over users.
+    """
+    weights = zipf_weights(users, skew)[rng.permutation(users)]
+    counts = np.ones(users, dtype=np.int64)
+    remaining = reviews - users
+    while remaining > 0:
+        # shares of users at limit go to the others
+        shares = np.where(counts < limit, weights, 0.0)
+        extra = np.floor(shares / shares.sum() * remaining).astype(np.int64)
+        if not extra.any():
+            extra[np.argsort(-shares, kind='stable')[:remaining]] = 1
+        added = np.minimum(counts + extra, limit) - counts
+        counts += added
+        remaining -= int(added.sum())
+    return counts
+
+
+def distinct_samples(rng, counts, cdf):
+    """
+    counts[i] distinct items for owner i, drawn by popularity of cumulative weights cdf.
+    Returns (owners, items) ordered by owner and item.
+    """
+    items = cdf.shape[0]
+    deficit = counts.astype(np.int64)
+    chosen = np.empty(0, dtype=np.int64)
+    attempt = 0
+    while True:
+        owners = np.flatnonzero(deficit)
+        if not owners.size:
+            break
+        needed = deficit[owners]
+        # some draws repeat items owner already has
+        draws = np.repeat(owners, needed + (needed >> 2) + 1)
+        if attempt < POPULAR_ROUNDS:
+            drawn = np.minimum(np.searchsorted(cdf, rng.random(draws.shape[0]) * cdf[-1], side='right'), items - 1)
+        else:
+            # owners with a large share of items rarely draw the unpopular ones
+            drawn = rng.integers(0, items, draws.shape[0])
+        # pairs as owner * items + item, first draw of each new pair is kept
+        keys = draws * items + drawn
+        order = np.argsort(keys, kind='stable')
+        ordered = keys[order]
+        first = np.empty(keys.shape[0], dtype=bool)
+        first[0] = True
+        np.not_equal(ordered[1:], ordered[:-1], out=first[1:])
+        if chosen.size:
+            found = np.minimum(np.searchsorted(chosen, ordered), chosen.shape[0] - 1)
+            first &= chosen[found] != ordered
+        keys = keys[np.sort(order[first])]
+        # draws of an owner are in random order, first ones up to its deficit are taken
+        owner = keys // items
+        sizes = np.bincount(owner, minlength=counts.shape[0])
+        starts = np.cumsum(sizes) - sizes
+        keys = keys[np.arange(keys.shape[0]) - starts[owner] < deficit[owner]]
+        deficit -= np.bincount(keys // items, minlength=counts.shape[0])
+        chosen = np.concatenate([chosen, keys])
+        chosen.sort()
+        attempt += 1
+    return chosen // items, chosen % items
+
+
+class SyntheticDataset:
+    """
+    users, beers and reviews generated from seed, users and beers are numbered from 0.
+    Reviews and recommendations refer to these numbers, writers map them to ids.
+    """
+    # independent random streams, a chunk of reviews depends only on its stream and first user
+    STREAMS = ['users', 'beers', 'bias', 'beer_rows', 'reviews', 'recommendations']
+
+    def __init__(self, users, beers, reviews, seed=0, user_skew=USER_SKEW, beer_skew=BEER_SKEW):
+        limit = max(1, int(beers * MAX_USER_SHARE))
+        if users < 1 or beers < 10 or seed < 0:
+            raise ValueError('Dataset needs a user, 10 beers and a non-negative seed')
+        if not users <= reviews <= users * limit:
+            raise ValueError('Reviews must be between {} (one per user) and {} ({} per user)'.format(
+                users, users * limit, limit))
+        self.users = users
+        self.beers = beers
+        self.reviews = reviews
+        self.seed = seed
+        self.review_counts = review_counts(users, reviews, user_skew, limit, self.rng('users'))
+        rng = self.rng('beers')
+        # popularity rank -> beer number, popular beers are spread over ids
+        self.beer_by_rank = rng.permutation(beers)
+        self.beer_cdf = np.cumsum(zipf_weights(beers, beer_skew))
+        self.beer_quality = rng.normal(3.8, 0.45, beers)
+        self.user_bias = self.rng('bias').normal(0.0, 0.35, users)
+
+    def rng(self, stream, *key):
+        return np.random.default_rng([self.seed, self.STREAMS.index(stream), *key])
+
+    def user_rows(self):
+        """ auth_user rows of USER_COLUMNS """
+        # every user has the same password, hashing it per user would dominate generation time
+        password = make_password(PASSWORD, salt='synthetic{}'.format(self.seed))
+        date_joined = datetime(2010, 1, 1, tzinfo=dt_timezone.utc).isoformat()
+        for number in range(self.users):
+            username = 'synthetic_{}_{}'.format(self.seed, number)
+            yield (username, '{}@example.com'.format(username), password, False, False, True, '', '', date_joined)
+
+    def beer_rows(self):
+        """ beer_app_beer rows of BEER_COLUMNS """
+        rng = self.rng('beer_rows')
+        styles = rng.integers(0, len(BEER_STYLES), self.beers)
+        # a few breweries make many beers
+        brewery_cdf = np.cumsum(zipf_weights(max(1, self.beers // BEERS_PER_BREWERY), 1.0))
+        breweries = np.minimum(np.searchsorted(brewery_cdf, rng.random(self.beers) * brewery_cdf[-1], side='right'),
+                               brewery_cdf.shape[0] - 1)
+        abvs = rng.uniform(3.0, 12.0, self.beers)
+        for number, (style, brewery, abv) in enumerate(zip(styles.tolist(), breweries.tolist(), abvs.tolist())):
+            yield ('Synthetic Beer {}'.format(number), BEER_STYLES[style], 'Synthetic Brewery {}'.format(brewery),
+                   '{:.2f}'.format(abv), 'images.jpg')
+
+    def user_chunks(self, per_user):
+        """ (start, end) ranges of users with about CHUNK_REVIEWS rows of per_user counts """
+        ends = np.cumsum(per_user)
+        start = 0
+        while start < self.users:
+            done = int(ends[start - 1]) if start else 0
+            end = max(start + 1, int(np.searchsorted(ends, done + CHUNK_REVIEWS, side='right')))
+            yield start, end
+            start = end
+
+    def review_chunk(self, start, end):
+        """
+        Reviews of users start..end-1 as dict of REVIEW_COLUMNS arrays: review_time as seconds
+        before NEWEST_REVIEW, review_overall in half points, user and beer numbers.
+        """
+        # chunk depends only on its users, not on chunks before
+        rng = self.rng('reviews', start)
+        users, ranks = distinct_samples(rng, self.review_counts[start:end], self.beer_cdf)
+        users += start
+        beers = self.beer_by_rank[ranks]
+        count = users.shape[0]
+        overall = self.beer_quality[beers] + self.user_bias[users] + rng.normal(0.0, 0.6, count)
+        halves = np.clip(np.rint(overall * 2), 2, 10).astype(np.int64)
+        aspects = np.clip(np.rint(halves[:, None] / 2 + rng.normal(0.0, 0.6, (count, 4))), 1, 5).astype(np.int64)
+        return {
+            'review_time': rng.integers(0, REVIEW_DAYS * 24 * 3600, count),
+            'review_overall': halves,
+            'review_aroma': aspects[:, 0],
+            'review_appearance': aspects[:, 1],
+            'review_palate': aspects[:, 2],
+            'review_taste': aspects[:, 3],
+            'review_user_id': users,
+            'review_beer_id': beers,
+        }
+
+    def recommendation_chunks(self):
+        """ (user numbers, beer numbers of shape (users, 10)) with ten distinct popular beers per user """
+        tens = np.full(self.users, 10, dtype=np.int64)
+        for start, end in self.user_chunks(tens):
+            _, ranks = distinct_samples(self.rng('recommendations', start), tens[start:end], self.beer_cdf)
+            yield np.arange(start, end), self.beer_by_rank[ranks].reshape(-1, 10)
+
+
+def csv_blocks(rows, chunk_rows=COPY_CHUNK_ROWS, delimiter=','):
+    """ CSV text of rows, chunk_rows rows per block """
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_rows))
+        if not chunk:
+            return
+        buffer = io.StringIO()
+        csv.writer(buffer, delimiter=delimiter, lineterminator='\n').writerows(chunk)
+        yield buffer.getvalue()
+
+
+def column_blocks(columns, chunk_rows=COPY_CHUNK_ROWS, delimiter=','):
+    """ CSV text of equal length columns (arrays of str or int), chunk_rows rows per block """
+    length = len(columns[0])
+    for start in range(0, length, chunk_rows):
+        parts = [column[start:start + chunk_rows] for column in columns]
+        parts = [list(map(str, part.tolist())) if part.dtype.kind in 'iu' else part.tolist() for part in parts]
+        yield '\n'.join(map(delimiter.join, zip(*parts))) + '\n'
+
+
+def review_blocks(chunk, user_ids, beer_ids):
+    """ CSV text of review chunk with user and beer numbers replaced by ids """
+    newest = np.datetime64(NEWEST_REVIEW.replace(tzinfo=None), 's')
+    times = np.datetime_as_string(newest - chunk['review_time'].astype('timedelta64[s]'), timezone='UTC')
+    columns = [times, OVERALL_TEXT[chunk['review_overall']]]
+    columns += [ASPECT_TEXT[chunk[name]] for name in REVIEW_COLUMNS[2:6]]
+    columns += [user_ids[chunk['review_user_id']], beer_ids[chunk['review_beer_id']]]
+    return column_blocks(columns)
+
+
+# dataset and ids of review worker process
+_worker_state = None
+
+
+def _init_review_worker(dataset, user_ids, beer_ids):
+    global _worker_state
+    _worker_state = (dataset, user_ids, beer_ids)
+
+
+def _review_worker(users):
+    dataset, user_ids, beer_ids = _worker_state
+    chunk = dataset.review_chunk(*users)
+    return list(review_blocks(chunk, user_ids, beer_ids)), chunk['review_user_id'].shape[0]
+
+
+def review_texts(dataset, user_ids, beer_ids, workers=1):
+    """
+    (CSV blocks, rows) of review chunks in order. With workers > 1 chunks are generated
+    by worker processes, at most two per worker wait for the caller.
+    """
+    chunks = dataset.user_chunks(dataset.review_counts)
+    if workers <= 1:
+        for start, end in chunks:
+            chunk = dataset.review_chunk(start, end)
+            yield review_blocks(chunk, user_ids, beer_ids), chunk['review_user_id'].shape[0]
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_review_worker,
+                             initargs=(dataset, user_ids, beer_ids)) as executor:
+        pending = deque()
+        for users in chunks:
+            pending.append(executor.submit(_review_worker, users))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class DatabaseWriter:
+    """ COPY into tables of database of cursor, ids are assigned by database """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def last_id(self, table):
+        self.cursor.execute('SELECT COALESCE(MAX(id), 0) FROM {}'.format(table))
+        return self.cursor.fetchone()[0]
+
+    def write(self, table, columns, blocks, delimiter=','):
+        """ COPY CSV blocks into table, returns number of rows """
+        statement = "COPY {}({}) FROM STDIN WITH (FORMAT csv, DELIMITER '{}')".format(table, ', '.join(columns),
+                                                                                     delimiter)
+        rows = 0
+        for block in blocks:
+            self.cursor.copy_expert(statement, io.StringIO(block))
+            rows += block.count('\n')
+        return rows
+
+    def insert(self, table, columns, blocks):
+        """ Write rows and return their ids in rows order """
+        after = self.last_id(table)
+        self.write(table, columns, blocks)
+        self.cursor.execute('SELECT COUNT(*), MIN(id), MAX(id) FROM {} WHERE id > %s'.format(table), [after])
+        count, first, last = self.cursor.fetchone()
+        if not count:
+            return np.empty(0, dtype=np.int64)
+        if last - first + 1 == count:
+            return np.arange(first, last + 1, dtype=np.int64)
+        # sequence had gaps
+        self.cursor.execute('SELECT id FROM {} WHERE id > %s ORDER BY id'.format(table), [after])
+        return np.fromiter((row[0] for row in self.cursor.fetchall()), dtype=np.int64, count=count)
+
+
+class FileWriter:
+    """
+    CSV files with header named and delimited like test_data, ids are those of tables empty before loading.
+    """
+    FILES = {
+        'auth_user': 'user.csv',
+        'beer_app_beer': 'beer.csv',
+        'beer_app_beerreview': 'review.csv',
+        'beer_app_beerrecommendation': 'recommendations.csv',
+    }
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.started = set()
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, table, columns, blocks, delimiter=','):
+        """ Append CSV blocks to file of table, returns number of rows """
+        path = os.path.join(self.directory, self.FILES[table])
+        rows = 0
+        with open(path, 'a' if table in self.started else 'w') as output:
+            if table not in self.started:
+                output.write(delimiter.join(columns) + '\n')
+                self.started.add(table)
+            for block in blocks:
+                output.write(block)
+                rows += block.count('\n')
+        return rows
+
+    def insert(self, table, columns, blocks):
+        return np.arange(1, self.write(table, columns, blocks) + 1, dtype=np.int64)
+
+
+def write_dataset(writer, dataset, log=None, workers=1):
+    """
+    Write users, beers, reviews and recommendations of dataset, returns ids of users and beers.
+    log(table, rows, seconds) is called after every chunk, reviews are generated by that many worker processes.
+    """
+    started = time.perf_counter()
+
+    def progress(table, rows):
+        if log is not None:
+            log(table, rows, time.perf_counter() - started)
+
+    user_ids = writer.insert('auth_user', USER_COLUMNS, csv_blocks(dataset.user_rows()))
+    progress('auth_user', dataset.users)
+    beer_ids = writer.insert('beer_app_beer', BEER_COLUMNS, csv_blocks(dataset.beer_rows()))
+    progress('beer_app_beer', dataset.beers)
+    written = 0
+    for blocks, rows in review_texts(dataset, user_ids, beer_ids, workers):
+        writer.write('beer_app_beerreview', REVIEW_COLUMNS, blocks)
+        written += rows
+        progress('beer_app_beerreview', written)
+    written = 0
+    for users, beers in dataset.recommendation_chunks():
+        columns = [user_ids[users]] + [beer_ids[beers[:, rank]] for rank in range(10)]
+        writer.write('beer_app_beerrecommendation', RECOMMENDATION_COLUMNS, column_blocks(columns, delimiter=';'),
+                     delimiter=';')
+        written += users.shape[0]
+        progress('beer_app_beerrecommendation', written)
+    return user_ids, beer_ids
+
+
+def load_dataset(connection, users=1000, beers=5000, reviews=100000, seed=0):
+    """
+    Add synthetic dataset to database of connection, returns ids of created users and beers.
+    """
+    with connection.cursor() as cursor:
+        user_ids, beer_ids = write_dataset(DatabaseWriter(cursor), SyntheticDataset(users, beers, reviews, seed))
+        cursor.execute('ANALYZE')
+    return user_ids.tolist(), beer_ids.tolist()
@@ -1,19 +1,118 @@
+import glob
+import hashlib
 import os
+import django
+from django.apps import apps
 from django.test.runner import DiscoverRunner
+from django.test.utils import setup_databases
 from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from beer_app.test.query_budget import SlowQueryReport
+
+# Test database is created from a template database seeded with test_data CSVs. The template
+# is built by the first run and kept on the server under a name containing hash of everything
+# its content depends on, later runs clone it with CREATE DATABASE ... TEMPLATE instead of
+# loading CSVs again. Templates of previous hashes are dropped when a new one is built.
+
+TEST_DATA_PATH = os.path.join(settings.BASE_DIR, 'beer_app', 'test', 'test_data')
+TEST_DATA_CSVS = ['user.csv', 'beer.csv', 'review.csv', 'recommendations.csv']
+MAX_DATABASE_NAME = 63
+
+
+def fixture_hash():
+    """
+    Hash of test_data CSVs, models and migrations of installed apps, Django version and this runner.
+    """
+    digest = hashlib.sha256(django.get_version().encode())
+    paths = [os.path.join(TEST_DATA_PATH, name) for name in TEST_DATA_CSVS] + [__file__]
+    for app_config in apps.get_app_configs():
+        if app_config.models_module is not None:
+            paths.append(app_config.models_module.__file__)
+        paths += sorted(glob.glob(os.path.join(app_config.path, 'migrations', '*.py')))
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def template_prefix(test_database_name):
+    return test_database_name[:MAX_DATABASE_NAME - len('_template_') - 12] + '_template_'
+
+
+def template_name(test_database_name, digest):
+    return template_prefix(test_database_name) + digest[:12]
 
 
 class CSVLoadingTestRunner(DiscoverRunner):
 
-    def setup_databases(self, *args, **kwargs):
-        old_names = super(CSVLoadingTestRunner, self).setup_databases(*args, **kwargs)
-        from django.db import connection
+    def __init__(self, *args, slow_queries=10, rebuild_template=False, **kwargs):
+        super(CSVLoadingTestRunner, self).__init__(*args, **kwargs)
+        self.slow_queries = slow_queries
+        self.rebuild_template = rebuild_template
+
+    @classmethod
+    def add_arguments(cls, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--slow-queries', type=int, default=10,
+                            help='number of slowest statements of the run to report, 0 disables the report')
+        parser.add_argument('--rebuild-template', action='store_true',
+                            help='load test_data CSVs again into a new template database')
+
+    def setup_test_environment(self, *args, **kwargs):
+        super(CSVLoadingTestRunner, self).setup_test_environment(*args, **kwargs)
+        # events are written only by explicit flush, inside test transaction
+        settings.RECOMMENDATION_LOG['BACKGROUND'] = False
+
+    def setup_databases(self, **kwargs):
+        aliases = kwargs.get('aliases')
+        if aliases is not None and DEFAULT_DB_ALIAS not in aliases:
+            # no test of the run uses database
+            return super(CSVLoadingTestRunner, self).setup_databases(**kwargs)
+        connection = connections[DEFAULT_DB_ALIAS]
+        test_database_name = connection.creation._get_test_db_name()
+        template = template_name(test_database_name, fixture_hash())
+        with connection._nodb_cursor() as cursor:
+            cursor.execute('SELECT datname FROM pg_catalog.pg_database')
+            databases = [row[0] for row in cursor.fetchall()]
+        reuse = template in databases and not self.rebuild_template
+
+        test_settings = connection.settings_dict['TEST']
+        old_template = test_settings.get('TEMPLATE')
+        if reuse:
+            test_settings['TEMPLATE'] = template
+        try:
+            old_names = setup_databases(
+                self.verbosity, self.interactive, time_keeper=self.time_keeper,
+                # kept database may hold data of another template
+                keepdb=self.keepdb and reuse, debug_sql=self.debug_sql,
+                # per worker clones are made below from seeded database, not from empty one
+                parallel=0, **kwargs)
+        finally:
+            test_settings['TEMPLATE'] = old_template
+
+        if not reuse:
+            with self.time_keeper.timed("  Seeding '%s'" % DEFAULT_DB_ALIAS):
+                self.load_test_data(connection)
+            with self.time_keeper.timed("  Creating template '%s'" % template):
+                self.create_template(connection, template, [
+                    name for name in databases if name.startswith(template_prefix(test_database_name))])
+        if self.parallel > 1:
+            for index in range(self.parallel):
+                with self.time_keeper.timed("  Cloning '%s'" % DEFAULT_DB_ALIAS):
+                    connection.creation.clone_test_db(suffix=str(index + 1), verbosity=self.verbosity,
+                                                      keepdb=self.keepdb and reuse)
+        return old_names
+
+    def load_test_data(self, connection):
         with connection.cursor() as cursor:
-            test_data_path = os.path.join(settings.BASE_DIR, 'beer_app', 'test', 'test_data')
-            user_csv_path = os.path.join(test_data_path, 'user.csv')
-            beer_csv_path = os.path.join(test_data_path, 'beer.csv')
-            beer_review_csv_path = os.path.join(test_data_path, 'review.csv')
-            beer_recommendations_csv_path = os.path.join(test_data_path, 'recommendations.csv')
+            user_csv_path = os.path.join(TEST_DATA_PATH, 'user.csv')
+            beer_csv_path = os.path.join(TEST_DATA_PATH, 'beer.csv')
+            beer_review_csv_path = os.path.join(TEST_DATA_PATH, 'review.csv')
+            beer_recommendations_csv_path = os.path.join(TEST_DATA_PATH, 'recommendations.csv')
             cursor.execute("""
                            COPY auth_user(username, email, password, is_superuser, is_staff, is_active, first_name, last_name, date_joined)
                            FROM %s
@@ -38,21 +137,36 @@ class CSVLoadingTestRunner(DiscoverRunner):
                            DELIMITER ';'
                            CSV HEADER;
                            """, [beer_recommendations_csv_path])
-        return old_names
+            cursor.execute('ANALYZE')
+
+    def create_template(self, connection, template, old_templates):
+        """ Copy seeded test database to template, dropping old_templates """
+        quote_name = connection.ops.quote_name
+        # CREATE DATABASE ... TEMPLATE fails while anyone is connected to source database
+        connections.close_all()
+        with connection._nodb_cursor() as cursor:
+            for name in old_templates:
+                cursor.execute('DROP DATABASE IF EXISTS {}'.format(quote_name(name)))
+            cursor.execute('CREATE DATABASE {} WITH TEMPLATE {}'.format(
+                quote_name(template), quote_name(connection.settings_dict['NAME'])))
+
+    def run_suite(self, suite, **kwargs):
+        if not self.slow_queries:
+            return super(CSVLoadingTestRunner, self).run_suite(suite, **kwargs)
+        if self.parallel > 1:
+            # statements run in worker processes, execute_wrapper of this process sees none of them
+            self.log('Slow query report is not available with --parallel, use --parallel 1')
+            return super(CSVLoadingTestRunner, self).run_suite(suite, **kwargs)
+        # statements of tests only, fixture loading is not recorded
+        report = SlowQueryReport()
+        with report.record():
+            result = super(CSVLoadingTestRunner, self).run_suite(suite, **kwargs)
+        self.log(report.format(self.slow_queries))
+        return result
 
     def teardown_databases(self, *args, **kwargs):
-        from django.db import connection
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                           DELETE FROM beer_app_beerrecommendation;
-                           """)
-            cursor.execute("""
-                           DELETE FROM beer_app_beerreview;
-                           """)
-            cursor.execute("""
-                           DELETE FROM beer_app_beer;
-                           """)
-            cursor.execute("""
-                           DELETE FROM auth_user;
-                           """)
+        from beer_app.event_log import get_event_log
+        # events served by tests and never flushed must not be written by atexit flush after teardown
+        get_event_log().clear()
+        # test database and its clones are dropped, template database is kept for next run
         super(CSVLoadingTestRunner, self).teardown_databases(*args, **kwargs)
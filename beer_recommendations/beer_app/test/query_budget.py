@@ -0,0 +1,129 @@
+import difflib
+import re
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from django.db import connections
+
+# SQL instrumentation for tests. QueryRecorder records every statement executed on any
+# database alias with its duration and normalized form (literals and placeholders replaced,
+# IN lists collapsed), so statements differing only in parameters compare equal.
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN \((?:\?, )*\?\)', re.IGNORECASE)
+_SPACE = re.compile(r'\s+')
+_SAVEPOINT = re.compile(r'\bSAVEPOINT "?\w+"?', re.IGNORECASE)
+
+
+def normalize(sql):
+    # savepoint names are unique per transaction
+    sql = _SAVEPOINT.sub('SAVEPOINT ?', sql)
+    sql = _STRING.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = _NUMBER.sub('?', sql)
+    sql = _SPACE.sub(' ', sql).strip()
+    return _IN_LIST.sub('IN (...)', sql)
+
+
+class QueryRecorder:
+    """
+    execute_wrapper recording (normalized sql, sql, seconds) of every statement.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.add(normalize(sql), sql, time.perf_counter() - start)
+
+    def add(self, statement, sql, seconds):
+        with self.lock:
+            self.queries.append((statement, sql, seconds))
+
+    @contextmanager
+    def record(self):
+        """ Record statements of all database aliases of the current thread """
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+    @property
+    def statements(self):
+        return [statement for statement, _, _ in self.queries]
+
+    @property
+    def seconds(self):
+        return sum(seconds for _, _, seconds in self.queries)
+
+
+class QueryBudgetMixin:
+    """
+    assertQueryBudget for test cases, e.g. budget of one request:
+
+        with self.assertQueryBudget(2):
+            self.client.get('/beer')
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, queries, milliseconds=None):
+        recorder = QueryRecorder()
+        with recorder.record():
+            yield recorder
+        over_count = len(recorder.queries) > queries
+        over_time = milliseconds is not None and recorder.seconds * 1000 > milliseconds
+        if over_count or over_time:
+            self.fail(budget_message(recorder, queries, milliseconds))
+
+
+def budget_message(recorder, queries, milliseconds=None):
+    """
+    Failure message with diff of distinct statements against executed ones,
+    statements executed repeatedly (N+1 patterns) show up as added lines.
+    """
+    header = '{} queries in {:.1f} ms, budget is {} queries'.format(
+        len(recorder.queries), recorder.seconds * 1000, queries)
+    if milliseconds is not None:
+        header += ' in {} ms'.format(milliseconds)
+    statements = recorder.statements
+    distinct = list(dict.fromkeys(statements))
+    diff = difflib.unified_diff(distinct, statements, 'distinct statements', 'executed statements', lineterm='', n=1)
+    if len(distinct) == len(statements):
+        return '\n'.join([header] + statements)
+    return '\n'.join([header] + list(diff))
+
+
+class SlowQueryReport(QueryRecorder):
+    """
+    Totals per normalized statement over a whole test run, statements themselves are not kept.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # statement -> (executions, total seconds, max seconds)
+        self.totals = {}
+
+    def add(self, statement, sql, seconds):
+        with self.lock:
+            executions, total, longest = self.totals.get(statement, (0, 0.0, 0.0))
+            self.totals[statement] = (executions + 1, total + seconds, max(longest, seconds))
+
+    def top(self, count):
+        """ (statement, executions, total seconds, max seconds) with highest total time first """
+        with self.lock:
+            ranked = sorted(self.totals.items(), key=lambda item: item[1][1], reverse=True)[:count]
+        return [(statement, executions, total, longest) for statement, (executions, total, longest) in ranked]
+
+    def format(self, count, width=160):
+        lines = ['Slowest statements by total time:', '{:>10}{:>12}{:>10}  statement'.format('calls', 'total ms', 'max ms')]
+        for statement, executions, total, longest in self.top(count):
+            if len(statement) > width:
+                statement = statement[:width - 3] + '...'
+            lines.append('{:>10}{:>12.1f}{:>10.1f}  {}'.format(executions, total * 1000, longest * 1000, statement))
+        return '\n'.join(lines)
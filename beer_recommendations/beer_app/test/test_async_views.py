@@ -0,0 +1,93 @@
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+from django.contrib.auth.models import User
+from beer_app.models import Beer
+import json
+
+
+class AsyncViewTests(APITestCase):
+
+    def setUp(self):
+        user = User.objects.get(username='stcules')
+        token, _ = Token.objects.get_or_create(user=user)
+        # async views authenticate from header, force_authenticate doesn't apply
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(token.key))
+
+    def assertSameAsSync(self, url):
+        sync_response = self.client.get(url)
+        async_response = self.client.get('/async' + url)
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        # pagination links differ only by /async prefix
+        async_data = json.loads(async_response.content.decode().replace('/async/', '/'))
+        self.assertEqual(async_data, json.loads(sync_response.content))
+        return async_data
+
+    def test_beer_list_same_as_sync(self):
+        """
+        Ensure async beer list returns same pages and filters as sync view.
+        """
+        self.assertSameAsSync('/beer')
+        self.assertSameAsSync('/beer?page=3')
+        self.assertSameAsSync('/beer?beer_style=Lager&beer_name=Light')
+        data = self.assertSameAsSync('/beer?beer_style=Ale&page=2')
+        self.assertIsNotNone(data['previous'])
+
+    def test_beer_detail_same_as_sync(self):
+        """
+        Ensure async beer detail returns same data as sync view, including is_reviewed.
+        """
+        data = self.assertSameAsSync('/beer/38567')
+        self.assertEqual(data['is_reviewed'], 973423)
+        self.assertSameAsSync('/beer/999999999')
+
+    def test_format_suffix_same_as_sync(self):
+        """
+        Ensure async views accept .json format suffix as sync views do.
+        """
+        beer = Beer.objects.order_by('id').first()
+        data = self.assertSameAsSync('/beer/{}.json'.format(beer.id))
+        self.assertEqual(data['id'], beer.id)
+        self.assertSameAsSync('/beer.json')
+        self.assertSameAsSync('/beer_review.json')
+
+    def test_beer_review_list_same_as_sync(self):
+        """
+        Ensure async review list returns same pages as sync view.
+        """
+        data = self.assertSameAsSync('/beer_review?page=2')
+        self.assertEqual(data['count'], 1788)
+        self.assertEqual(len(data['results']), 10)
+
+    def test_beer_recommendations_same_as_sync(self):
+        """
+        Ensure async recommendations return same data as sync view.
+        """
+        self.assertSameAsSync('/beer_recs')
+
+    def test_invalid_page(self):
+        """
+        Ensure out of range page returns not found.
+        """
+        response = self.client.get('/async/beer_review?page=1000')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(json.loads(response.content), {'detail': 'Invalid page.'})
+
+    def test_invalid_credentials(self):
+        """
+        Ensure async views reject invalid token with rest_framework error.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format('invalid_test'))
+        response = self.client.get('/async/beer')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(json.loads(response.content), {'detail': 'Invalid token.'})
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+
+    def test_without_credentials_header(self):
+        """
+        Ensure async views require credentials header.
+        """
+        self.client.credentials()
+        response = self.client.get('/async/beer_recs')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(json.loads(response.content), {'detail': 'Authentication credentials were not provided.'})
@@ -0,0 +1,78 @@
+import csv
+import os
+import tempfile
+import numpy as np
+from django.test import SimpleTestCase
+from beer_app import urls
+from beer_app.benchmark import SCENARIOS, routes
+from beer_app.synthetic import FileWriter, SyntheticDataset, write_dataset
+
+
+class SyntheticDatasetTests(SimpleTestCase):
+
+    def test_rows_depend_only_on_seed(self):
+        """
+        Ensure same seed generates same dataset and other seed a different one.
+        """
+        def files(seed):
+            with tempfile.TemporaryDirectory() as directory:
+                write_dataset(FileWriter(directory), SyntheticDataset(50, 200, 1000, seed=seed))
+                return {name: open(os.path.join(directory, name)).read() for name in sorted(os.listdir(directory))}
+
+        first = files(1)
+        self.assertEqual(sorted(first), ['beer.csv', 'recommendations.csv', 'review.csv', 'user.csv'])
+        self.assertEqual(first, files(1))
+        self.assertNotEqual(first['review.csv'], files(2)['review.csv'])
+        self.assertEqual(first['review.csv'].count('\n'), 1001)
+        self.assertEqual(first['recommendations.csv'].splitlines()[1].count(';'), 10)
+
+    def test_reviews_are_unique_per_user_and_beer(self):
+        """
+        Ensure every user has a review, reviews add up and every user reviews a beer once.
+        """
+        dataset = SyntheticDataset(100, 500, 20000, seed=3)
+        chunk = dataset.review_chunk(0, dataset.users)
+        users, beers = chunk['review_user_id'], chunk['review_beer_id']
+        self.assertEqual(users.shape[0], 20000)
+        self.assertEqual(np.unique(users * dataset.beers + beers).shape[0], 20000)
+        self.assertEqual(np.bincount(users, minlength=100).tolist(), dataset.review_counts.tolist())
+        self.assertGreaterEqual(dataset.review_counts.min(), 1)
+        self.assertLessEqual(dataset.review_counts.max(), 250)
+        self.assertTrue(2 <= chunk['review_overall'].min() and chunk['review_overall'].max() <= 10)
+        for _, recommended in dataset.recommendation_chunks():
+            self.assertTrue(all(len(set(row)) == 10 for row in recommended.tolist()))
+
+    def test_review_columns_fit_model_fields(self):
+        """
+        Ensure aspect columns are written as integers and review_overall in half points, as COPY into BeerReview needs.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            write_dataset(FileWriter(directory), SyntheticDataset(50, 200, 1000, seed=4))
+            with open(os.path.join(directory, 'review.csv'), newline='') as f:
+                rows = list(csv.DictReader(f))
+        self.assertEqual(len(rows), 1000)
+        for name in ['review_aroma', 'review_appearance', 'review_palate', 'review_taste']:
+            self.assertEqual({row[name] for row in rows} - {'1', '2', '3', '4', '5'}, set())
+        self.assertEqual({row['review_overall'] for row in rows} - {'{:.1f}'.format(half / 2) for half in range(2, 11)},
+                         set())
+
+    def test_reviews_follow_power_law(self):
+        """
+        Ensure a few beers get most reviews with default skew and none with skew 0.
+        """
+        def top_share(beer_skew):
+            dataset = SyntheticDataset(2000, 1000, 20000, beer_skew=beer_skew)
+            counts = np.sort(np.bincount(dataset.review_chunk(0, dataset.users)['review_beer_id']))[::-1]
+            return counts[:10].sum() / counts.sum()
+
+        self.assertGreater(top_share(1.0), 0.1)
+        self.assertLess(top_share(0.0), 0.05)
+
+
+class BenchmarkScenarioTests(SimpleTestCase):
+
+    def test_every_route_has_scenario(self):
+        """
+        Ensure benchmark_api drives every route of beer_app.urls.
+        """
+        self.assertEqual([route for route in routes(urls.urlpatterns) if route not in SCENARIOS], [])
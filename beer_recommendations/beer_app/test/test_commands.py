@@ -0,0 +1,29 @@
+from io import StringIO
+from rest_framework.test import APITestCase
+from beer_app.models import BeerReview
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from decimal import Decimal
+import os
+import tempfile
+
+
+class ImportReviewsCommandTests(APITestCase):
+
+    def test_import_reviews_from_csv_file(self):
+        """
+        Ensure import_reviews command loads CSV file and reports throughput.
+        """
+        review_counts = BeerReview.objects.count()
+        user = User.objects.get(username='stcules')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'reviews.csv')
+            with open(path, 'w') as f:
+                f.write('review_user,review_beer,review_overall,review_aroma,review_appearance,review_palate,review_taste\n')
+                f.write('{},100,2.5,2,3,2,3\n'.format(user.id))
+            out = StringIO()
+            call_command('import_reviews', path, '--batch-size', '1', stdout=out)
+        self.assertTrue('Imported 1 reviews (1 created, 0 updated)' in out.getvalue())
+        self.assertTrue('rows/sec' in out.getvalue())
+        self.assertEqual(BeerReview.objects.count(), review_counts + 1)
+        self.assertEqual(BeerReview.objects.get(review_user=user, review_beer=100).review_overall, Decimal('2.5'))
@@ -0,0 +1,157 @@
+import os
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest import mock
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from beer_app.models import Beer, BeerCandidates, RecommendationEvent
+from beer_app.rerank import unpack
+
+# cron_job.py and recommender_eval.py are standalone scripts next to Django project
+sys.path.insert(0, os.path.dirname(settings.BASE_DIR))
+import cron_job
+import recommender_eval
+
+
+class CronJobRunTests(SimpleTestCase):
+
+    def run_stages(self, data_dir, *args):
+        ran = []
+        stage_functions = {stage: (lambda checkpoints, options, stage=stage: ran.append(stage)) for stage in cron_job.STAGES}
+        with mock.patch.dict(cron_job.STAGE_FUNCTIONS, stage_functions), redirect_stdout(StringIO()):
+            cron_job.run(cron_job.parse_args(['--data-dir', data_dir] + list(args)))
+        return ran
+
+    def test_published_run_is_not_resumed(self):
+        """
+        Ensure run after a published one runs every stage again and each run has its own report.
+        """
+        with tempfile.TemporaryDirectory() as data_dir:
+            self.assertEqual(self.run_stages(data_dir), cron_job.STAGES)
+            self.assertEqual(self.run_stages(data_dir), cron_job.STAGES)
+            reports = os.listdir(os.path.join(data_dir, cron_job.RUNS_DIR))
+            self.assertEqual(len(reports), 2)
+            checkpoints = cron_job.Checkpoints(data_dir)
+            self.assertFalse(checkpoints.is_done('extract'))
+            self.assertTrue(checkpoints.has_output('extract'))
+
+    def test_interrupted_run_is_resumed(self):
+        """
+        Ensure run stopped before publish is continued after its last completed stage.
+        """
+        with tempfile.TemporaryDirectory() as data_dir:
+            self.assertEqual(self.run_stages(data_dir, '--to-stage', 'train'), ['extract', 'index', 'train'])
+            self.assertEqual(self.run_stages(data_dir), ['score', 'fill', 'publish'])
+
+
+class ImplicitAlsTests(SimpleTestCase):
+
+    def test_conjugate_gradient_solves_normal_equations(self):
+        """
+        Ensure conjugate gradient converges to exact solution of (Y^T C_u Y + reg I) x_u = Y^T C_u p_u of every user.
+        """
+        rng = np.random.default_rng(0)
+        n_users, n_beers, rank, reg_param = 6, 9, 4, 0.1
+        # last user has no reviews
+        pairs = np.array([(user, beer) for user in range(n_users - 1) for beer in range(n_beers) if rng.random() < 0.4])
+        user_index, beer_index = pairs[:, 0], pairs[:, 1]
+        confidence = 10.0 * rng.random(pairs.shape[0])
+        beer_factors = rng.standard_normal((n_beers, rank))
+        user_factors = rng.standard_normal((n_users, rank)) * 0.01
+        cron_job.conjugate_gradient(user_factors, beer_factors,
+                                    *cron_job.sorted_by_rows(user_index, beer_index, confidence, n_users), reg_param, 50)
+        for user in range(n_users):
+            c = np.ones(n_beers)
+            p = np.zeros(n_beers)
+            c[beer_index[user_index == user]] += confidence[user_index == user]
+            p[beer_index[user_index == user]] = 1
+            expected = np.linalg.solve(beer_factors.T @ (c[:, None] * beer_factors) + reg_param * np.eye(rank),
+                                       beer_factors.T @ (c * p))
+            np.testing.assert_allclose(user_factors[user], expected, atol=1e-6)
+
+    def test_review_weights_decay_with_age(self):
+        """
+        Ensure weight is mean review score out of 5, halved every half_life_days before newest review.
+        """
+        data = {name: np.array([5.0, 5.0, 2.5]) for name in cron_job.REVIEW_SIGNALS}
+        data['review_time'] = np.array([0.0, 10 * 86400.0, 10 * 86400.0])
+        weights = cron_job.review_weights(data, np.ones(3, dtype=bool), half_life_days=10)
+        np.testing.assert_allclose(weights, [0.5, 1.0, 0.5])
+
+
+class TopUnseenTests(SimpleTestCase):
+
+    def test_reviewed_beers_are_excluded(self):
+        """
+        Ensure ranked lists are best scored unreviewed beers, padded with -1 once user has reviewed nearly all.
+        """
+        rng = np.random.default_rng(1)
+        n_users, n_beers, count = 7, 12, 5
+        user_factors = rng.standard_normal((n_users, 3)).astype(np.float32)
+        beer_factors = rng.standard_normal((n_beers, 3)).astype(np.float32)
+        reviewed = {user: set(rng.choice(n_beers, size=rng.integers(0, 5), replace=False).tolist()) for user in range(n_users)}
+        # last user has reviewed all but two beers
+        reviewed[n_users - 1] = set(range(n_beers - 2))
+        user_index = np.array([user for user in reviewed for _ in reviewed[user]], dtype=np.int32)
+        beer_index = np.array([beer for user in reviewed for beer in reviewed[user]], dtype=np.int32)
+        top, scores = cron_job.top_unseen_matrix(user_factors, beer_factors, user_index, beer_index, count=count,
+                                                 chunk_size=3, with_scores=True)
+        for user in range(n_users):
+            user_scores = user_factors[user] @ beer_factors.T
+            unseen = sorted(set(range(n_beers)) - reviewed[user], key=lambda beer: -user_scores[beer])[:count]
+            self.assertEqual(top[user][:len(unseen)].tolist(), unseen)
+            self.assertTrue(all(beer == -1 for beer in top[user][len(unseen):]))
+            np.testing.assert_allclose(scores[user][:len(unseen)], user_scores[unseen], rtol=1e-5)
+        self.assertEqual(sorted(top[n_users - 1][:2].tolist()), [n_beers - 2, n_beers - 1])
+        self.assertEqual(top[n_users - 1][2:].tolist(), [-1] * 3)
+        self.assertTrue(np.isneginf(scores[n_users - 1][2:]).all())
+
+
+class PublishCandidatesTests(TestCase):
+
+    def test_candidates_are_copied_into_model_table(self):
+        """
+        Ensure write_candidates file is loaded by publish stage COPY into table of BeerCandidates.
+        """
+        self.assertEqual(cron_job.CANDIDATES_TABLE, BeerCandidates._meta.db_table)
+        user_ids = np.array(User.objects.order_by('id').values_list('id', flat=True)[:2])
+        beer_ids = np.array(Beer.objects.order_by('id').values_list('id', flat=True)[:5])
+        # second user has one candidate, -1 entries are not stored
+        candidates = np.array([[4, 0, 2], [1, -1, -1]], dtype=np.int32)
+        candidate_scores = np.array([[3.0, 2.0, 1.5], [0.5, -np.inf, -np.inf]], dtype=np.float32)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'candidates.csv')
+            cron_job.write_candidates(path, user_ids, beer_ids, candidates, candidate_scores)
+            with connection.cursor() as cursor:
+                cron_job.copy_candidates(cursor, path)
+        first = BeerCandidates.objects.get(user_id=user_ids[0])
+        self.assertEqual(list(unpack(first.beer_ids, 'i')), beer_ids[[4, 0, 2]].tolist())
+        self.assertEqual(list(unpack(first.scores, 'f')), [3.0, 2.0, 1.5])
+        second = BeerCandidates.objects.get(user_id=user_ids[1])
+        self.assertEqual(list(unpack(second.beer_ids, 'i')), [beer_ids[1]])
+        self.assertEqual(list(unpack(second.scores, 'f')), [0.5])
+
+
+class ExtractEventsTests(TestCase):
+
+    def test_events_are_read_from_model_table(self):
+        """
+        Ensure recommender_eval reads impressions and reviews logged in table of RecommendationEvent.
+        """
+        self.assertEqual(recommender_eval.EVENTS_TABLE, RecommendationEvent._meta.db_table)
+        user = User.objects.order_by('id').first()
+        beer = Beer.objects.order_by('id').first()
+        RecommendationEvent.objects.create(user=user, beer=beer, event='impression', source='beer_recs', position=3)
+        RecommendationEvent.objects.create(user=user, beer=beer, event='review')
+        # test database connection stays open for other tests
+        conn = mock.Mock(cursor=connection.cursor)
+        with mock.patch.object(cron_job, 'connect', return_value=conn), redirect_stdout(StringIO()):
+            impressions, reviews = recommender_eval.extract_events()
+        self.assertEqual(impressions[['user_id', 'beer_id', 'source', 'position']].values.tolist(),
+                         [[user.id, beer.id, 'beer_recs', 3]])
+        self.assertEqual(reviews[['user_id', 'beer_id', 'position']].values.tolist(), [[user.id, beer.id, 0]])
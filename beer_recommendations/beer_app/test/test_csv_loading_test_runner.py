@@ -0,0 +1,42 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+from django.test import SimpleTestCase
+from beer_app.test import csv_loading_test_runner
+from beer_app.test.csv_loading_test_runner import MAX_DATABASE_NAME, fixture_hash, template_name, template_prefix
+
+
+class TemplateDatabaseTests(SimpleTestCase):
+
+    def setUp(self):
+        self.test_data = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_data)
+        for name in csv_loading_test_runner.TEST_DATA_CSVS:
+            with open(os.path.join(self.test_data, name), 'w') as f:
+                f.write('header\n')
+        patcher = mock.patch.object(csv_loading_test_runner, 'TEST_DATA_PATH', self.test_data)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_hash_changes_with_test_data(self):
+        """
+        Ensure template hash is stable and changes once a CSV changes.
+        """
+        digest = fixture_hash()
+        self.assertEqual(fixture_hash(), digest)
+        with open(os.path.join(self.test_data, 'review.csv'), 'a') as f:
+            f.write('2020-01-01T00:00:00Z,4.0,4,4,4,4,1,1\n')
+        self.assertNotEqual(fixture_hash(), digest)
+
+    def test_template_name_fits_postgres_limit(self):
+        """
+        Ensure template name keeps hash within PostgreSQL identifier length for long database names.
+        """
+        digest = fixture_hash()
+        name = template_name('test_' + 'x' * 80, digest)
+        self.assertEqual(len(name), MAX_DATABASE_NAME)
+        self.assertTrue(name.endswith(digest[:12]))
+        self.assertTrue(name.startswith(template_prefix('test_' + 'x' * 80)))
+        self.assertEqual(template_name('test_beer_recommendations', digest),
+                         'test_beer_recommendations_template_' + digest[:12])
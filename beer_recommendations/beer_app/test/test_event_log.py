@@ -0,0 +1,56 @@
+from rest_framework import status
+from rest_framework.test import APITestCase
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase
+from beer_app.event_log import EventLog, get_event_log
+from beer_app.models import BeerRecommendation, RecommendationEvent
+
+
+class EventLogTests(SimpleTestCase):
+
+    def test_buffer_is_bounded(self):
+        """
+        Ensure oldest events are dropped once buffer is full.
+        """
+        event_log = EventLog(max_buffer=3, background=False)
+        event_log.add([(1, beer_id, 'impression', 'beer_recs', beer_id, None) for beer_id in range(1, 6)])
+        self.assertEqual(event_log.stats(), {'buffered': 3, 'written': 0, 'dropped': 2})
+        self.assertEqual([event[1] for event in event_log.buffer], [3, 4, 5])
+
+
+class RecommendationEventTests(APITestCase):
+
+    def setUp(self):
+        self.event_log = get_event_log()
+        self.event_log.clear()
+        self.user = User.objects.get(username='stcules')
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        self.event_log.clear()
+
+    def test_served_recommendations_are_logged(self):
+        """
+        Ensure beer_recs logs impression of every served beer with its position.
+        """
+        recommendation = BeerRecommendation.objects.get(recommendation_user=self.user)
+        response = self.client.get('/beer_recs')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(RecommendationEvent.objects.count(), 0)
+        self.assertEqual(self.event_log.flush(), 10)
+        events = RecommendationEvent.objects.filter(user=self.user).order_by('position')
+        self.assertEqual([event.beer_id for event in events],
+                         [getattr(recommendation, 'top{}_beer_id'.format(i)) for i in range(1, 11)])
+        self.assertTrue(all(event.event == 'impression' and event.source == 'beer_recs' for event in events))
+
+    def test_review_is_logged(self):
+        """
+        Ensure posted review is logged as feedback event.
+        """
+        data = {'review_beer': 100, 'review_overall': '4.5', 'review_aroma': 4,
+                'review_appearance': 4, 'review_palate': 4, 'review_taste': 4}
+        response = self.client.post('/beer_review_post', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.event_log.flush(), 1)
+        event = RecommendationEvent.objects.get(user=self.user)
+        self.assertEqual((event.event, event.beer_id, event.position), ('review', 100, None))
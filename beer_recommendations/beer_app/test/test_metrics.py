@@ -0,0 +1,95 @@
+import threading
+import time
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase
+from beer_app.metrics import MetricsRegistry, PhaseTimer, escape, get_registry, reset_registry
+
+
+class PhaseTimerTests(SimpleTestCase):
+
+    def test_phases_add_up_to_total(self):
+        """
+        Ensure nested phase stops outer one and phases add up to total.
+        """
+        timer = PhaseTimer()
+        timer.switch('serialization')
+        with timer.measure('auth'):
+            time.sleep(0.01)
+        self.assertEqual(timer.phase, 'serialization')
+        total = timer.stop()
+        self.assertTrue(timer.phases['auth'] >= 0.01)
+        self.assertAlmostEqual(sum(timer.phases.values()), total, places=6)
+
+
+class MetricsRegistryTests(SimpleTestCase):
+
+    def test_render_merges_thread_shards(self):
+        """
+        Ensure histograms counted by different threads are merged into cumulative buckets.
+        """
+        registry = MetricsRegistry([0.1, 1.0])
+
+        def observe(seconds):
+            timer = PhaseTimer()
+            timer.phases['db'] = seconds
+            timer.queries = 2
+            registry.observe('beer/<int:pk>', 'GET', 200, timer, seconds)
+
+        threads = [threading.Thread(target=observe, args=(seconds,)) for seconds in [0.05, 0.5, 5.0]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        text = registry.render()
+        self.assertIn('beer_requests_total{view="beer/<int:pk>",method="GET",status="200"} 3', text)
+        self.assertIn('beer_db_queries_total{view="beer/<int:pk>"} 6', text)
+        self.assertIn('beer_request_duration_seconds_bucket{view="beer/<int:pk>",phase="db",le="0.1"} 1', text)
+        self.assertIn('beer_request_duration_seconds_bucket{view="beer/<int:pk>",phase="db",le="1"} 2', text)
+        self.assertIn('beer_request_duration_seconds_bucket{view="beer/<int:pk>",phase="db",le="+Inf"} 3', text)
+        self.assertIn('beer_request_duration_seconds_sum{view="beer/<int:pk>",phase="total"} 5.550000', text)
+        self.assertEqual(escape('a"b\\c'), 'a\\"b\\\\c')
+
+
+class MetricsMiddlewareTests(APITestCase):
+
+    def setUp(self):
+        reset_registry()
+        user = User.objects.get(username='stcules')
+        token, _ = Token.objects.get_or_create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(token.key))
+
+    def tearDown(self):
+        reset_registry()
+
+    def test_requests_are_measured_by_view_and_phase(self):
+        """
+        Ensure requests are counted per route with their queries and time of every phase.
+        """
+        self.assertEqual(self.client.get('/beer').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get('/async/beer').status_code, status.HTTP_200_OK)
+        requests, durations, queries = get_registry().collect()
+        self.assertEqual(requests[('beer', 'GET', 200)], 1)
+        self.assertEqual(requests[('async/beer', 'GET', 200)], 1)
+        # token lookup, page count and page
+        self.assertEqual(queries['beer'], 3)
+        self.assertEqual(queries['async/beer'], 3)
+        for phase in ['total', 'middleware', 'auth', 'db', 'serialization', 'render']:
+            counts, seconds = durations[('beer', phase)]
+            self.assertEqual(sum(counts), 1)
+        self.assertTrue(durations[('beer', 'db')][1] > 0)
+
+    def test_metrics_endpoint(self):
+        """
+        Ensure metrics are served in Prometheus text format to allowed addresses only.
+        """
+        self.client.get('/beer')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn(b'beer_requests_total{view="beer",method="GET",status="200"} 1', response.content)
+        self.assertIn(b'# TYPE beer_request_duration_seconds histogram', response.content)
+        response = self.client.get('/metrics', REMOTE_ADDR='10.1.2.3')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
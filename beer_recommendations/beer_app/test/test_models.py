@@ -0,0 +1,85 @@
+from rest_framework.test import APITestCase
+from beer_app.models import Beer, BeerReview
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Avg, F
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from io import BytesIO
+from PIL import Image
+import shutil
+import tempfile
+
+
+class BeerReviewIndexTests(APITestCase):
+
+    def setUp(self):
+        # planner may still prefer sequential scans on small tables, so we
+        # check that indexes are usable rather than chosen by cost
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off;')
+
+    def test_review_list_uses_user_time_index(self):
+        """
+        Ensure user review history ordered by time is served by composite index.
+        """
+        user = User.objects.get(username='stcules')
+        queryset = BeerReview.objects.filter(review_user=user).order_by(F('review_time').desc(nulls_last=True))
+        plan = queryset.explain()
+        self.assertTrue('beerreview_user_time_idx' in plan)
+
+    def test_is_reviewed_probe_uses_unique_index(self):
+        """
+        Ensure (review_user, review_beer) probe is served by unique constraint index.
+        """
+        user = User.objects.get(username='stcules')
+        queryset = BeerReview.objects.filter(review_user=user, review_beer=38567).values('id')
+        plan = queryset.explain()
+        self.assertTrue('unique_user_beer_review' in plan)
+
+    def test_beer_averages_use_beer_overall_index(self):
+        """
+        Ensure grouping reviews by beer reads composite covering index.
+        """
+        queryset = BeerReview.objects.values('review_beer').annotate(average_rate=Avg('review_overall')).order_by('review_beer')
+        plan = queryset.explain()
+        self.assertTrue('beerreview_beer_overall_idx' in plan)
+
+
+class BeerThumbnailTests(APITestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+
+    def upload_beer(self, size):
+        content = BytesIO()
+        Image.new('RGBA', size, (200, 120, 0, 255)).save(content, format='PNG')
+        beer = Beer(beer_name='Thumbnail Ale', beer_style='Test style', brewery_name='Test brewery', beer_abv='5.0',
+                    beer_image=SimpleUploadedFile('label.png', content.getvalue(), content_type='image/png'))
+        beer.save()
+        return beer
+
+    def test_thumbnail_is_generated_on_upload(self):
+        """
+        Ensure resized variant of beer image is generated when image is uploaded.
+        """
+        with override_settings(MEDIA_ROOT=self.media_root, BEER_THUMBNAIL_SIZE=(64, 64)):
+            beer = self.upload_beer((640, 320))
+            self.assertTrue(beer.beer_thumbnail.name.startswith('beer/thumbnails/label_thumbnail'))
+            self.assertEqual(Image.open(beer.beer_thumbnail.path).size, (64, 32))
+            self.assertEqual(Image.open(beer.beer_image.path).size, (640, 320))
+
+    def test_list_endpoints_use_thumbnail(self):
+        """
+        Ensure beer lists return thumbnail url while beer detail returns original image.
+        """
+        user = User.objects.get(username='stcules')
+        self.client.force_authenticate(user=user)
+        with override_settings(MEDIA_ROOT=self.media_root, MEDIA_BASE_URL='https://cdn.example.com/media/'):
+            beer = self.upload_beer((640, 320))
+            response = self.client.get('/beer?beer_name=Thumbnail Ale', format='json')
+            self.assertEqual(response.data['results'][0]['beer_image'],
+                             'https://cdn.example.com/media/' + beer.beer_thumbnail.name)
+            response = self.client.get('/beer/{}'.format(beer.id), format='json')
+            self.assertEqual(response.data['beer_image'], 'https://cdn.example.com/media/' + beer.beer_image.name)
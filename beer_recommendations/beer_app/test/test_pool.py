@@ -0,0 +1,148 @@
+from django.test import SimpleTestCase
+from beer_app.pool import ConnectionPool, PoolTimeout
+import threading
+
+
+class FakeConnection:
+    """
+    Stand-in for DB-API connection.
+    """
+    def __init__(self, number):
+        self.number = number
+        self.closed = False
+        self.usable = True
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ConnectionPoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.opened = []
+        self.clock = FakeClock()
+
+    def connect(self):
+        connection = FakeConnection(len(self.opened))
+        self.opened.append(connection)
+        return connection
+
+    def make_pool(self, **kwargs):
+        kwargs.setdefault('health_check', lambda connection: connection.usable)
+        return ConnectionPool(self.connect, clock=self.clock, **kwargs)
+
+    def test_released_connection_is_reused(self):
+        """
+        Ensure released connection is handed out again instead of opening a new one.
+        """
+        pool = self.make_pool(max_size=2)
+        connection = pool.acquire()
+        pool.release(connection)
+        self.assertIs(pool.acquire(), connection)
+        self.assertEqual(len(self.opened), 1)
+
+    def test_fill_opens_min_size(self):
+        """
+        Ensure fill opens min_size connections once.
+        """
+        pool = self.make_pool(min_size=3, max_size=5)
+        pool.fill()
+        pool.fill()
+        self.assertEqual(len(self.opened), 3)
+        self.assertEqual(pool.stats(), {'size': 3, 'idle': 3, 'in_use': 0, 'max_size': 5})
+
+    def test_max_size_times_out(self):
+        """
+        Ensure acquire waits for a free connection and raises PoolTimeout when none is released.
+        """
+        pool = ConnectionPool(self.connect, max_size=1, timeout=0.05)
+        pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        self.assertEqual(len(self.opened), 1)
+
+    def test_waiting_acquire_gets_released_connection(self):
+        """
+        Ensure thread blocked at max_size gets connection released by another thread.
+        """
+        pool = ConnectionPool(self.connect, max_size=1, timeout=5)
+        connection = pool.acquire()
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+        thread.start()
+        pool.release(connection)
+        thread.join()
+        self.assertEqual(acquired, [connection])
+
+    def test_unhealthy_connection_is_replaced(self):
+        """
+        Ensure connection failing health check after idle interval is closed and replaced.
+        """
+        pool = self.make_pool(max_size=1, check_interval=30)
+        connection = pool.acquire()
+        pool.release(connection)
+        connection.usable = False
+        # not checked before check interval
+        self.assertIs(pool.acquire(), connection)
+        pool.release(connection)
+        self.clock.now += 31
+        replacement = pool.acquire()
+        self.assertIsNot(replacement, connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_discarded_connection_frees_slot(self):
+        """
+        Ensure discarded connection is closed and doesn't count to max_size.
+        """
+        pool = self.make_pool(max_size=1, timeout=0.05)
+        connection = pool.acquire()
+        pool.release(connection, discard=True)
+        self.assertTrue(connection.closed)
+        self.assertIsNot(pool.acquire(), connection)
+
+    def test_idle_connections_expire_to_min_size(self):
+        """
+        Ensure connections idle longer than max_idle are closed but min_size are kept.
+        """
+        pool = self.make_pool(min_size=1, max_size=3, max_idle=60)
+        connections = [pool.acquire() for _ in range(3)]
+        for connection in connections[:2]:
+            pool.release(connection)
+        self.clock.now += 61
+        pool.release(connections[2])
+        self.assertEqual(pool.stats(), {'size': 1, 'idle': 1, 'in_use': 0, 'max_size': 3})
+        self.assertEqual([connection.closed for connection in connections], [True, True, False])
+
+    def test_close_all(self):
+        """
+        Ensure close_all closes idle connections only.
+        """
+        pool = self.make_pool(max_size=2)
+        idle, in_use = pool.acquire(), pool.acquire()
+        pool.release(idle)
+        pool.close_all()
+        self.assertTrue(idle.closed)
+        self.assertFalse(in_use.closed)
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_failed_connect_frees_slot(self):
+        """
+        Ensure error while connecting doesn't leak pool slot.
+        """
+        def connect():
+            raise OSError('connection refused')
+        pool = ConnectionPool(connect, max_size=1, timeout=0.05)
+        for _ in range(2):
+            with self.assertRaises(OSError):
+                pool.acquire()
+        self.assertEqual(pool.stats()['size'], 0)
@@ -0,0 +1,115 @@
+from io import StringIO
+from unittest import mock
+from rest_framework import status
+from rest_framework.test import APITestCase
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db.models import Count, Sum
+from django.test import SimpleTestCase
+from beer_app.models import Beer, BeerReview, BeerPopularity, BeerRecommendation
+from beer_app import popularity
+from beer_app.popularity import PopularityTable, compute_top, get_table, reset_table, PRIOR_REVIEWS
+
+
+class PopularityTableTests(SimpleTestCase):
+
+    def setUp(self):
+        rows = [
+            {'id': 1, 'beer_style': 'Stout', 'brewery_name': 'A', 'score': 4.5},
+            {'id': 2, 'beer_style': 'IPA', 'brewery_name': 'B', 'score': 4.4},
+            {'id': 3, 'beer_style': 'Stout', 'brewery_name': 'B', 'score': 4.0},
+            {'id': 4, 'beer_style': 'Lager', 'brewery_name': 'C', 'score': 3.5},
+            {'id': 5, 'beer_style': 'IPA', 'brewery_name': 'C', 'score': 3.0},
+        ]
+        self.table = PopularityTable(rows, depth=2)
+
+    def test_top_of_chosen_styles_by_score(self):
+        """
+        Ensure beers of chosen styles are merged by score.
+        """
+        self.assertEqual(self.table.top(3, ['IPA', 'Lager']), [2, 4, 5])
+        self.assertEqual(self.table.top(2, ['Stout'], ['C']), [1, 3])
+
+    def test_top_is_topped_up_with_overall_best(self):
+        """
+        Ensure short style rankings are topped up with overall best beers without duplicates.
+        """
+        self.assertEqual(self.table.top(3, ['Lager']), [4, 1, 2])
+        self.assertEqual(self.table.top(2, ['Unknown']), [1, 2])
+        self.assertEqual(self.table.top(2), [1, 2])
+
+
+class PopularityTests(APITestCase):
+
+    def setUp(self):
+        reset_table()
+        self.user = User.objects.get(username='stcules')
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        # rows are rolled back after each test, table of this process must not outlive them
+        reset_table()
+
+    def test_build_popularity_scores(self):
+        """
+        Ensure build_popularity command stores Bayesian average of every reviewed beer.
+        """
+        out = StringIO()
+        call_command('build_popularity', stdout=out)
+        reviewed = BeerReview.objects.values('review_beer').distinct().count()
+        self.assertTrue('Ranked {} beers'.format(reviewed) in out.getvalue())
+        self.assertEqual(BeerPopularity.objects.count(), reviewed)
+
+        totals = BeerReview.objects.aggregate(count=Count('id'), sum=Sum('review_overall'))
+        beer = BeerReview.objects.filter(review_beer=38567).aggregate(count=Count('id'), sum=Sum('review_overall'))
+        global_mean = float(totals['sum']) / totals['count']
+        popularity = BeerPopularity.objects.get(beer=38567)
+        self.assertEqual(popularity.review_count, beer['count'])
+        self.assertAlmostEqual(popularity.score, (float(beer['sum']) + PRIOR_REVIEWS * global_mean) / (beer['count'] + PRIOR_REVIEWS))
+        self.assertEqual(popularity.beer_style, Beer.objects.get(id=38567).beer_style)
+
+    def test_onboarding_returns_best_beers_of_chosen_style(self):
+        """
+        Ensure onboarding endpoint returns best beers of chosen style ordered by score.
+        """
+        call_command('build_popularity', stdout=StringIO())
+        beer_style = Beer.objects.get(id=38567).beer_style
+        response = self.client.get('/onboarding', {'beer_style': beer_style, 'count': 5})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        expected = BeerPopularity.objects.filter(beer_style=beer_style).order_by('-score', 'beer_id')[:5]
+        self.assertEqual([beer['id'] for beer in response.data], [popularity.beer_id for popularity in expected])
+        self.assertTrue(all(beer['beer_style'] == beer_style for beer in response.data))
+
+    def test_table_reloaded_after_build_in_other_process(self):
+        """
+        Ensure table loaded before first build is reloaded once build_popularity has run in another process.
+        """
+        self.assertEqual(get_table().top(5), [])
+        # other process doesn't reset table of this one
+        with mock.patch.object(popularity, 'reset_table'):
+            call_command('build_popularity', stdout=StringIO())
+        self.assertEqual(get_table().top(5), [])
+        with mock.patch.object(popularity, 'VERSION_CHECK_SECONDS', 0):
+            self.assertEqual(get_table().top(5),
+                             list(BeerPopularity.objects.order_by('-score', 'beer_id').values_list('beer_id', flat=True)[:5]))
+
+    def test_onboarding_with_invalid_count(self):
+        """
+        Ensure onboarding endpoint rejects count which is not an integer.
+        """
+        response = self.client.get('/onboarding', {'count': 'ten'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_registration_recommends_overall_best_beers(self):
+        """
+        Ensure new user gets 10 overall best beers, with or without popularity table.
+        """
+        expected = compute_top(10)
+        call_command('build_popularity', stdout=StringIO())
+        self.assertEqual(list(BeerPopularity.objects.order_by('-score', 'beer_id').values_list('beer_id', flat=True)[:10]), expected)
+
+        self.client.force_authenticate(user=None)
+        response = self.client.post('/registration', {'email': 'test@user.com', 'password': 'test_password'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        recommendation = BeerRecommendation.objects.get(recommendation_user__username='test@user.com')
+        self.assertEqual([getattr(recommendation, 'top{}_beer_id'.format(i)) for i in range(1, 11)], expected)
@@ -0,0 +1,106 @@
+from types import SimpleNamespace
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase
+from beer_app.models import BeerReview
+from beer_app.popularity import build_popularity, get_table, reset_table
+from beer_app.rerank import reset_catalog
+from beer_app.test.query_budget import QueryBudgetMixin, budget_message, normalize
+
+
+# Queries per request authenticated by token, in-memory rankings and catalog already loaded.
+# Raise a budget only together with the change that needs the extra queries.
+QUERY_BUDGETS = {
+    '/beer': 3,
+    '/beer/{beer}': 2,
+    '/beer_rates': 3,
+    '/beer_review': 3,
+    '/beer_review/{review}': 2,
+    '/beer_review_export': 2,
+    '/beer_recs': 3,
+    '/beer_recs/rerank': 2,
+    '/onboarding': 1,
+    '/trending': 1,
+    '/async/beer': 3,
+    '/async/beer/{beer}': 2,
+    '/async/beer_review': 3,
+    '/async/beer_recs': 3,
+}
+
+
+class NormalizeTests(SimpleTestCase):
+
+    def test_normalize_replaces_literals_and_collapses_in_lists(self):
+        """
+        Ensure statements differing only in parameters are normalized to the same statement.
+        """
+        self.assertEqual(normalize('SELECT  "beer"."id" FROM "beer"\n WHERE "beer"."id" IN (%s, %s, %s) LIMIT 21'),
+                         'SELECT "beer"."id" FROM "beer" WHERE "beer"."id" IN (...) LIMIT ?')
+        self.assertEqual(normalize('RELEASE SAVEPOINT "s1396_x4"'), 'RELEASE SAVEPOINT ?')
+        self.assertEqual(normalize("SELECT top1_beer_id FROM r WHERE name = 'it''s' AND abv > 5.5"),
+                         'SELECT top1_beer_id FROM r WHERE name = ? AND abv > ?')
+
+    def test_budget_message_shows_repeated_statements(self):
+        """
+        Ensure budget failure lists statements repeated per row as added lines of the diff.
+        """
+        statements = ['SELECT a FROM t', 'SELECT b FROM u WHERE id = ?', 'SELECT b FROM u WHERE id = ?']
+        recorder = SimpleNamespace(queries=[(statement, statement, 0.001) for statement in statements],
+                                   statements=statements, seconds=0.003)
+        message = budget_message(recorder, 2)
+        self.assertTrue(message.startswith('3 queries in 3.0 ms, budget is 2 queries'))
+        self.assertIn('+SELECT b FROM u WHERE id = ?', message)
+
+
+class QueryBudgetTests(QueryBudgetMixin, APITestCase):
+
+    def setUp(self):
+        reset_table()
+        reset_catalog()
+        self.user = User.objects.get(username='stcules')
+        token, _ = Token.objects.get_or_create(user=self.user)
+        # token lookup is part of every budget, async views don't support force_authenticate anyway
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(token.key))
+        self.review = BeerReview.objects.filter(review_user=self.user).order_by('id').first()
+
+    def tearDown(self):
+        reset_table()
+        reset_catalog()
+
+    def test_endpoint_query_budgets(self):
+        """
+        Ensure read endpoints stay within their query budgets.
+        """
+        for endpoint, queries in QUERY_BUDGETS.items():
+            url = endpoint.format(beer=self.review.review_beer_id, review=self.review.id)
+            with self.subTest(url=url):
+                # first request loads in-memory tables
+                self.client.get(url)
+                with self.assertQueryBudget(queries):
+                    response = self.client.get(url)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_registration_query_budget(self):
+        """
+        Ensure registration fetches best beers without a query per recommended beer.
+        """
+        build_popularity()
+        get_table()
+        self.client.credentials()
+        with self.assertQueryBudget(5):
+            response = self.client.post('/registration', {'email': 'budget@user.com', 'password': 'budget'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_review_post_query_budget(self):
+        """
+        Ensure posting review checks beer and writes review with constant number of queries.
+        """
+        with self.assertQueryBudget(5):
+            response = self.client.post('/beer_review_post', {'review_beer': 100, 'review_overall': 3.0, 'review_aroma': 3,
+                                                              'review_appearance': 2, 'review_palate': 4, 'review_taste': 3},
+                                        format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
@@ -0,0 +1,57 @@
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+from beer_app import renderers
+from beer_app.middleware import brotli
+from django.contrib.auth.models import User
+import gzip
+import json
+import unittest
+
+
+class RendererTests(APITestCase):
+
+    def setUp(self):
+        user = User.objects.get(username='stcules')
+        self.client.force_authenticate(user=user)
+
+    def test_beer_list_renders_same_json(self):
+        """
+        Ensure default renderer produces same JSON as rest_framework JSONRenderer.
+        """
+        url = '/beer_review'
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.content), json.loads(JSONRenderer().render(response.data)))
+
+    @unittest.skipIf(renderers.msgpack is None, 'msgpack is not installed')
+    def test_beer_list_renders_messagepack(self):
+        """
+        Ensure MessagePack is returned when client accepts it.
+        """
+        url = '/beer'
+        response = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        data = renderers.msgpack.unpackb(response.content)
+        self.assertEqual(data, json.loads(JSONRenderer().render(response.data)))
+
+    def test_beer_list_is_gzipped(self):
+        """
+        Ensure large responses are gzipped when client accepts gzip.
+        """
+        url = '/beer_review'
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content)), json.loads(JSONRenderer().render(response.data)))
+
+    @unittest.skipIf(brotli is None, 'brotli is not installed')
+    def test_beer_list_prefers_brotli(self):
+        """
+        Ensure brotli is used when client accepts both brotli and gzip.
+        """
+        url = '/beer_review'
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(json.loads(brotli.decompress(response.content)), json.loads(JSONRenderer().render(response.data)))
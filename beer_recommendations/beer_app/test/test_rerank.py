@@ -0,0 +1,105 @@
+from rest_framework import status
+from rest_framework.test import APITestCase
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase
+from beer_app.models import Beer, BeerCandidates
+from beer_app.popularity import reset_table
+from beer_app.rerank import Catalog, rerank, pack, unpack, reset_catalog
+
+
+class RerankTests(SimpleTestCase):
+
+    def setUp(self):
+        self.catalog = Catalog([
+            (1, 'One', 'American IPA', 'A', 6.5),
+            (2, 'Two', 'American IPA', 'A', 7.0),
+            (3, 'Three', 'Russian Imperial Stout', 'B', 9.5),
+            (4, 'Four', 'English India Pale Ale (IPA)', 'C', 5.0),
+            (5, 'Five', 'Czech Pilsener', 'A', 4.5),
+        ])
+        self.beer_ids = [1, 2, 3, 4, 5]
+        self.scores = [5.0, 4.9, 4.0, 3.9, 3.0]
+
+    def ids(self, picked):
+        return [self.catalog.ids[position] for position, _ in picked]
+
+    def test_filters(self):
+        """
+        Ensure candidates are filtered by style substrings and ABV range keeping their order.
+        """
+        self.assertEqual(self.ids(rerank(self.catalog, self.beer_ids, self.scores, exclude_styles=['ipa'])), [3, 5])
+        self.assertEqual(self.ids(rerank(self.catalog, self.beer_ids, self.scores, beer_styles=['IPA'], max_abv=6.5)), [1, 4])
+        self.assertEqual(self.ids(rerank(self.catalog, self.beer_ids, self.scores, count=2, min_abv=5)), [1, 2])
+
+    def test_max_per_brewery(self):
+        """
+        Ensure no more than max_per_brewery beers of one brewery are picked.
+        """
+        self.assertEqual(self.ids(rerank(self.catalog, self.beer_ids, self.scores, max_per_brewery=1)), [1, 3, 4])
+
+    def test_diversity(self):
+        """
+        Ensure maximal marginal relevance prefers beers of styles and breweries not picked yet.
+        """
+        self.assertEqual(self.ids(rerank(self.catalog, self.beer_ids, self.scores, count=3)), [1, 2, 3])
+        self.assertEqual(self.ids(rerank(self.catalog, self.beer_ids, self.scores, count=3, diversity=0.5)), [1, 3, 4])
+
+    def test_pack_unpack(self):
+        """
+        Ensure candidate arrays round trip through little-endian bytes.
+        """
+        self.assertEqual(pack([1, 38567], 'i'), b'\x01\x00\x00\x00\xa7\x96\x00\x00')
+        self.assertEqual(list(unpack(pack([1, 38567], 'i'), 'i')), [1, 38567])
+        self.assertEqual(list(unpack(pack([4.5, 0.25], 'f'), 'f')), [4.5, 0.25])
+
+
+class BeerRecommendationRerankTests(APITestCase):
+
+    def setUp(self):
+        reset_catalog()
+        reset_table()
+        self.user = User.objects.get(username='stcules')
+        self.client.force_authenticate(user=self.user)
+        self.beers = list(Beer.objects.order_by('id')[:30])
+        BeerCandidates.objects.create(user=self.user, beer_ids=pack([beer.id for beer in self.beers], 'i'),
+                                      scores=pack([5 - i * 0.1 for i in range(len(self.beers))], 'f'))
+
+    def tearDown(self):
+        reset_catalog()
+
+    def test_rerank_excluding_style(self):
+        """
+        Ensure re-ranked recommendations skip excluded style and keep stored order.
+        """
+        beer_style = self.beers[0].beer_style
+        response = self.client.get('/beer_recs/rerank', {'exclude_style': beer_style, 'count': 5})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        expected = [beer.id for beer in self.beers if beer_style.lower() not in beer.beer_style.lower()][:5]
+        self.assertEqual([beer['id'] for beer in response.data], expected)
+
+    def test_rerank_max_per_brewery_reads_only_candidates(self):
+        """
+        Ensure brewery limit is applied from memory with one query for stored candidates.
+        """
+        self.client.get('/beer_recs/rerank')
+        with self.assertNumQueries(1):
+            response = self.client.get('/beer_recs/rerank', {'max_per_brewery': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        breweries = [beer['brewery_name'] for beer in response.data]
+        self.assertEqual(len(breweries), len(set(breweries)))
+
+    def test_rerank_with_invalid_diversity(self):
+        """
+        Ensure diversity outside of [0, 1] is rejected.
+        """
+        response = self.client.get('/beer_recs/rerank', {'diversity': 2})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rerank_with_not_finite_numbers(self):
+        """
+        Ensure nan and inf are rejected, nan would pass range checks and disable diversity or ABV filter.
+        """
+        for params in [{'diversity': 'nan'}, {'min_abv': 'nan'}, {'max_abv': 'inf'}, {'min_abv': '-inf'}]:
+            response = self.client.get('/beer_recs/rerank', params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(str(response.data['detail']), '{} must be a finite number.'.format(list(params)[0]))
@@ -0,0 +1,113 @@
+from rest_framework import status
+from rest_framework.test import APITestCase
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connections, router
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from beer_app.models import Beer
+from beer_app.routers import STICKY_COOKIE, read_from, sticky_key
+
+
+@override_settings(REPLICA_DATABASE='replica')
+class ReplicaRoutingTests(APITestCase):
+    # replica is a test mirror of default, fixture data is visible on both connections
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.user = User.objects.get(username='stcules')
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        caches['shared'].clear()
+
+    def get_on_replica(self, url):
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(replica_queries)
+
+    def test_router_reads_from_alias(self):
+        """
+        Ensure reads are routed to alias set with read_from and writes stay on default.
+        """
+        self.assertEqual(router.db_for_read(Beer), 'default')
+        with read_from('replica'):
+            self.assertEqual(router.db_for_read(Beer), 'replica')
+            self.assertEqual(router.db_for_write(Beer), 'default')
+        self.assertEqual(router.db_for_read(Beer), 'default')
+
+    def test_read_endpoints_use_replica(self):
+        """
+        Ensure beer list, ratings and detail are read from replica.
+        """
+        self.assertGreater(self.get_on_replica('/beer'), 0)
+        self.assertGreater(self.get_on_replica('/beer_rates'), 0)
+        self.assertGreater(self.get_on_replica('/beer/38567'), 0)
+
+    def test_user_data_endpoints_use_default(self):
+        """
+        Ensure user's reviews are not read from replica.
+        """
+        self.assertEqual(self.get_on_replica('/beer_review'), 0)
+
+    def test_reads_stick_to_default_after_write(self):
+        """
+        Ensure user reads own write from default right after review update.
+        """
+        url = '/beer/1/review'
+        data = {'review_overall': 4.5, 'review_aroma': 4, 'review_appearance': 4, 'review_palate': 4, 'review_taste': 4}
+        response = self.client.put(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_on_replica('/beer/1'), 0)
+        # other users still read from replica
+        self.client.force_authenticate(user=User.objects.get(username='Boto'))
+        self.assertGreater(self.get_on_replica('/beer/1'), 0)
+
+    def test_sticky_cookie_must_be_signed(self):
+        """
+        Ensure write mark is read from signed cookie only, forged cookie keeps reads on replica.
+        """
+        url = '/beer/1/review'
+        data = {'review_overall': 4.5, 'review_aroma': 4, 'review_appearance': 4, 'review_palate': 4, 'review_taste': 4}
+        response = self.client.put(url, data, format='json')
+        self.assertTrue(response.cookies[STICKY_COOKIE]['httponly'])
+        self.assertEqual(response.cookies[STICKY_COOKIE]['max-age'], settings.REPLICA_STICKY_SECONDS)
+        # valid cookie is enough without cache mark
+        caches['shared'].clear()
+        self.assertEqual(self.get_on_replica('/beer/1'), 0)
+        self.client.cookies[STICKY_COOKIE] = str(self.user.pk)
+        self.assertGreater(self.get_on_replica('/beer/1'), 0)
+
+    def test_reads_stick_to_default_without_cookies(self):
+        """
+        Ensure token client which doesn't keep cookies reads own write from default too.
+        """
+        url = '/beer/1/review'
+        data = {'review_overall': 4.5, 'review_aroma': 4, 'review_appearance': 4, 'review_palate': 4, 'review_taste': 4}
+        response = self.client.put(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.cookies.clear()
+        self.assertEqual(self.get_on_replica('/beer/1'), 0)
+        caches['shared'].delete(sticky_key(self.user))
+        self.assertGreater(self.get_on_replica('/beer/1'), 0)
+
+    def test_failed_write_does_not_stick(self):
+        """
+        Ensure rejected write doesn't move user's reads to default.
+        """
+        url = '/beer/1/review'
+        response = self.client.put(url, {'review_overall': 'four'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+        self.assertIsNone(caches['shared'].get(sticky_key(self.user)))
+        self.assertGreater(self.get_on_replica('/beer/1'), 0)
+
+    @override_settings(REPLICA_DATABASE='default')
+    def test_without_replica(self):
+        """
+        Ensure nothing is read from replica alias when it is not configured.
+        """
+        self.assertEqual(self.get_on_replica('/beer'), 0)
@@ -0,0 +1,146 @@
+import json
+from datetime import datetime, timezone
+from unittest import mock
+from rest_framework import status
+from rest_framework.test import APITestCase
+from rest_framework.throttling import ScopedRateThrottle
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db.models import Max
+from django.test import SimpleTestCase
+from beer_app import trending
+from beer_app.models import Beer, BeerReview, TrendingBeer
+from beer_app.trending import (TrendingWindow, refresh, get_trending, reset_table, BUCKET_SECONDS, HALF_LIFE_SECONDS,
+                              WINDOW_SECONDS)
+
+
+class TrendingWindowTests(SimpleTestCase):
+
+    def test_scores_decay_with_age(self):
+        """
+        Ensure review weight halves every half-life and reviews out of window are forgotten.
+        """
+        now = 100 * WINDOW_SECONDS
+        window = TrendingWindow()
+        window.add(1, 10, now - BUCKET_SECONDS / 2)
+        window.add(2, 10, now - HALF_LIFE_SECONDS - BUCKET_SECONDS / 2)
+        window.add(3, 20, now - WINDOW_SECONDS - 2 * BUCKET_SECONDS)
+        window.advance(now)
+        scores = window.scores(now)
+        self.assertEqual(set(scores), {10})
+        # reviews are aged by middle of their bucket
+        self.assertAlmostEqual(scores[10][0], 1.5 * 0.5 ** (BUCKET_SECONDS / 2 / HALF_LIFE_SECONDS))
+        self.assertEqual(scores[10][1], 2)
+
+    def test_overlapping_reads_count_review_once(self):
+        """
+        Ensure review read again by overlapping refresh is not counted twice, edited review is.
+        """
+        window = TrendingWindow()
+        self.assertTrue(window.add(1, 10, 1000.0))
+        window.advance(1010.0)
+        # state is stored as JSON between refreshes
+        window = TrendingWindow(**json.loads(json.dumps(window.state())))
+        self.assertFalse(window.add(1, 10, 1000.0))
+        self.assertTrue(window.add(1, 10, 1005.0))
+        self.assertEqual(window.scores(1010.0)[10][1], 2)
+
+
+class TrendingStorageTests(APITestCase):
+
+    def setUp(self):
+        reset_table()
+        self.client.force_authenticate(user=User.objects.get(username='stcules'))
+
+    def tearDown(self):
+        reset_table()
+
+    def test_trending_written_by_other_process(self):
+        """
+        Ensure worker which has served empty list before first refresh serves rankings stored by refresh_trending.
+        """
+        self.assertEqual(self.client.get('/trending').data, [])
+        beers = list(Beer.objects.order_by('id')[:3])
+        TrendingBeer.objects.bulk_create(
+            TrendingBeer(beer=beer, beer_style=beer.beer_style, brewery_name=beer.brewery_name, reviews=score, score=score)
+            for score, beer in enumerate(beers, start=1))
+        with mock.patch.object(trending, 'VERSION_CHECK_SECONDS', 0):
+            response = self.client.get('/trending')
+            self.assertEqual([beer['id'] for beer in response.data], [beer.id for beer in reversed(beers)])
+            response = self.client.get('/trending', {'beer_style': beers[0].beer_style})
+            self.assertEqual(response.data[-1]['id'], beers[0].id)
+
+
+class TrendingBeersTests(APITestCase):
+
+    def setUp(self):
+        caches['shared'].clear()
+        reset_table()
+        self.user = User.objects.get(username='stcules')
+        self.client.force_authenticate(user=self.user)
+        # fixture reviews are historical, trending is computed as of newest of them
+        self.now = BeerReview.objects.aggregate(newest=Max('review_time'))['newest'].timestamp() + 1
+        refresh(now=self.now)
+
+    def tearDown(self):
+        caches['shared'].clear()
+        # rows are rolled back after each test, lists of this process must not outlive them
+        reset_table()
+
+    def test_trending_beers(self):
+        """
+        Ensure trending beers are ranked by decayed score with review counts of last week.
+        """
+        response = self.client.get('/trending', {'count': 5})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(0 < len(response.data) <= 5)
+        scores = [beer['score'] for beer in response.data]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        first = response.data[0]
+        window_start = datetime.fromtimestamp(self.now - WINDOW_SECONDS, timezone.utc)
+        week_reviews = BeerReview.objects.filter(review_beer=first['id'], review_time__gt=window_start)
+        self.assertEqual(first['reviews'], week_reviews.count())
+
+    def test_trending_beers_of_style(self):
+        """
+        Ensure per style list contains only beers of that style.
+        """
+        beer_style = get_trending()[0]['beer_style']
+        response = self.client.get('/trending', {'beer_style': beer_style})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(len(response.data) > 0)
+        self.assertTrue(all(beer['beer_style'] == beer_style for beer in response.data))
+        self.assertEqual(self.client.get('/trending', {'beer_style': 'No such style'}).data, [])
+
+    def test_refresh_counts_only_new_reviews(self):
+        """
+        Ensure next refresh reads reviews after previous one only.
+        """
+        self.assertEqual(refresh(now=self.now + 60), 0)
+
+    def test_refresh_in_other_process_is_served(self):
+        """
+        Ensure lists loaded by this process are replaced once rankings are written by another process.
+        """
+        self.assertTrue(len(self.client.get('/trending').data) > 0)
+        beer = Beer.objects.exclude(id__in=TrendingBeer.objects.values('beer_id')).first()
+        # refresh_trending process writes rows only, lists of this process are not reset
+        TrendingBeer.objects.all().delete()
+        TrendingBeer.objects.create(beer=beer, beer_style=beer.beer_style, brewery_name=beer.brewery_name,
+                                    reviews=3, score=2.5)
+        self.assertNotEqual(self.client.get('/trending').data[0]['id'], beer.id)
+        with mock.patch.object(trending, 'VERSION_CHECK_SECONDS', 0):
+            response = self.client.get('/trending')
+        self.assertEqual(response.data, [{'id': beer.id, 'beer_name': beer.beer_name, 'beer_style': beer.beer_style,
+                                          'brewery_name': beer.brewery_name, 'reviews': 3, 'score': 2.5}])
+
+    @mock.patch.object(ScopedRateThrottle, 'THROTTLE_RATES', {'trending': '2/min'})
+    def test_trending_is_throttled(self):
+        """
+        Ensure trending endpoint is rate limited per user.
+        """
+        for _ in range(2):
+            self.assertEqual(self.client.get('/trending').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get('/trending').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        # history is in cache shared by workers
+        self.assertEqual(len(caches['shared'].get('throttle_trending_{}'.format(self.user.pk))), 2)
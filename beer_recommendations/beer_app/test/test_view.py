@@ -2,10 +2,14 @@ from rest_framework import status
 from rest_framework.test import APITestCase
 from rest_framework.exceptions import ErrorDetail
 from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
 from beer_app.models import Beer, BeerReview, BeerRecommendation
+from beer_app import bulk_import, views as beer_views
 from django.contrib.auth.models import User
 from django.conf import settings
 from decimal import Decimal
+import json
 import math
 
 
@@ -509,6 +513,43 @@ class BeerReviewListViewTests(APITestCase):
         self.assertTrue(response.data['next'] is None)
 
 
+class ValuesListSerializerTests(APITestCase):
+
+    def assert_same_output_as_model_serializer(self, url, view_class):
+        user = User.objects.get(username='stcules')
+        self.client.force_authenticate(user=user)
+        # second page to avoid relying on first rows only
+        response = self.client.get(url + '?page=2', format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        request = Request(APIRequestFactory().get(url))
+        request.user = user
+        view = view_class()
+        view.request = request
+        view.format_kwarg = None
+        page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+        instances = view.get_queryset()[page_size:2 * page_size]
+        expected = view.serializer_class(instances, many=True, context={'request': request}).data
+        self.assertEqual(response.data['results'], [dict(item) for item in expected])
+
+    def test_beer_list_matches_model_serializer(self):
+        """
+        Ensure beer list values serializer returns same data as BeerListSerializer.
+        """
+        self.assert_same_output_as_model_serializer('/beer', beer_views.BeerList)
+
+    def test_beer_rates_matches_model_serializer(self):
+        """
+        Ensure beer rates values serializer returns same data as BeerRatingSerializer.
+        """
+        self.assert_same_output_as_model_serializer('/beer_rates', beer_views.BeerRatingList)
+
+    def test_beer_review_list_matches_model_serializer(self):
+        """
+        Ensure beer review list values serializer returns same data as BeerReviewListSerializer.
+        """
+        self.assert_same_output_as_model_serializer('/beer_review', beer_views.BeerReviewList)
+
 class BeerReviewPostViewTests(APITestCase):
     
     def test_create_beer_review_with_valid_token(self):
@@ -705,6 +746,28 @@ class BeerReviewPostViewTests(APITestCase):
                                         })
         self.assertEqual(BeerReview.objects.count(), review_counts)
 
+    def test_create_beer_review_for_already_reviewed_beer(self):
+        """
+        Ensure we can't create a second review of the same beer.
+        """
+        review_counts = BeerReview.objects.count()
+        # test username
+        test_user_name = 'stcules'
+        user = User.objects.get(username=test_user_name)
+        self.client.force_authenticate(user=user)
+        # beer 38567 is already reviewed by this user
+        url = '/beer_review_post'
+        data = {'review_beer': 38567, 
+                'review_overall': 3.0,
+                'review_aroma': 3,
+                'review_appearance': 2,
+                'review_palate': 4,
+                'review_taste': 3}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'review_beer': [ErrorDetail('You have already reviewed this beer.', code='invalid')]})
+        self.assertEqual(BeerReview.objects.count(), review_counts)
+
 
 class BeerReviewPutViewTests(APITestCase):
     
@@ -890,6 +953,334 @@ class BeerReviewPutViewTests(APITestCase):
         self.assertEqual(BeerReview.objects.count(), review_counts)
 
 
+    def test_update_beer_review_of_another_user(self):
+        """
+        Ensure we can't update a beer review written by another user.
+        """
+        test_user_name = 'stcules'
+        user = User.objects.get(username=test_user_name)
+        self.client.force_authenticate(user=user)
+        # review 973421 belongs to another user
+        url = '/beer_review_put'
+        data = {'id': 973421,
+                'review_beer': 1, 
+                'review_overall': 3.0,
+                'review_aroma': 3,
+                'review_appearance': 2,
+                'review_palate': 4,
+                'review_taste': 3}
+        response = self.client.put(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.data, {'detail': ErrorDetail(string='Not found.', code='not_found')})
+        self.assertEqual(BeerReview.objects.get(id=973421).review_user.username, 'Boto')
+
+
+class BeerReviewUpsertViewTests(APITestCase):
+
+    def test_upsert_beer_review_creates_review(self):
+        """
+        Ensure upsert creates a review for not reviewed beer.
+        """
+        review_counts = BeerReview.objects.count()
+        test_user_name = 'stcules'
+        user = User.objects.get(username=test_user_name)
+        self.client.force_authenticate(user=user)
+        url = '/beer/100/review'
+        data = {'review_overall': 3.0,
+                'review_aroma': 3,
+                'review_appearance': 2,
+                'review_palate': 4,
+                'review_taste': 3}
+        response = self.client.put(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(BeerReview.objects.count(), review_counts + 1)
+        review = BeerReview.objects.get(review_user=user, review_beer=100)
+        self.assertEqual(response.data['id'], review.id)
+        self.assertEqual(response.data['review_beer'], 100)
+        self.assertEqual(response.data['review_overall'], Decimal('3.0'))
+        self.assertEqual(review.review_aroma, 3)
+        self.assertEqual(review.review_appearance, 2)
+        self.assertEqual(review.review_palate, 4)
+        self.assertEqual(review.review_taste, 3)
+
+        # beer detail sees the new review
+        url = '/beer/100'
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.data['is_reviewed'], review.id)
+
+    def test_upsert_beer_review_updates_review(self):
+        """
+        Ensure upsert updates existing review of already reviewed beer.
+        """
+        review_counts = BeerReview.objects.count()
+        test_user_name = 'stcules'
+        user = User.objects.get(username=test_user_name)
+        self.client.force_authenticate(user=user)
+        # beer 38567 is reviewed by this user in review 973423
+        url = '/beer/38567/review'
+        data = {'review_overall': 4.5,
+                'review_aroma': 4,
+                'review_appearance': 5,
+                'review_palate': 4,
+                'review_taste': 5}
+        response = self.client.put(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(BeerReview.objects.count(), review_counts)
+        self.assertEqual(response.data['id'], 973423)
+        review = BeerReview.objects.get(id=973423)
+        self.assertEqual(review.review_overall, Decimal('4.5'))
+        self.assertEqual(review.review_aroma, 4)
+        self.assertEqual(review.review_appearance, 5)
+        self.assertEqual(review.review_palate, 4)
+        self.assertEqual(review.review_taste, 5)
+
+    def test_upsert_beer_review_for_inexisted_beer(self):
+        """
+        Ensure upsert returns 404 for beer id which doesn't exist.
+        """
+        review_counts = BeerReview.objects.count()
+        test_user_name = 'stcules'
+        user = User.objects.get(username=test_user_name)
+        self.client.force_authenticate(user=user)
+        inexisted_beer_id = Beer.objects.latest('id').id + 1
+        url = '/beer/{}/review'.format(inexisted_beer_id)
+        data = {'review_overall': 3.0,
+                'review_aroma': 3,
+                'review_appearance': 2,
+                'review_palate': 4,
+                'review_taste': 3}
+        response = self.client.put(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(BeerReview.objects.count(), review_counts)
+
+    def test_upsert_beer_review_with_invalid_data(self):
+        """
+        Ensure upsert rejects invalid data.
+        """
+        test_user_name = 'stcules'
+        user = User.objects.get(username=test_user_name)
+        self.client.force_authenticate(user=user)
+        url = '/beer/100/review'
+        data = {'review_overall': 'three.',
+                'review_aroma': 'string',
+                'review_appearance': 'two',
+                'review_palate': 4.25,
+                'review_taste': 'three'}
+        response = self.client.put(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {
+                                            'review_overall': [ErrorDetail('A valid number is required.', code='invalid')],
+                                            'review_aroma': [ErrorDetail('A valid integer is required.', code='invalid')], 
+                                            'review_appearance': [ErrorDetail('A valid integer is required.', code='invalid')],
+                                            'review_palate': [ErrorDetail('A valid integer is required.', code='invalid')], 
+                                            'review_taste': [ErrorDetail('A valid integer is required.', code='invalid')]
+                                        })
+        self.assertFalse(BeerReview.objects.filter(review_user=user, review_beer=100).exists())
+
+    def test_upsert_beer_review_without_credentials_header(self):
+        """
+        Ensure we can't upsert a beer review without credentials header.
+        """
+        url = '/beer/100/review'
+        response = self.client.put(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.data, {'detail': ErrorDetail(string='Authentication credentials were not provided.', code='not_authenticated')})
+
+
+class BeerReviewImportViewTests(APITestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('import_admin', 'import@admin.com', 'test_password')
+        self.user = User.objects.get(username='stcules')
+
+    def test_import_beer_reviews_from_ndjson(self):
+        """
+        Ensure admin can import reviews from NDJSON, invalid rows are reported.
+        """
+        review_counts = BeerReview.objects.count()
+        self.client.force_authenticate(user=self.admin)
+        rows = [
+            # new review
+            {'review_user': self.user.id, 'review_beer': 100, 'review_overall': 3.5, 'review_aroma': 3,
+             'review_appearance': 4, 'review_palate': 3, 'review_taste': 4},
+            # existing review 973423 is updated
+            {'review_user': self.user.id, 'review_beer': 38567, 'review_overall': 4.0, 'review_aroma': 4,
+             'review_appearance': 4, 'review_palate': 4, 'review_taste': 4},
+            # invalid values
+            {'review_user': self.user.id, 'review_beer': 101, 'review_overall': 'three', 'review_aroma': 3,
+             'review_appearance': 4, 'review_palate': 3, 'review_taste': 4},
+        ]
+        body = '\n'.join(json.dumps(row) for row in rows) + '\nnot json\n'
+        url = '/beer_review_import'
+        response = self.client.post(url, body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['imported'], 2)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual(response.data['rejected'], 2)
+        self.assertEqual([error['line'] for error in response.data['errors']], [3, 4])
+        self.assertTrue('review_overall' in response.data['errors'][0]['errors'])
+        self.assertTrue(response.data['rows_per_second'] > 0)
+        self.assertEqual(BeerReview.objects.count(), review_counts + 1)
+        self.assertEqual(BeerReview.objects.get(id=973423).review_overall, Decimal('4.0'))
+        self.assertEqual(BeerReview.objects.get(review_user=self.user, review_beer=100).review_overall, Decimal('3.5'))
+
+    def test_import_beer_reviews_from_csv(self):
+        """
+        Ensure admin can import reviews from CSV, rows with unknown beer are rejected.
+        """
+        review_counts = BeerReview.objects.count()
+        self.client.force_authenticate(user=self.admin)
+        inexisted_beer_id = Beer.objects.latest('id').id + 1
+        body = ('review_user,review_beer,review_overall,review_aroma,review_appearance,review_palate,review_taste\n'
+                '{0},100,3.5,3,4,3,4\n'
+                '{0},{1},3.5,3,4,3,4\n').format(self.user.id, inexisted_beer_id)
+        url = '/beer_review_import'
+        response = self.client.post(url, body, content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['imported'], 1)
+        self.assertEqual(response.data['rejected'], 1)
+        self.assertEqual(response.data['errors'][0]['line'], 3)
+        self.assertTrue('review_beer' in response.data['errors'][0]['errors'])
+        self.assertEqual(BeerReview.objects.count(), review_counts + 1)
+
+    def test_import_duplicate_beer_reviews(self):
+        """
+        Ensure duplicates of the same user and beer in a batch are written and counted once, last one wins.
+        """
+        review_counts = BeerReview.objects.count()
+        self.client.force_authenticate(user=self.admin)
+        body = ('review_user,review_beer,review_overall,review_aroma,review_appearance,review_palate,review_taste\n'
+                '{0},100,3.5,3,4,3,4\n'
+                '{0},100,4.5,3,4,3,4\n').format(self.user.id)
+        url = '/beer_review_import'
+        response = self.client.post(url, body, content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['imported'], 1)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['updated'], 0)
+        self.assertEqual(response.data['rejected'], 0)
+        self.assertEqual(BeerReview.objects.count(), review_counts + 1)
+        self.assertEqual(BeerReview.objects.get(review_user=self.user, review_beer=100).review_overall, Decimal('4.5'))
+
+    def test_import_validates_reviewed_beers_per_batch(self):
+        """
+        Ensure rows of already reviewed beers are valid and batch is validated with one query per model.
+        """
+        reviews = BeerReview.objects.order_by('id')[:3]
+        batch = [(line_number, {'review_user': review.review_user_id, 'review_beer': review.review_beer_id,
+                                'review_overall': 4.0, 'review_aroma': 4, 'review_appearance': 4,
+                                'review_palate': 4, 'review_taste': 4})
+                 for line_number, review in enumerate(reviews, start=2)]
+        errors = []
+        with self.assertNumQueries(2):
+            valid = bulk_import._validate_batch(batch, errors)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(valid), 3)
+
+    def test_import_updates_reviewed_beer(self):
+        """
+        Ensure importing a review of an already reviewed beer updates it.
+        """
+        review_counts = BeerReview.objects.count()
+        review = BeerReview.objects.order_by('id').first()
+        self.client.force_authenticate(user=self.admin)
+        body = ('review_user,review_beer,review_overall,review_aroma,review_appearance,review_palate,review_taste\n'
+                '{},{},1.5,1,2,1,2\n').format(review.review_user_id, review.review_beer_id)
+        url = '/beer_review_import'
+        response = self.client.post(url, body, content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['imported'], 1)
+        self.assertEqual(response.data['created'], 0)
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual(response.data['rejected'], 0)
+        self.assertEqual(BeerReview.objects.count(), review_counts)
+        self.assertEqual(BeerReview.objects.get(id=review.id).review_overall, Decimal('1.5'))
+
+    def test_import_beer_reviews_with_unsupported_media_type(self):
+        """
+        Ensure import rejects unknown content types.
+        """
+        self.client.force_authenticate(user=self.admin)
+        url = '/beer_review_import'
+        response = self.client.post(url, {'review_user': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_import_beer_reviews_by_not_admin_user(self):
+        """
+        Ensure regular users can't import reviews.
+        """
+        self.client.force_authenticate(user=self.user)
+        url = '/beer_review_import'
+        response = self.client.post(url, '', content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class BeerReviewExportViewTests(APITestCase):
+
+    def test_export_beer_reviews_as_ndjson(self):
+        """
+        Ensure export streams the whole review history as NDJSON in one response.
+        """
+        test_user_name = 'stcules'
+        user = User.objects.get(username=test_user_name)
+        self.client.force_authenticate(user=user)
+        url = '/beer_review_export'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+        # all reviews, not a single page
+        self.assertEqual(len(rows), 1788)
+        review = [row for row in rows if row['id'] == 973423][0]
+        self.assertEqual(review['review_beer'], 38567)
+        self.assertEqual(review['review_time'], '2012-01-06T12:21:32Z')
+        self.assertEqual(review['beer_name'], 'Karlsberg Black Baron')
+        self.assertEqual(review['beer_style'], 'Schwarzbier')
+        self.assertTrue('/media/images.jpg' in review['beer_image'])
+        self.assertEqual(review['review_overall'], 2.0)
+        self.assertEqual(review['review_taste'], 2)
+        # newest reviews go first
+        times = [row['review_time'] for row in rows]
+        self.assertEqual(times, sorted(times, reverse=True))
+
+    def test_export_beer_reviews_as_csv(self):
+        """
+        Ensure export streams CSV with header when requested.
+        """
+        test_user_name = 'stcules'
+        user = User.objects.get(username=test_user_name)
+        self.client.force_authenticate(user=user)
+        url = '/beer_review_export?export_format=csv'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(lines[0], 'id,review_beer,review_time,beer_name,beer_style,beer_image,review_overall,'
+                                   'review_aroma,review_appearance,review_palate,review_taste')
+        self.assertEqual(len(lines), 1788 + 1)
+
+    def test_export_beer_reviews_with_unknown_format(self):
+        """
+        Ensure export rejects unknown formats.
+        """
+        test_user_name = 'stcules'
+        user = User.objects.get(username=test_user_name)
+        self.client.force_authenticate(user=user)
+        url = '/beer_review_export?export_format=xml'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_beer_reviews_without_credentials_header(self):
+        """
+        Ensure we can't export reviews without credentials header.
+        """
+        url = '/beer_review_export'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
 class BeerReviewDetailViewTests(APITestCase):
     
     def test_get_beer_review_detail_for_reviewed_beer_with_valid_token(self):
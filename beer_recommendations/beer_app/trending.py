@@ -0,0 +1,175 @@
+import heapq
+import math
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from beer_app.models import Beer, BeerReview, TrendingBeer, TrendingWindowState
+
+# Trending beers: reviews of last WINDOW_SECONDS counted in hourly buckets, bucket weight
+# halves every HALF_LIFE_SECONDS. refresh_trending command reads only reviews newer than
+# previous run, window state is kept in TrendingWindowState and ranked lists (overall and
+# per style) in TrendingBeer, so the trending endpoint never aggregates reviews. Each worker
+# process keeps ranked lists in memory and reloads them after a refresh by any process.
+
+WINDOW_SECONDS = 7 * 24 * 3600
+HALF_LIFE_SECONDS = 2 * 24 * 3600
+BUCKET_SECONDS = 3600
+TRENDING_DEPTH = 100
+# reviews committed after a refresh with slightly older review_time are counted by next one
+OVERLAP_SECONDS = 300
+# workers compare time of latest refresh in TrendingBeer with their lists at most this often
+VERSION_CHECK_SECONDS = 10
+STATE_ID = 1
+
+
+class TrendingWindow:
+    """
+    Review counts per beer in time buckets, reviews seen in last OVERLAP_SECONDS are
+    remembered by (id, review_time) so overlapping reads don't count them twice.
+    Arguments are those of state(), which holds lists only and is stored as JSON.
+    """
+
+    def __init__(self, buckets=(), watermark=None, recent=()):
+        # bucket start -> beer id -> reviews
+        self.buckets = defaultdict(dict)
+        for start, beer_id, count in buckets:
+            self.buckets[start][beer_id] = count
+        self.watermark = watermark
+        self.recent = {(review_id, timestamp) for review_id, timestamp in recent}
+
+    def add(self, review_id, beer_id, timestamp):
+        if (review_id, timestamp) in self.recent:
+            return False
+        self.recent.add((review_id, timestamp))
+        bucket = self.buckets[int(timestamp // BUCKET_SECONDS) * BUCKET_SECONDS]
+        bucket[beer_id] = bucket.get(beer_id, 0) + 1
+        return True
+
+    def advance(self, now):
+        """ Move watermark to now, forget buckets out of window and reviews out of overlap """
+        self.watermark = now
+        for start in [start for start in self.buckets if start + BUCKET_SECONDS <= now - WINDOW_SECONDS]:
+            del self.buckets[start]
+        self.recent = {(review_id, timestamp) for review_id, timestamp in self.recent if timestamp > now - OVERLAP_SECONDS}
+
+    def scores(self, now):
+        """ beer id -> (decayed score, reviews in window) """
+        scores = {}
+        for start, counts in self.buckets.items():
+            # bucket middle is its age
+            weight = math.pow(0.5, max(now - start - BUCKET_SECONDS / 2, 0) / HALF_LIFE_SECONDS)
+            for beer_id, count in counts.items():
+                score, reviews = scores.get(beer_id, (0.0, 0))
+                scores[beer_id] = (score + count * weight, reviews + count)
+        return scores
+
+    def state(self):
+        return {'buckets': [[start, beer_id, count] for start, counts in self.buckets.items() for beer_id, count in counts.items()],
+                'watermark': self.watermark,
+                'recent': sorted([review_id, timestamp] for review_id, timestamp in self.recent)}
+
+
+def refresh(now=None):
+    """
+    Count reviews since previous refresh and store ranked lists, returns number of new reviews.
+    """
+    now = time.time() if now is None else now
+    with transaction.atomic():
+        # concurrent refresh waits, reviews are not counted twice
+        state = TrendingWindowState.objects.select_for_update().filter(id=STATE_ID).values_list('state', flat=True).first()
+        window = TrendingWindow(**(state or {}))
+        since = now - WINDOW_SECONDS if window.watermark is None else max(window.watermark - OVERLAP_SECONDS, now - WINDOW_SECONDS)
+        reviews = BeerReview.objects.filter(review_time__gt=datetime.fromtimestamp(since, dt_timezone.utc),
+                                            review_time__lte=datetime.fromtimestamp(now, dt_timezone.utc))
+        added = 0
+        for review_id, beer_id, review_time in reviews.order_by().values_list('id', 'review_beer', 'review_time').iterator():
+            added += window.add(review_id, beer_id, review_time.timestamp())
+        window.advance(now)
+
+        scores = window.scores(now)
+        beers = Beer.objects.filter(id__in=list(scores)).values_list('id', 'beer_style', 'brewery_name')
+        by_style = defaultdict(list)
+        overall = []
+        for beer_id, beer_style, brewery_name in beers.iterator():
+            score, review_count = scores[beer_id]
+            entry = (-round(score, 4), beer_id, beer_style, brewery_name, review_count)
+            overall.append(entry)
+            by_style[beer_style].append(entry)
+
+        # beers of any ranked list, lists are cut again when loaded
+        ranked = set(heapq.nsmallest(TRENDING_DEPTH, overall))
+        for entries in by_style.values():
+            ranked.update(heapq.nsmallest(TRENDING_DEPTH, entries))
+        refreshed = timezone.now()
+        TrendingBeer.objects.all().delete()
+        TrendingBeer.objects.bulk_create(
+            TrendingBeer(beer_id=beer_id, beer_style=beer_style, brewery_name=brewery_name, reviews=review_count,
+                         score=-negative_score, refreshed=refreshed)
+            for negative_score, beer_id, beer_style, brewery_name, review_count in ranked)
+        TrendingWindowState.objects.update_or_create(id=STATE_ID, defaults={'state': window.state()})
+    reset_table()
+    return added
+
+
+class TrendingTable:
+    """
+    Overall and per style lists of trending beers as served by the endpoint, best first.
+    """
+
+    def __init__(self, rows, depth=TRENDING_DEPTH):
+        self.overall = []
+        self.by_style = {}
+        # rows are ordered by descending score
+        for beer_id, beer_name, beer_style, brewery_name, review_count, score in rows:
+            entry = {'id': beer_id, 'beer_name': beer_name, 'beer_style': beer_style, 'brewery_name': brewery_name,
+                     'reviews': review_count, 'score': score}
+            for ranking in (self.overall, self.by_style.setdefault(beer_style, [])):
+                if len(ranking) < depth:
+                    ranking.append(entry)
+
+
+def load_table():
+    rows = TrendingBeer.objects.order_by('-score', 'beer_id').values_list(
+        'beer_id', 'beer__beer_name', 'beer_style', 'brewery_name', 'reviews', 'score')
+    return TrendingTable(rows.iterator())
+
+
+_table = None
+_version = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def get_table():
+    """
+    Trending lists of this process, reloaded once refresh_trending has run in any process.
+    """
+    global _table, _version, _checked_at
+    if _table is not None and time.monotonic() - _checked_at < VERSION_CHECK_SECONDS:
+        return _table
+    with _lock:
+        if _table is None or time.monotonic() - _checked_at >= VERSION_CHECK_SECONDS:
+            # index only lookup, None until first refresh
+            version = TrendingBeer.objects.aggregate(refreshed=Max('refreshed'))['refreshed']
+            if _table is None or version != _version:
+                _table = load_table()
+                _version = version
+            _checked_at = time.monotonic()
+    return _table
+
+
+def reset_table():
+    global _table
+    with _lock:
+        _table = None
+
+
+def get_trending(beer_style=None):
+    table = get_table()
+    if beer_style is None:
+        return table.overall
+    return table.by_style.get(beer_style, [])
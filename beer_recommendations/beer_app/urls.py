@@ -4,18 +4,31 @@ from django.conf import settings
 from rest_framework.urlpatterns import format_suffix_patterns
 from rest_framework.authtoken import views as auth_views
 from beer_app import views as beer_views
+from beer_app import async_views
+from beer_app.metrics import metrics_view
 
 urlpatterns = [
     path('beer', beer_views.BeerList.as_view()),
     path('beer/<int:pk>', beer_views.BeerDetail.as_view()),
+    path('beer/<int:pk>/review', beer_views.BeerReviewUpsert.as_view()),
 	path('beer_rates', beer_views.BeerRatingList.as_view()),
     path('beer_review', beer_views.BeerReviewList.as_view()),
     path('beer_review_put', beer_views.BeerReviewPut.as_view()),
     path('beer_review_post', beer_views.BeerReviewPost.as_view()),
     path('beer_review/<int:pk>', beer_views.BeerReviewDetail.as_view()),
+    path('beer_review_import', beer_views.BeerReviewImport.as_view()),
+    path('beer_review_export', beer_views.BeerReviewExport.as_view()),
     path('beer_recs', beer_views.BeerRecommendationDetail.as_view()),
+    path('beer_recs/rerank', beer_views.BeerRecommendationRerank.as_view()),
+    path('onboarding', beer_views.BeerOnboarding.as_view()),
+    path('trending', beer_views.TrendingBeers.as_view()),
+    path('async/beer', async_views.BeerList.as_view()),
+    path('async/beer/<int:pk>', async_views.BeerDetail.as_view()),
+    path('async/beer_review', async_views.BeerReviewList.as_view()),
+    path('async/beer_recs', async_views.BeerRecommendationDetail.as_view()),
     path('registration', beer_views.UserRegistration.as_view()),
 	path('api-token-auth', auth_views.obtain_auth_token),
+    path('metrics', metrics_view),
 ]
 
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
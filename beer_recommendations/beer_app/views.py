@@ -1,87 +1,236 @@
 from rest_framework import generics
 from rest_framework import permissions
 from rest_framework.authentication import TokenAuthentication
-from beer_app.models import Beer, BeerReview, BeerRecommendation
-from django.db import models
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.throttling import ScopedRateThrottle
+from rest_framework.exceptions import ValidationError, ParseError, UnsupportedMediaType
+from beer_app.models import Beer, BeerReview, BeerCandidates
+from django.core.cache import caches
+from django.db import transaction, IntegrityError
 from django.shortcuts import get_object_or_404
+from django.http import StreamingHttpResponse
 from django.contrib.auth.models import User
-from django.db.models import Avg, F, OuterRef, Value, Q, Subquery
+from django.utils.connection import ConnectionProxy
+from beer_app.queries import (beer_list_queryset, beer_detail_queryset, beer_rating_queryset,
+							  beer_review_queryset, beer_recommendation_queryset)
+from beer_app.media import media_base_url
+from beer_app.popularity import get_table, RANKING_DEPTH
+from beer_app.rerank import get_catalog, rerank, unpack
+from beer_app.event_log import log_impressions, log_review
+from beer_app.trending import get_trending, TRENDING_DEPTH
+from beer_app.routers import read_alias, replica_alias_for, mark_written
+from beer_app.bulk_import import import_reviews, read_csv, read_ndjson, DEFAULT_BATCH_SIZE
+from rest_framework import serializers
+import codecs
+import csv
+import json
+import math
 from beer_app.serializers import (BeerListSerializer, BeerDetailSerializer,
 			 					  BeerReviewListSerializer, BeerReviewPutPostSerializer, BeerReviewDetailSerializer,
+								  BeerReviewUpsertSerializer,
 								  BeerRecommendationSerializer,
-								  UserSerializer, BeerRatingSerializer)
+								  UserSerializer, BeerRatingSerializer,
+								  BeerListValuesSerializer, BeerRatingValuesSerializer, BeerReviewListValuesSerializer)
 
-class BeerList(generics.ListAPIView):
+class ValuesListMixin:
+	"""
+	Serializes list pages from values_list() rows with values_serializer_class,
+	serializer_class output stays the reference format.
+	"""
+	values_serializer_class = None
+
+	def list(self, request, *args, **kwargs):
+		serializer = self.values_serializer_class(context=self.get_serializer_context())
+		queryset = self.filter_queryset(self.get_queryset()).values_list(*serializer.values_fields())
+		page = self.paginate_queryset(queryset)
+		if page is not None:
+			return self.get_paginated_response(serializer.serialize(page))
+		return Response(serializer.serialize(queryset))
+
+class ReplicaReadMixin:
+	"""
+	Reads go to REPLICA_DATABASE once request is authenticated, unless user has just written a review.
+	"""
+	def initial(self, request, *args, **kwargs):
+		super().initial(request, *args, **kwargs)
+		self.read_alias_token = read_alias.set(replica_alias_for(request))
+
+	def finalize_response(self, request, response, *args, **kwargs):
+		token = getattr(self, 'read_alias_token', None)
+		if token is not None:
+			read_alias.reset(token)
+			self.read_alias_token = None
+		return super().finalize_response(request, response, *args, **kwargs)
+
+class ReplicaWriteMixin:
+	"""
+	Successful writes make the user read from default database for REPLICA_STICKY_SECONDS.
+	"""
+	def finalize_response(self, request, response, *args, **kwargs):
+		response = super().finalize_response(request, response, *args, **kwargs)
+		if request.method not in permissions.SAFE_METHODS and status.is_success(response.status_code):
+			mark_written(response, request.user)
+		return response
+
+class BeerList(ReplicaReadMixin, ValuesListMixin, generics.ListAPIView):
 	permission_classes = [permissions.IsAuthenticated]
 	serializer_class = BeerListSerializer
+	values_serializer_class = BeerListValuesSerializer
 
 	def get_queryset(self):
-		queryset = Beer.objects.all().annotate(average_rate=Avg('beerreview__review_overall')).order_by(F('id').asc(nulls_last=True))
 		beer_name = self.request.query_params.get('beer_name', None)
 		beer_style = self.request.query_params.get('beer_style', None)
-		if beer_name is not None:
-			queryset = queryset.filter(beer_name__icontains=beer_name)
-		if beer_style is not None:
-			queryset = queryset.filter(beer_style__icontains=beer_style)
-		return queryset
+		return beer_list_queryset(beer_name, beer_style)
 
-class BeerDetail(generics.RetrieveAPIView):
+class BeerDetail(ReplicaReadMixin, generics.RetrieveAPIView):
 	permission_classes = [permissions.IsAuthenticated]
 	serializer_class = BeerDetailSerializer
 
 	def get_queryset(self):
-		queryset = Beer.objects.all().annotate(average_rate=Avg('beerreview__review_overall')).order_by(F('id').desc(nulls_last=True))
-		queryset = queryset.annotate(average_aroma=Avg('beerreview__review_aroma'))
-		queryset = queryset.annotate(average_appearance=Avg('beerreview__review_appearance'))
-		queryset = queryset.annotate(average_palate=Avg('beerreview__review_palate'))
-		queryset = queryset.annotate(average_taste=Avg('beerreview__review_taste'))
-		related_model = BeerReview.objects.filter(Q(review_user=self.request.user))
-		related_model_subquery = related_model.filter(review_beer=OuterRef('pk'))
-		queryset = queryset.annotate(is_reviewed=Subquery(related_model_subquery.values('id')))
-		return queryset
-
-class BeerRatingList(generics.ListAPIView):
+		return beer_detail_queryset(self.request.user)
+
+class BeerRatingList(ReplicaReadMixin, ValuesListMixin, generics.ListAPIView):
 	permission_classes = [permissions.IsAuthenticated]
-	queryset = Beer.objects.all().annotate(average_rate=Avg('beerreview__review_overall')).order_by(F('average_rate').desc(nulls_last=True))
 	serializer_class = BeerRatingSerializer
+	values_serializer_class = BeerRatingValuesSerializer
+
+	def get_queryset(self):
+		return beer_rating_queryset()
 
-class BeerReviewList(generics.ListAPIView):
+class BeerReviewList(ValuesListMixin, generics.ListAPIView):
 	permission_classes = [permissions.IsAuthenticated]
 	serializer_class = BeerReviewListSerializer
+	values_serializer_class = BeerReviewListValuesSerializer
 
 	def get_queryset(self, *args, **kwargs):
-		queryset = BeerReview.objects.all().filter(review_user=self.request.user).order_by(F('review_time').desc(nulls_last=True))
-		queryset = queryset.annotate(beer_name=F('review_beer__beer_name'), beer_style=F('review_beer__beer_style'), beer_image=F('review_beer__beer_image'))
-		return queryset
+		return beer_review_queryset(self.request.user)
 
-class BeerReviewPost(generics.CreateAPIView):
+class BeerReviewPost(ReplicaWriteMixin, generics.CreateAPIView):
 	permission_classes = [permissions.IsAuthenticated]
 	queryset = BeerReview.objects.all()
 	serializer_class = BeerReviewPutPostSerializer
 
 	def perform_create(self, serializer):
-		serializer.save(review_user=self.request.user)
+		try:
+			with transaction.atomic():
+				serializer.save(review_user=self.request.user)
+		except IntegrityError:
+			raise ValidationError({'review_beer': ['You have already reviewed this beer.']})
+		log_review(self.request.user, serializer.instance.review_beer_id)
 
-class BeerReviewPut(generics.UpdateAPIView):
+class BeerReviewPut(ReplicaWriteMixin, generics.UpdateAPIView):
 	permission_classes = [permissions.IsAuthenticated]
 	queryset = BeerReview.objects.all()
 	serializer_class = BeerReviewPutPostSerializer
 
 	def get_object(self):
-		post_user = get_object_or_404(BeerReview, id=self.request.data["id"])
+		post_user = get_object_or_404(BeerReview, id=self.request.data["id"], review_user=self.request.user)
 		return post_user
 
 	def perform_create(self, serializer):
 		serializer.save(review_user=self.request.user)
 
+	def perform_update(self, serializer):
+		try:
+			with transaction.atomic():
+				serializer.save()
+		except IntegrityError:
+			raise ValidationError({'review_beer': ['You have already reviewed this beer.']})
+		log_review(self.request.user, serializer.instance.review_beer_id)
+
+class BeerReviewUpsert(ReplicaWriteMixin, generics.GenericAPIView):
+	permission_classes = [permissions.IsAuthenticated]
+	serializer_class = BeerReviewUpsertSerializer
+
+	def put(self, request, *args, **kwargs):
+		serializer = self.get_serializer(data=request.data)
+		serializer.is_valid(raise_exception=True)
+		# foreign keys are deferred to commit of outermost transaction, upsert of a missing beer doesn't fail here
+		beer = get_object_or_404(Beer.objects.only('id'), pk=self.kwargs['pk'])
+		review = BeerReview.objects.upsert(request.user, beer.pk, **serializer.validated_data)
+		log_review(request.user, review.review_beer_id)
+		response_status = status.HTTP_201_CREATED if review.created else status.HTTP_200_OK
+		return Response(self.get_serializer(review).data, status=response_status)
+
+class Echo:
+	"""
+	File-like object returning written value, lets csv.writer produce lines for streaming.
+	"""
+	def write(self, value):
+		return value
+
+class BeerReviewExport(generics.GenericAPIView):
+	permission_classes = [permissions.IsAuthenticated]
+	fields = ['id', 'review_beer', 'review_time', 'beer_name', 'beer_style', 'beer_image', 'review_overall',
+			  'review_aroma', 'review_appearance', 'review_palate', 'review_taste']
+	chunk_size = 2000
+
+	def get_queryset(self):
+		return beer_review_queryset(self.request.user).values_list(*self.fields)
+
+	def iter_rows(self):
+		# values are prepared the same way serializers do, absolute media base is built once
+		media_url = media_base_url(self.request)
+		time_field = serializers.DateTimeField()
+		image_index = self.fields.index('beer_image')
+		time_index = self.fields.index('review_time')
+		# server side cursor keeps memory constant regardless of history size
+		for row in self.get_queryset().iterator(chunk_size=self.chunk_size):
+			row = list(row)
+			row[image_index] = media_url + row[image_index]
+			row[time_index] = time_field.to_representation(row[time_index])
+			yield row
+
+	def iter_ndjson(self):
+		for row in self.iter_rows():
+			yield json.dumps(dict(zip(self.fields, row)), default=float) + '\n'
+
+	def iter_csv(self):
+		writer = csv.writer(Echo())
+		yield writer.writerow(self.fields)
+		for row in self.iter_rows():
+			yield writer.writerow(row)
+
+	def get(self, request, *args, **kwargs):
+		export_format = request.query_params.get('export_format', 'ndjson')
+		if export_format == 'csv':
+			response = StreamingHttpResponse(self.iter_csv(), content_type='text/csv')
+		elif export_format == 'ndjson':
+			response = StreamingHttpResponse(self.iter_ndjson(), content_type='application/x-ndjson')
+		else:
+			raise ParseError('export_format must be csv or ndjson.')
+		response['Content-Disposition'] = 'attachment; filename="beer_reviews.{}"'.format(export_format)
+		return response
+
+class BeerReviewImport(generics.GenericAPIView):
+	permission_classes = [permissions.IsAdminUser]
+	readers = {
+		'text/csv': read_csv,
+		'application/x-ndjson': read_ndjson,
+		'application/jsonl': read_ndjson,
+	}
+
+	def post(self, request, *args, **kwargs):
+		# body is read line by line from the stream, so request.data is never parsed
+		content_type = request.content_type.split(';')[0].strip()
+		if content_type not in self.readers:
+			raise UnsupportedMediaType(content_type)
+		if request.stream is None:
+			raise ParseError('Empty upload.')
+		try:
+			batch_size = int(request.query_params.get('batch_size', DEFAULT_BATCH_SIZE))
+		except ValueError:
+			raise ParseError('batch_size must be an integer.')
+		rows = self.readers[content_type](codecs.iterdecode(request.stream, 'utf-8'))
+		return Response(import_reviews(rows, batch_size=max(batch_size, 1)))
+
 class BeerReviewDetail(generics.RetrieveAPIView):
 	permission_classes = [permissions.IsAuthenticated]
 	serializer_class = BeerReviewDetailSerializer
 
 	def get_queryset(self, *args, **kwargs):
-		queryset = BeerReview.objects.all().filter(review_user=self.request.user).order_by(F('review_time').desc(nulls_last=True))
-		queryset = queryset.annotate(beer_name=F('review_beer__beer_name'), beer_style=F('review_beer__beer_style'), beer_image=F('review_beer__beer_image'))
-		return queryset
+		return beer_review_queryset(self.request.user)
 
 # class BeerRecommendationPost(generics.CreateAPIView):
 # 	permission_classes = [permissions.IsAdminUser]
@@ -95,7 +244,97 @@ class BeerRecommendationDetail(generics.ListAPIView):
 	serializer_class = BeerRecommendationSerializer
 
 	def get_queryset(self, *args, **kwargs):
-		return BeerRecommendation.objects.all().filter(recommendation_user=self.request.user)
+		return beer_recommendation_queryset(self.request.user)
+
+	def list(self, request, *args, **kwargs):
+		response = super().list(request, *args, **kwargs)
+		for recommendation in response.data['results']:
+			log_impressions(request.user, 'beer_recs', [recommendation['top{}_beer'.format(i)] for i in range(1, 11)])
+		return response
+
+class BeerOnboarding(generics.GenericAPIView):
+	"""
+	Best beers of styles (and breweries) chosen by new user, assembled from in-memory popularity rankings.
+	"""
+	permission_classes = [permissions.IsAuthenticated]
+
+	def get(self, request, *args, **kwargs):
+		try:
+			count = int(request.query_params.get('count', 10))
+		except ValueError:
+			raise ParseError('count must be an integer.')
+		table = get_table()
+		beer_ids = table.top(min(max(count, 1), RANKING_DEPTH),
+							 request.query_params.getlist('beer_style'), request.query_params.getlist('brewery_name'))
+		log_impressions(request.user, 'onboarding', beer_ids)
+		return Response([table.beers[beer_id] for beer_id in beer_ids])
+
+class BeerRecommendationRerank(generics.GenericAPIView):
+	"""
+	Recommendations re-ranked from stored candidates with style/ABV filters, brewery limit and diversity.
+	Users without candidates are re-ranked from overall popularity ranking.
+	"""
+	permission_classes = [permissions.IsAuthenticated]
+
+	def get_number(self, name, cast, minimum=None, maximum=None):
+		value = self.request.query_params.get(name, None)
+		if value is None:
+			return None
+		try:
+			value = cast(value)
+		except ValueError:
+			raise ParseError('{} must be a number.'.format(name))
+		# float() accepts nan and inf, nan passes every range check
+		if not math.isfinite(value):
+			raise ParseError('{} must be a finite number.'.format(name))
+		if minimum is not None and value < minimum:
+			raise ParseError('{} must be at least {}.'.format(name, minimum))
+		if maximum is not None and value > maximum:
+			raise ParseError('{} must be at most {}.'.format(name, maximum))
+		return value
+
+	def get_candidates(self):
+		row = BeerCandidates.objects.filter(user=self.request.user).values_list('beer_ids', 'scores').first()
+		if row is not None:
+			return unpack(row[0], 'i'), unpack(row[1], 'f')
+		ranking = get_table().overall
+		return [beer_id for _, beer_id in ranking], [-score for score, _ in ranking]
+
+	def get(self, request, *args, **kwargs):
+		count = self.get_number('count', int, 1, RANKING_DEPTH) or 10
+		beer_ids, scores = self.get_candidates()
+		catalog = get_catalog(beer_ids)
+		picked = rerank(catalog, beer_ids, scores, count=count,
+						beer_styles=request.query_params.getlist('beer_style'),
+						exclude_styles=request.query_params.getlist('exclude_style'),
+						min_abv=self.get_number('min_abv', float),
+						max_abv=self.get_number('max_abv', float),
+						max_per_brewery=self.get_number('max_per_brewery', int, 1),
+						diversity=self.get_number('diversity', float, 0, 1) or 0.0)
+		log_impressions(request.user, 'rerank', [catalog.ids[position] for position, _ in picked])
+		return Response([catalog.beer(position, score) for position, score in picked])
+
+class SharedScopedRateThrottle(ScopedRateThrottle):
+	"""
+	Request history is kept in 'shared' cache, so limits hold across worker processes.
+	"""
+	cache = ConnectionProxy(caches, 'shared')
+
+class TrendingBeers(generics.GenericAPIView):
+	"""
+	Beers with most recent reviews, ranked by refresh_trending command, overall or of one beer_style.
+	"""
+	permission_classes = [permissions.IsAuthenticated]
+	throttle_classes = [SharedScopedRateThrottle]
+	throttle_scope = 'trending'
+
+	def get(self, request, *args, **kwargs):
+		try:
+			count = int(request.query_params.get('count', 10))
+		except ValueError:
+			raise ParseError('count must be an integer.')
+		trending = get_trending(request.query_params.get('beer_style', None))
+		return Response(trending[:min(max(count, 1), TRENDING_DEPTH)])
 
 class UserRegistration(generics.CreateAPIView):
 	permission_classes = [permissions.AllowAny]
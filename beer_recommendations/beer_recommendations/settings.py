@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
 from pathlib import Path
+from importlib.util import find_spec
 import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -30,6 +31,10 @@ ALLOWED_HOSTS = []
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+# absolute media base (e.g. CDN), built from request host if not set
+MEDIA_BASE_URL = os.environ.get('MEDIA_BASE_URL')
+# beer images are resized to this size for list endpoints at upload time
+BEER_THUMBNAIL_SIZE = (256, 256)
 # Application definition
 
 INSTALLED_APPS = [
@@ -46,7 +51,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'beer_app.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'django.middleware.gzip.GZipMiddleware',
+    'beer_app.middleware.BrotliMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -80,15 +88,46 @@ WSGI_APPLICATION = 'beer_recommendations.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 
+# Database settings can be overridden from environment, cron_job.py reads the same variables.
+# DATABASE_POOL_MAX_SIZE > 0 enables in-process connection pool (beer_app.postgresql_pool),
+# pool size is per worker process: workers * DATABASE_POOL_MAX_SIZE must stay below max_connections.
+# Otherwise connections persist per thread for DATABASE_CONN_MAX_AGE seconds.
+DATABASE_POOL_MAX_SIZE = int(os.environ.get('DATABASE_POOL_MAX_SIZE', 0))
+
 DATABASES = {
     'default': {
+        'ENGINE': 'beer_app.postgresql_pool' if DATABASE_POOL_MAX_SIZE else 'django.db.backends.postgresql_psycopg2',
+        'NAME': os.environ.get('DATABASE_NAME', 'beer_recommendations'),
+        'USER': os.environ.get('DATABASE_USER', 'beer_lover'),
+        'PASSWORD': os.environ.get('DATABASE_PASSWORD', 'lovebeer'),
+        'HOST': os.environ.get('DATABASE_HOST', 'localhost'),
+        'PORT': os.environ.get('DATABASE_PORT', '5432'),
+        # pooled connections are returned to pool at the end of each request
+        'CONN_MAX_AGE': 0 if DATABASE_POOL_MAX_SIZE else int(os.environ.get('DATABASE_CONN_MAX_AGE', 60)),
+        # persistent connections are checked before first use in a request
+        'CONN_HEALTH_CHECKS': True,
+        'POOL_OPTIONS': {
+            'MIN_SIZE': int(os.environ.get('DATABASE_POOL_MIN_SIZE', 0)),
+            'MAX_SIZE': DATABASE_POOL_MAX_SIZE,
+            'TIMEOUT': float(os.environ.get('DATABASE_POOL_TIMEOUT', 10)),
+            'MAX_IDLE': float(os.environ.get('DATABASE_POOL_MAX_IDLE', 600)),
+        },
+    },
+
+    # Read replica, same credentials as default unless overridden. Tests read it through default.
+    'replica': {
         'ENGINE': 'django.db.backends.postgresql_psycopg2',
-        'NAME': 'beer_recommendations',
-        'USER': 'beer_lover',
-        'PASSWORD': 'lovebeer',
-        'HOST': 'localhost',
-        'PORT': '5432',
-    }
+        'NAME': os.environ.get('DATABASE_REPLICA_NAME', os.environ.get('DATABASE_NAME', 'beer_recommendations')),
+        'USER': os.environ.get('DATABASE_REPLICA_USER', os.environ.get('DATABASE_USER', 'beer_lover')),
+        'PASSWORD': os.environ.get('DATABASE_REPLICA_PASSWORD', os.environ.get('DATABASE_PASSWORD', 'lovebeer')),
+        'HOST': os.environ.get('DATABASE_REPLICA_HOST', os.environ.get('DATABASE_HOST', 'localhost')),
+        'PORT': os.environ.get('DATABASE_REPLICA_PORT', os.environ.get('DATABASE_PORT', '5432')),
+        'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
 
     # 'default': {
     #     'ENGINE': 'django.db.backends.sqlite3',
@@ -96,6 +135,46 @@ DATABASES = {
     # }
 }
 
+# Default cache is local to each worker process. Rate limits of throttled views (e.g. trending) and
+# read-your-writes marks (beer_app.routers) are kept in 'shared' cache, it has to be shared by all
+# workers in production, e.g.
+# SHARED_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache SHARED_CACHE_LOCATION=redis://host:6379.
+# Without it limits are per worker process and only the worker that served a write sees its mark.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': os.environ.get('SHARED_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('SHARED_CACHE_LOCATION', 'shared'),
+    },
+}
+
+DATABASE_ROUTERS = ['beer_app.routers.ReplicaRouter']
+# Alias read-heavy endpoints and cron_job extract use, replica is used only if its host is configured
+REPLICA_DATABASE = 'replica' if os.environ.get('DATABASE_REPLICA_HOST') else 'default'
+# After a review write the user reads from default for this many seconds (replication lag margin).
+# Writes are marked in 'shared' cache and by a signed cookie (beer_app.routers.STICKY_COOKIE).
+REPLICA_STICKY_SECONDS = 10
+
+# Served recommendations and reviews are logged by beer_app.event_log, batches are written
+# from a background thread of each worker every FLUSH_SECONDS or once BATCH_SIZE events wait.
+RECOMMENDATION_LOG = {
+    'ENABLED': os.environ.get('RECOMMENDATION_LOG_ENABLED', '1') == '1',
+    'BACKGROUND': True,
+    'FLUSH_SECONDS': 2.0,
+    'BATCH_SIZE': 1000,
+    'MAX_BUFFER': 100000,
+}
+
+# Per view request timings of beer_app.middleware.MetricsMiddleware, served at /metrics
+# in Prometheus text format to ALLOWED_IPS (empty list allows everyone).
+REQUEST_METRICS = {
+    'ENABLED': os.environ.get('REQUEST_METRICS_ENABLED', '1') == '1',
+    'BUCKETS': [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0],
+    'ALLOWED_IPS': [ip for ip in os.environ.get('REQUEST_METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip],
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -136,13 +215,25 @@ STATIC_URL = '/static/'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'beer_app.metrics.TimedTokenAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'beer_app.renderers.ORJSONRenderer',
+    ] + (['beer_app.renderers.MessagePackRenderer'] if find_spec('msgpack') else []) + [
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
-    'COERCE_DECIMAL_TO_STRING': False
+    'COERCE_DECIMAL_TO_STRING': False,
+    # per user rates of views with throttle_scope
+    'DEFAULT_THROTTLE_RATES': {
+        'trending': '60/min',
+    },
 }
 
 APPEND_SLASH = False
 
+# used by beer_app.middleware.BrotliMiddleware, 0-11
+BROTLI_QUALITY = 5
+
 TEST_RUNNER = 'beer_app.test.csv_loading_test_runner.CSVLoadingTestRunner'
\ No newline at end of file
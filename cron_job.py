@@ -1,18 +1,85 @@
 # Default libraries
 import psycopg2
 import pandas as pd
+import numpy as np
 import sys
-import random
-# Initiate PySpark
+import argparse
+import cProfile
+import glob
+import json
+import platform
+import resource
+import threading
+import time
+import tracemalloc
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+# PySpark is imported with the Spark session, only train stage needs it
 # !pip install pyspark
 # !pip install -q findspark
-from pyspark.sql import SparkSession
-spark = SparkSession.builder.master("local[*]").getOrCreate()
-# PySpark libraries
-from pyspark.ml.recommendation import ALS
-import timeit
 
-PATH_TO_DATA = 'D:/TRKPO/beer-recommendations-backend/data_process/'
+# Output files and stage checkpoints, resumed runs read them back
+PATH_TO_DATA = os.environ.get('CRON_JOB_DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data_process'))
+
+STAGES = ['extract', 'index', 'train', 'score', 'fill', 'publish']
+
+# Run reports (one JSON file per run) and cProfile dumps are kept in these subdirectories of data dir
+RUNS_DIR = 'runs'
+PROFILES_DIR = 'profiles'
+# resident memory is sampled this often while a stage runs
+RSS_SAMPLE_SECONDS = 0.05
+
+# ALS parameters of production model, recommender_eval.py compares alternatives
+ALS_PARAMS = {'rank': 10, 'max_iter': 15, 'reg_param': 0.1}
+
+# Implicit mode: every review is a positive interaction, weighted by its scores and age.
+# Confidence of reviewed beer is 1 + alpha * weight, of other beers 1.
+IMPLICIT_PARAMS = {'rank': 10, 'max_iter': 15, 'reg_param': 0.1, 'alpha': 10.0, 'cg_steps': 3}
+REVIEW_SIGNALS = ['review_overall', 'review_aroma', 'review_appearance', 'review_palate', 'review_taste']
+# weight of review this many days older than newest review is halved
+REVIEW_HALF_LIFE_DAYS = 730
+
+# Same as beer_app.popularity.PRIOR_REVIEWS
+POPULARITY_PRIOR_REVIEWS = 100
+
+# Longer ranked list per user kept for request time re-ranking (beer_app.rerank)
+CANDIDATE_COUNT = 100
+# Table Django creates for beer_app.models.BeerCandidates
+CANDIDATES_TABLE = 'beer_app_beercandidates'
+
+_spark = None
+
+
+def get_spark():
+    """ Start Spark session on first use """
+    global _spark
+    if _spark is None:
+        from pyspark.sql import SparkSession
+        _spark = SparkSession.builder.master(os.environ.get('SPARK_MASTER', 'local[*]')).getOrCreate()
+    return _spark
+
+
+def db_params(prefix='DATABASE_'):
+    """ Connection parameters from the same environment variables as DATABASES in Django settings """
+    params_dic = {
+        'host'      : os.environ.get('DATABASE_HOST', 'localhost'),
+        'port'      : os.environ.get('DATABASE_PORT', '5432'),
+        'database'  : os.environ.get('DATABASE_NAME', 'beer_recommendations'),
+        'user'      : os.environ.get('DATABASE_USER', 'beer_lover'),
+        'password'  : os.environ.get('DATABASE_PASSWORD', 'lovebeer'),
+        'connect_timeout': 10,
+        # keep connection alive through firewalls/NAT during long transfers
+        'keepalives': 1,
+        'keepalives_idle': 60,
+    }
+    if prefix != 'DATABASE_':
+        # e.g. DATABASE_REPLICA_HOST, defaults to primary
+        for key, name in [('host', 'HOST'), ('port', 'PORT'), ('database', 'NAME'), ('user', 'USER'), ('password', 'PASSWORD')]:
+            params_dic[key] = os.environ.get(prefix + name, params_dic[key])
+    return params_dic
 
 
 def connect(params_dic):
@@ -49,149 +116,697 @@ def postgresql_to_dataframe(conn, select_query, column_names):
     df = pd.DataFrame(tupples, columns=column_names)
     return df
 
-def recommend(new_users, reviews):
-    # Create Spark DataFrame
-    beer_ratings = reviews[['user_id', 'beer_id', 'review_overall']]
-    beer_ratings = beer_ratings.rename(columns = {'review_overall': 'rating'})
-    beer_ratings = spark.createDataFrame(beer_ratings)
 
-    # Select relevant columns & convert the columns to the proper data types
-    beer_tbl = beer_ratings.select(beer_ratings.user_id.cast("integer"),
-                                 beer_ratings.beer_id.cast("integer"),
-                                 beer_ratings.rating.cast("double"))
+class Checkpoints:
+    """
+    Stage outputs saved as .npz files in data_dir, completed stages of current run and timings in state.json.
+    Completed stages are cleared once a run has published, only an interrupted run is resumed.
+    """
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.state_path = os.path.join(data_dir, 'state.json')
+        os.makedirs(data_dir, exist_ok=True)
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                self.state = json.load(f)
+        else:
+            self.state = {'completed': [], 'timings': {}}
+
+    def path(self, stage, extension='.npz'):
+        return os.path.join(self.data_dir, stage + extension)
+
+    def is_done(self, stage):
+        return stage in self.state['completed']
+
+    def has_output(self, stage):
+        """ Stage output of current run or of last finished one is in data_dir """
+        return self.is_done(stage) or stage in self.state.get('finished', [])
+
+    def save(self, stage, **arrays):
+        # write to temporary file first, interrupted save never looks like a checkpoint
+        tmp_path = self.path(stage, '.tmp.npz')
+        with section('save_checkpoint'):
+            np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, self.path(stage))
+
+    def load(self, stage):
+        with section('load_checkpoint'), np.load(self.path(stage)) as data:
+            return {name: data[name] for name in data.files}
+
+    def mark_done(self, stage, seconds):
+        # outputs of later stages were computed from previous run of this stage
+        self.invalidate_from(STAGES[STAGES.index(stage) + 1:])
+        self.state['completed'].append(stage)
+        self.state['timings'][stage] = round(seconds, 3)
+        self.write_state()
+
+    def finish(self):
+        """ Next run starts from first stage, outputs are kept until it replaces them """
+        self.state['finished'] = self.state['completed']
+        self.state['completed'] = []
+        self.write_state()
+
+    def invalidate_from(self, stages):
+        self.state['completed'] = [stage for stage in self.state['completed'] if stage not in stages]
+        self.write_state()
+
+    def write_state(self):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+
+def rss_mb():
+    """ Resident memory of this process, peak since start where /proc is not available """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def cpu_seconds():
+    """ User and system time of this process and its finished child processes (fill workers) """
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+class StageProfile:
+    """
+    Wall and CPU time, sampled peak RSS and timed sections of one stage, with tracemalloc_top
+    largest allocation sites if tracemalloc is tracing and cProfile stats dumped to profile_path.
+    Memory of Spark JVM is not included.
+    """
+    current = None
+
+    def __init__(self, stage, tracemalloc_top=0, profile_path=None):
+        self.stage = stage
+        self.tracemalloc_top = tracemalloc_top if tracemalloc.is_tracing() else 0
+        self.profile_path = profile_path
+        self.sections = {}
+        self.result = {}
+
+    def __enter__(self):
+        self.rss_start = self.rss_peak = rss_mb()
+        self.sampling = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+        if self.tracemalloc_top:
+            tracemalloc.reset_peak()
+            self.snapshot = tracemalloc.take_snapshot()
+        self.profiler = cProfile.Profile() if self.profile_path else None
+        StageProfile.current = self
+        self.cpu_start = cpu_seconds()
+        self.wall_start = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.enable()
+        return self
+
+    def sample(self):
+        while not self.sampling.wait(RSS_SAMPLE_SECONDS):
+            self.rss_peak = max(self.rss_peak, rss_mb())
+
+    def __exit__(self, *exc_info):
+        if self.profiler is not None:
+            self.profiler.disable()
+        wall = time.perf_counter() - self.wall_start
+        cpu = cpu_seconds() - self.cpu_start
+        StageProfile.current = None
+        self.sampling.set()
+        self.sampler.join()
+        rss_end = rss_mb()
+        self.result = {
+            'wall_seconds': round(wall, 3),
+            'cpu_seconds': round(cpu, 3),
+            'rss_start_mb': round(self.rss_start, 1),
+            'rss_end_mb': round(rss_end, 1),
+            'rss_peak_mb': round(max(self.rss_peak, rss_end), 1),
+            'sections': {name: round(seconds, 3) for name, seconds in self.sections.items()},
+        }
+        if self.profiler is not None:
+            os.makedirs(os.path.dirname(self.profile_path), exist_ok=True)
+            self.profiler.dump_stats(self.profile_path)
+            self.result['profile'] = self.profile_path
+        if self.tracemalloc_top:
+            _, traced_peak = tracemalloc.get_traced_memory()
+            exclude = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, cProfile.__file__)]
+            snapshot = tracemalloc.take_snapshot().filter_traces(exclude)
+            # sites holding most memory allocated during the stage at its end
+            stats = snapshot.compare_to(self.snapshot.filter_traces(exclude), 'lineno')[:self.tracemalloc_top]
+            self.snapshot = None
+            self.result['traced_peak_mb'] = round(traced_peak / 2 ** 20, 1)
+            self.result['allocations'] = [{'site': '{}:{}'.format(stat.traceback[0].filename, stat.traceback[0].lineno),
+                                           'size_mb': round(stat.size / 2 ** 20, 2),
+                                           'size_diff_mb': round(stat.size_diff / 2 ** 20, 2),
+                                           'count': stat.count} for stat in stats]
+        return False
+
+
+@contextmanager
+def section(name):
+    """ Time part of a stage, reported in sections of its stage """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile = StageProfile.current
+        if profile is not None:
+            profile.sections[name] = profile.sections.get(name, 0.0) + time.perf_counter() - start
+
+
+def latest_report(runs_dir):
+    paths = sorted(glob.glob(os.path.join(runs_dir, '*.json')))
+    if not paths:
+        return None
+    with open(paths[-1]) as f:
+        return json.load(f)
+
+
+def save_report(runs_dir, report):
+    os.makedirs(runs_dir, exist_ok=True)
+    path = os.path.join(runs_dir, report['run_id'] + '.json')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def print_report(report, previous=None):
+    """ Stage table of run, wall time of the same stage in previous run for comparison """
+    previous_stages = previous['stages'] if previous else {}
+    print('{:<10}{:>10}{:>10}{:>12}{:>12}'.format('stage', 'wall s', 'cpu s', 'peak MB', 'previous s'))
+    for stage, result in report['stages'].items():
+        before = previous_stages.get(stage, {}).get('wall_seconds')
+        print('{:<10}{:>10.1f}{:>10.1f}{:>12.1f}{:>12}'.format(stage, result['wall_seconds'], result['cpu_seconds'],
+                                                            result['rss_peak_mb'], '-' if before is None else '{:.1f}'.format(before)))
+        for name, seconds in result['sections'].items():
+            print('  {:<18}{:>10.1f}'.format(name, seconds))
+
+
+def extract(checkpoints, options):
+    """ Load reviews and users without reviews """
+    conn = connect(db_params('DATABASE_REPLICA_'))
+    column_names = ['user_id', 'beer_id', 'review_time'] + REVIEW_SIGNALS
+    with section('query_reviews'):
+        review_df = postgresql_to_dataframe(conn, 'SELECT review_user_id, review_beer_id, EXTRACT(EPOCH FROM review_time), {} FROM beer_beerreview'.format(', '.join(REVIEW_SIGNALS)), column_names)
+    column_names = ['user_id']
+    new_users = postgresql_to_dataframe(conn, 'SELECT id FROM auth_user WHERE  id NOT IN (SELECT DISTINCT review_user_id FROM beer_beerreview)', column_names)
+    # Don't hold a server connection idle during training
+    conn.close()
+    if isinstance(review_df, int) or isinstance(new_users, int):
+        sys.exit(1)
+    print('DFs are built')
+    checkpoints.save('extract',
+                     user_id=review_df.user_id.to_numpy(dtype=np.int64),
+                     beer_id=review_df.beer_id.to_numpy(dtype=np.int64),
+                     review_time=review_df.review_time.to_numpy(dtype=np.float64),
+                     new_users=new_users.user_id.to_numpy(dtype=np.int64),
+                     **{name: review_df[name].to_numpy(dtype=np.float64) for name in REVIEW_SIGNALS})
+
+
+def review_weights(data, keep, half_life_days=REVIEW_HALF_LIFE_DAYS):
+    """ Weight in [0, 1] of kept reviews: mean of review scores out of 5, decayed with age """
+    scores = np.mean([data[name][keep] for name in REVIEW_SIGNALS], axis=0) / 5
+    review_time = data['review_time'][keep]
+    age_days = (review_time.max(initial=0) - review_time) / 86400
+    return (np.clip(scores, 0, 1) * 0.5 ** (age_days / half_life_days)).astype(np.float32)
+
+
+def index(checkpoints, options):
+    """
+    Map user and beer ids of reviews to contiguous int32 indices, explicit mode keeps reviews with scores >= 1.
+    Sorted raw ids are the reverse maps, raw id of index i is user_ids[i].
+    """
+    data = checkpoints.load('extract')
+    if options.mode == 'implicit':
+        # low scores are weak interactions, not missing ones
+        keep = np.ones(data['review_overall'].shape[0], dtype=bool)
+    else:
+        # Review scores of >= 1
+        keep = data['review_overall'] >= 1
+    user_ids, user_index = np.unique(data['user_id'][keep], return_inverse=True)
+    beer_ids, beer_index = np.unique(data['beer_id'][keep], return_inverse=True)
+    checkpoints.save('index',
+                     user_ids=user_ids,
+                     beer_ids=beer_ids,
+                     user_index=user_index.astype(np.int32),
+                     beer_index=beer_index.astype(np.int32),
+                     rating=data['review_overall'][keep].astype(np.float32),
+                     weight=review_weights(data, keep))
+
+
+def factors_array(factors, size):
+    """ Spark factors DataFrame (id, features) to array indexed by dense id """
+    factors = factors.toPandas()
+    result = np.zeros((size, len(factors.features.iloc[0])), dtype=np.float32)
+    result[factors.id.to_numpy()] = np.array(factors.features.tolist(), dtype=np.float32)
+    return result
+
+
+def fit_als(user_index, beer_index, rating, n_users, n_beers, rank=10, max_iter=15, reg_param=0.1, seed=0):
+    """ Fit Spark ALS on dense indices, returns user and beer factor arrays """
+    from pyspark.ml.recommendation import ALS
+
+    # Create Spark DataFrame
+    beer_ratings = pd.DataFrame({'user_id': user_index, 'beer_id': beer_index, 'rating': rating.astype(np.float64)})
+    beer_ratings = get_spark().createDataFrame(beer_ratings)
 
     # Create ALS model
     als = ALS(userCol="user_id",
               itemCol="beer_id",
               ratingCol="rating",
-              rank=10,
-              maxIter=15,
-              regParam=0.1,
+              rank=rank,
+              maxIter=max_iter,
+              regParam=reg_param,
               coldStartStrategy="drop",
               nonnegative=True,
-              implicitPrefs=False)
+              implicitPrefs=False,
+              seed=seed)
 
     # Fit the model
-    model = als.fit(beer_ratings)
-
-    # Generate n recommendations for all users
-    ALS_recommendations = model.recommendForAllUsers(10)
-
-    # Create temporary table
-    ALS_recommendations.registerTempTable("ALS_recs_temp")
-
-    # Clean up output, explode it, extract lateral view as separate columns
-    clean_recs = spark.sql("SELECT user_id, beer_ids_and_ratings.beer_id AS beer_id,\
-                                beer_ids_and_ratings.rating AS prediction \
-                                FROM ALS_recs_temp\
-                                LATERAL VIEW explode(recommendations) \
-                                exploded_table AS beer_ids_and_ratings")
-
-    # Filter for beers that each user has not consumed before
-    recommendations = clean_recs.join(beer_ratings.select('user_id', 'beer_id', 'rating'),
-                    ['user_id','beer_id'], "left")\
-                    .filter(beer_ratings.rating.isNull()).drop('rating')\
-                    .distinct()
-
-    recommendations = recommendations.select('user_id', 'beer_id').toPandas()
-
-    # Fill missing recommendations - NEED TO OPTIMIZE
-    users_with_not_full_recommends = recommendations[recommendations.groupby('user_id')['user_id'].transform('size') < 10].user_id.unique()
-    users_with_not_full_recommends.sort()
-    for i in range(0, users_with_not_full_recommends.shape[0]):
-        user = users_with_not_full_recommends[i]
-        values_to_fill = 10 - recommendations[recommendations.user_id == user].user_id.count()
-        beers_not_to_include = reviews[reviews.user_id == user].beer_id.unique()
-        not_consumed_beer = list(reviews[~reviews.beer_id.isin(beers_not_to_include)].beer_id.unique())
-        for j in range(0, values_to_fill):
-            beer_to_insert = random.choice(not_consumed_beer)
-            not_consumed_beer.remove(beer_to_insert)
-            recommendations = pd.concat([recommendations, pd.DataFrame([[user, beer_to_insert]], columns=recommendations.columns)], ignore_index=True)
-
-    # Sort and reshape
-    recommendations = recommendations.sort_values('user_id')
-    recommendations['beer_id_field_name'] = ['Rec'+ str(i) for i in range(0, 10)] * (recommendations.shape[0] // 10)
-    recommendations = recommendations.pivot(index='user_id', columns='beer_id_field_name', values='beer_id')
-    recommendations.columns = recommendations.columns.ravel()
-    recommendations.reset_index(inplace=True)
-
-    # Add users with no reviews - fill recommendations using top 10 beers with > 1000 reviews
-    top_10_rec = reviews[['beer_id', 'review_overall']]\
-        .pivot_table(index="beer_id", aggfunc=("count",'mean'))\
-        .dropna()
-
-    # Rename columns and flatten pivot table
-    top_10_rec.columns = top_10_rec.columns.to_series().str.join('_')
-    top_10_rec.reset_index(inplace=True)
-
-    # Filter for highest rated beers
-    top_10_rec = top_10_rec.query('review_overall_count >= 1000')\
-    .sort_values('review_overall_mean', ascending=False)\
-    .head(10)
-
-    top_10 = top_10_rec.beer_id.values
-
-    # Add to resulting df
-    for new_user in new_users:
-        new_row = list(top_10)
-        new_row.insert(0, new_user)
-        recommendations = pd.concat([recommendations, pd.DataFrame([new_row], columns=recommendations.columns)], ignore_index=True)
-
-    return recommendations, users_with_not_full_recommends
-
-
-start = timeit.default_timer()
-params_dic = {
-    'host'      : 'localhost',
-    'database'  : 'beer_recommendations',
-    'user'      : 'beer_lover',
-    'password'  : 'lovebeer'
-}
+    with section('spark_fit'):
+        model = als.fit(beer_ratings)
+    with section('to_pandas'):
+        return factors_array(model.userFactors, n_users), factors_array(model.itemFactors, n_beers)
 
-# Connect to the database
-conn = connect(params_dic)
-column_names = ['user_id', 'beer_id', 'review_overall']
-# Execute the "SELECT *" query
-review_df = postgresql_to_dataframe(conn, 'SELECT review_user_id, review_beer_id, review_overall FROM beer_beerreview', column_names)
-column_names = ['user_id']
-new_users = postgresql_to_dataframe(conn, 'SELECT id FROM auth_user WHERE  id NOT IN (SELECT DISTINCT review_user_id FROM beer_beerreview)', column_names)
-print('DFs are built')
-
-reviews = review_df.copy()
-new_users = new_users.copy()
-# Review scores of >= 1
-reviews = reviews[(reviews['review_overall'] >= 1)]
-recommendations, users_with_not_full_recommends = recommend(new_users, reviews)
-print('Recs are built')
-
-recommendations.to_csv(PATH_TO_DATA + 'recommendations.csv', index=False)
-with open(PATH_TO_DATA + 'users_with_not_full_recommends.txt', 'w') as f:
-    for item in users_with_not_full_recommends:
-        f.write("%d\n" % item)
-
-cursor = conn.cursor()
-cursor.execute('BEGIN;')
-try:
-    cursor.execute('TRUNCATE beer_beerrecommendation;')
-except (Exception, psycopg2.DatabaseError) as error:
-    print("Error: %s" % error)
-    cursor.execute('ROLBACK;')
-    cursor.close()
-    conn.close()
-    sys.exit(1)
-print('Table is truncated')
-
-try:
-    request = "COPY beer_beerrecommendation (recommendation_user_id, top1_beer_id, top2_beer_id, top3_beer_id, top4_beer_id, top5_beer_id, top6_beer_id, top7_beer_id, top8_beer_id, top9_beer_id, top10_beer_id) FROM '{}' DELIMITER ',' CSV HEADER ENCODING 'UTF8';".format(PATH_TO_DATA + 'recommendations.csv')
-    cursor.execute(request)
-except (Exception, psycopg2.DatabaseError) as error:
-    print("Error: %s" % error)
-    cursor.execute('ROLBACK;')
+
+def sorted_by_rows(rows, columns, values, n_rows):
+    """ CSR arrays (columns, values, indptr) of (row, column, value) triples """
+    order = np.argsort(rows, kind='stable')
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n_rows))])
+    return columns[order], values[order], indptr
+
+
+def segment_sum(values, indptr):
+    """ Sums of values rows over CSR segments, zero for empty segments """
+    result = np.zeros((indptr.shape[0] - 1, values.shape[1]), dtype=values.dtype)
+    nonempty = indptr[1:] > indptr[:-1]
+    if values.shape[0]:
+        # reduceat sums from each start to next one, empty segments in between don't move it
+        result[nonempty] = np.add.reduceat(values, indptr[:-1][nonempty], axis=0)
+    return result
+
+
+def conjugate_gradient(factors, fixed, columns, confidence, indptr, reg_param, steps):
+    """
+    Improve factors rows in place with steps of conjugate gradient on implicit ALS normal equations
+    (Y^T C_u Y + reg I) x_u = Y^T C_u p_u, all rows at once.
+    Y^T C_u Y = Y^T Y + Y^T (C_u - I) Y, so only reviewed beers are visited: O(nnz * rank) per step.
+    """
+    gram = fixed.T @ fixed
+    reviewed = fixed[columns]
+    # preference is 1 on reviewed beers, 0 elsewhere
+    b = segment_sum((1 + confidence)[:, None] * reviewed, indptr)
+    rows = np.repeat(np.arange(indptr.shape[0] - 1), np.diff(indptr))
+
+    def multiply(direction):
+        dots = (direction[rows] * reviewed).sum(axis=1)
+        return direction @ gram + reg_param * direction + segment_sum((confidence * dots)[:, None] * reviewed, indptr)
+
+    residual = b - multiply(factors)
+    direction = residual.copy()
+    residual_norm = (residual * residual).sum(axis=1)
+    for _ in range(steps):
+        product = multiply(direction)
+        curvature = (direction * product).sum(axis=1)
+        step = np.divide(residual_norm, curvature, out=np.zeros_like(residual_norm), where=curvature > 0)
+        factors += step[:, None] * direction
+        residual -= step[:, None] * product
+        new_norm = (residual * residual).sum(axis=1)
+        if new_norm.max(initial=0) < 1e-10:
+            break
+        ratio = np.divide(new_norm, residual_norm, out=np.zeros_like(new_norm), where=residual_norm > 0)
+        direction = residual + ratio[:, None] * direction
+        residual_norm = new_norm
+
+
+def fit_implicit_als(user_index, beer_index, weight, n_users, n_beers, rank=10, max_iter=15, reg_param=0.1,
+                     alpha=10.0, cg_steps=3, seed=0):
+    """
+    Implicit ALS (Hu, Koren, Volinsky) with confidence 1 + alpha * weight, returns user and beer factor arrays.
+    Least squares are solved approximately by conjugate gradient warm started from previous factors.
+    """
+    rng = np.random.default_rng(seed)
+    user_factors = (rng.standard_normal((n_users, rank)) * 0.01).astype(np.float32)
+    beer_factors = (rng.standard_normal((n_beers, rank)) * 0.01).astype(np.float32)
+    # C - I is alpha * weight on reviewed beers and 0 elsewhere
+    confidence = (alpha * weight).astype(np.float32)
+    by_user = sorted_by_rows(user_index, beer_index, confidence, n_users)
+    by_beer = sorted_by_rows(beer_index, user_index, confidence, n_beers)
+    for _ in range(max_iter):
+        conjugate_gradient(user_factors, beer_factors, *by_user, reg_param, cg_steps)
+        conjugate_gradient(beer_factors, user_factors, *by_beer, reg_param, cg_steps)
+    return user_factors, beer_factors
+
+
+def train(checkpoints, options):
+    """ Fit ALS model, factors are saved as arrays indexed by dense id """
+    data = checkpoints.load('index')
+    if options.mode == 'implicit':
+        user_factors, beer_factors = fit_implicit_als(data['user_index'], data['beer_index'], data['weight'],
+                                                      data['user_ids'].shape[0], data['beer_ids'].shape[0],
+                                                      seed=options.seed, **IMPLICIT_PARAMS)
+    else:
+        user_factors, beer_factors = fit_als(data['user_index'], data['beer_index'], data['rating'],
+                                             data['user_ids'].shape[0], data['beer_ids'].shape[0],
+                                             seed=options.seed, **ALS_PARAMS)
+    checkpoints.save('train', user_factors=user_factors, beer_factors=beer_factors)
+
+
+def top_unseen_matrix(user_factors, beer_factors, user_index, beer_index, users=None, count=10, chunk_size=None,
+                      with_scores=False):
+    """
+    count best scored beers per user of users (all by default) excluding reviewed ones,
+    rows ordered by descending score, -1 where user has fewer unseen beers.
+    With with_scores also returns their float32 scores, -inf where beer is -1.
+    """
+    n_users, n_beers = user_factors.shape[0], beer_factors.shape[0]
+    users = np.arange(n_users) if users is None else np.asarray(users)
+    count = min(count, n_beers)
+    # reviews as CSR rows: beers of user u are reviewed_beers[indptr[u]:indptr[u + 1]]
+    order = np.argsort(user_index, kind='stable')
+    reviewed_beers = beer_index[order]
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(user_index, minlength=n_users))])
+    # score matrix of one chunk stays around 256MB
+    chunk_size = chunk_size or max(1, (1 << 26) // max(n_beers, 1))
+    result = np.full((users.shape[0], count), -1, dtype=np.int32)
+    result_scores = np.full((users.shape[0], count), -np.inf, dtype=np.float32)
+    for start in range(0, users.shape[0], chunk_size):
+        chunk = users[start:start + chunk_size]
+        scores = user_factors[chunk] @ beer_factors.T
+        lengths = indptr[chunk + 1] - indptr[chunk]
+        rows = np.repeat(np.arange(chunk.shape[0]), lengths)
+        positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(indptr[chunk], lengths)
+        scores[rows, reviewed_beers[positions]] = -np.inf
+        top = np.argpartition(-scores, count - 1, axis=1)[:, :count]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        ranking = np.argsort(-top_scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, ranking, axis=1)
+        top_scores = np.take_along_axis(top_scores, ranking, axis=1)
+        valid = np.isfinite(top_scores)
+        result[start:start + chunk.shape[0]] = np.where(valid, top, -1)
+        result_scores[start:start + chunk.shape[0]] = np.where(valid, top_scores, -np.inf)
+    if with_scores:
+        return result, result_scores
+    return result
+
+
+def matrix_pairs(matrix):
+    """ (user index, beer index) pairs of valid entries of top_unseen_matrix of all users, ordered by user """
+    valid = matrix >= 0
+    users = np.repeat(np.arange(matrix.shape[0], dtype=np.int32), matrix.shape[1]).reshape(matrix.shape)
+    return users[valid], matrix[valid]
+
+
+def top_unseen(user_factors, beer_factors, user_index, beer_index, count=10, chunk_size=None):
+    """ top_unseen_matrix of all users as (user index, beer index) pairs ordered by user """
+    return matrix_pairs(top_unseen_matrix(user_factors, beer_factors, user_index, beer_index, count=count, chunk_size=chunk_size))
+
+
+def score(checkpoints, options):
+    """
+    Top CANDIDATE_COUNT with scores for all users, without beers each user has already reviewed.
+    First 10 of them are recommendations.
+    """
+    data = checkpoints.load('index')
+    factors = checkpoints.load('train')
+    # factor rows are addressed by dense index, no joins with reviews needed
+    candidates, candidate_scores = top_unseen_matrix(factors['user_factors'], factors['beer_factors'],
+                                                     data['user_index'], data['beer_index'],
+                                                     count=CANDIDATE_COUNT, with_scores=True)
+    user_index, beer_index = matrix_pairs(candidates[:, :10])
+    checkpoints.save('score', user_index=user_index, beer_index=beer_index,
+                     candidates=candidates, candidate_scores=candidate_scores)
+
+
+def share_array(array, segments):
+    """ Copy array to new shared memory segment, returns description workers attach with """
+    segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    segments.append(segment)
+    np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+    return segment.name, array.shape, array.dtype.str
+
+
+def attach_arrays(descriptions):
+    segments = [shared_memory.SharedMemory(name=name) for name, _, _ in descriptions]
+    arrays = [np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+              for segment, (_, shape, dtype) in zip(segments, descriptions)]
+    return segments, arrays
+
+
+def sample_not_in(rng, candidates, excluded, count):
+    """ count distinct random candidates not in excluded, excluded is small compared to candidates """
+    chosen = np.empty(0, dtype=candidates.dtype)
+    for _ in range(10):
+        drawn = candidates[rng.integers(0, candidates.shape[0], 2 * count + 8)]
+        drawn = drawn[~np.isin(drawn, excluded) & ~np.isin(drawn, chosen)]
+        # keep random order, drop repeated draws
+        _, first = np.unique(drawn, return_index=True)
+        chosen = np.concatenate([chosen, drawn[np.sort(first)]])[:count]
+        if chosen.shape[0] == count:
+            return chosen
+    # excluded covers most candidates
+    available = np.setdiff1d(candidates, np.concatenate([excluded, chosen]))
+    return np.concatenate([chosen, rng.permutation(available)[:count - chosen.shape[0]]])
+
+
+def fill_users(descriptions, start, stop, seed):
+    """
+    Fill rows start:stop of users needing recommendations, run in worker process.
+    Random choice is seeded per user, result doesn't depend on partitioning.
+    """
+    segments, (need_rows, matrix, counts, indptr, reviewed_beers, user_ids, candidates) = attach_arrays(descriptions)
+    try:
+        result = []
+        for row in need_rows[start:stop]:
+            count = counts[row]
+            # neither beers user has reviewed nor already recommended ones
+            excluded = np.concatenate([reviewed_beers[indptr[row]:indptr[row + 1]], matrix[row, :count]])
+            rng = np.random.default_rng([seed, user_ids[row]])
+            result.append(sample_not_in(rng, candidates, excluded, 10 - count))
+        return start, stop, result
+    finally:
+        for segment in segments:
+            segment.close()
+
+
+def fill(checkpoints, options):
+    """ Complete every user to 10 recommendations and pick top 10 for users with no reviews """
+    data = checkpoints.load('index')
+    new_users = checkpoints.load('extract')['new_users']
+    scored = checkpoints.load('score')
+    n_users, n_beers = data['user_ids'].shape[0], data['beer_ids'].shape[0]
+
+    # Row per user index with up to 10 beer indices, -1 for missing
+    order = np.argsort(scored['user_index'], kind='stable')
+    scored_users, scored_beers = scored['user_index'][order], scored['beer_index'][order]
+    counts = np.bincount(scored_users, minlength=n_users)
+    first = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    rank = np.arange(scored_users.shape[0]) - first[scored_users]
+    keep = rank < 10
+    matrix = np.full((n_users, 10), -1, dtype=np.int32)
+    matrix[scored_users[keep], rank[keep]] = scored_beers[keep]
+    counts = np.minimum(counts, 10)
+
+    # Fill missing recommendations, users are partitioned by index range between worker processes
+    need_rows = np.flatnonzero(counts < 10)
+    users_with_not_full_recommends = data['user_ids'][need_rows]
+    review_order = np.argsort(data['user_index'], kind='stable')
+    reviewed_beers = data['beer_index'][review_order]
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(data['user_index'], minlength=n_users))])
+    candidates = np.arange(n_beers, dtype=np.int32)
+
+    arrays = [need_rows, matrix, counts, indptr, reviewed_beers, data['user_ids'], candidates]
+    bounds = np.linspace(0, need_rows.shape[0], options.workers * 4 + 1).astype(int)
+    partitions = [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+    segments = []
+    try:
+        descriptions = [share_array(array, segments) for array in arrays]
+        with section('fill_users'):
+            if options.workers > 1 and len(partitions) > 1:
+                with ProcessPoolExecutor(max_workers=options.workers) as executor:
+                    futures = [executor.submit(fill_users, descriptions, start, stop, options.seed) for start, stop in partitions]
+                    results = [future.result() for future in futures]
+            else:
+                results = [fill_users(descriptions, start, stop, options.seed) for start, stop in partitions]
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+    for start, stop, filled in results:
+        for row, beers in zip(need_rows[start:stop], filled):
+            matrix[row, counts[row]:counts[row] + beers.shape[0]] = beers
+
+    # Users with no reviews get top 10 beers by Bayesian average score, same ranking as beer_app.popularity
+    review_counts = np.bincount(data['beer_index'], minlength=n_beers)
+    review_sums = np.bincount(data['beer_index'], weights=data['rating'], minlength=n_beers)
+    global_mean = review_sums.sum() / max(review_counts.sum(), 1)
+    scores = (review_sums + POPULARITY_PRIOR_REVIEWS * global_mean) / (review_counts + POPULARITY_PRIOR_REVIEWS)
+    popular = np.argsort(-scores, kind='stable').astype(np.int32)
+    top_10 = popular[:10]
+
+    # Users who have reviewed all but a few beers are completed with best beers, reviewed ones included
+    short_rows = np.flatnonzero((matrix < 0).any(axis=1))
+    for row in short_rows:
+        recommended = matrix[row][matrix[row] >= 0]
+        extra = popular[~np.isin(popular, recommended)][:10 - recommended.shape[0]]
+        matrix[row, recommended.shape[0]:recommended.shape[0] + extra.shape[0]] = extra
+    if short_rows.shape[0]:
+        print('{} users have fewer than 10 beers not reviewed, completed with best beers'.format(short_rows.shape[0]))
+
+    with open(os.path.join(checkpoints.data_dir, 'users_with_not_full_recommends.txt'), 'w') as f:
+        for item in users_with_not_full_recommends:
+            f.write("%d\n" % item)
+    checkpoints.save('fill', beer_index=matrix, new_users=new_users, top_10=top_10,
+                     users_with_not_full_recommends=users_with_not_full_recommends)
+
+
+def write_candidates(path, user_ids, beer_ids, candidates, candidate_scores):
+    """ CSV of user id and candidates as bytea hex of little-endian int32 beer ids and float32 scores """
+    counts = (candidates >= 0).sum(axis=1)
+    raw_candidates = beer_ids[np.maximum(candidates, 0)].astype('<i4')
+    candidate_scores = candidate_scores.astype('<f4')
+    with open(path, 'w') as f:
+        f.write('user_id,beer_ids,scores\n')
+        for user_id, row, row_scores, count in zip(user_ids, raw_candidates, candidate_scores, counts):
+            f.write('{},\\x{},\\x{}\n'.format(user_id, row[:count].tobytes().hex(), row_scores[:count].tobytes().hex()))
+
+
+def copy_candidates(cursor, path):
+    """ Load write_candidates file into CANDIDATES_TABLE """
+    with open(path) as f:
+        cursor.copy_expert('COPY {} (user_id, beer_ids, scores) FROM STDIN WITH (FORMAT csv, HEADER true);'.format(CANDIDATES_TABLE), f)
+
+
+def publish(checkpoints, options):
+    """ Replace beer_beerrecommendation and CANDIDATES_TABLE content in one transaction """
+    data = checkpoints.load('fill')
+    ids = checkpoints.load('index')
+    # -1 would index the last beer id, fill completes every row of a catalogue of 10 beers or more
+    if (data['beer_index'] < 0).any() or data['top_10'].shape[0] < 10:
+        print('Error: fill checkpoint has users with fewer than 10 recommendations')
+        sys.exit(1)
+    # back to raw ids, users with no reviews are added in one block
+    beers = np.concatenate([ids['beer_ids'][data['beer_index']],
+                            np.tile(ids['beer_ids'][data['top_10']], (data['new_users'].shape[0], 1))])
+    recommendations = pd.DataFrame(beers, columns=['Rec' + str(i) for i in range(0, 10)])
+    recommendations.insert(0, 'user_id', np.concatenate([ids['user_ids'], data['new_users']]))
+    csv_path = os.path.join(checkpoints.data_dir, 'recommendations.csv')
+    # users with no reviews have no candidates, they are re-ranked from popularity rankings
+    scored = checkpoints.load('score')
+    candidates_path = os.path.join(checkpoints.data_dir, 'candidates.csv')
+    with section('write_csv'):
+        recommendations.to_csv(csv_path, index=False)
+        write_candidates(candidates_path, ids['user_ids'], ids['beer_ids'], scored['candidates'], scored['candidate_scores'])
+
+    conn = connect(db_params())
+    cursor = conn.cursor()
+    try:
+        cursor.execute('TRUNCATE beer_beerrecommendation, {};'.format(CANDIDATES_TABLE))
+        print('Tables are truncated')
+        # COPY FROM STDIN streams file from this host, server doesn't need access to it
+        with section('copy'), open(csv_path) as f:
+            cursor.copy_expert("COPY beer_beerrecommendation (recommendation_user_id, top1_beer_id, top2_beer_id, top3_beer_id, top4_beer_id, top5_beer_id, top6_beer_id, top7_beer_id, top8_beer_id, top9_beer_id, top10_beer_id) FROM STDIN WITH (FORMAT csv, HEADER true, ENCODING 'UTF8');", f)
+        with section('copy'):
+            copy_candidates(cursor, candidates_path)
+    except (Exception, psycopg2.DatabaseError) as error:
+        print("Error: %s" % error)
+        conn.rollback()
+        cursor.close()
+        conn.close()
+        sys.exit(1)
+    conn.commit()
+    print('Copy to db')
     cursor.close()
     conn.close()
-    sys.exit(1)
-print('Copy to db')
-cursor.execute('COMMIT;')
-stop = timeit.default_timer()
-print('Work time is', stop - start)
-conn.close()
+
+
+STAGE_FUNCTIONS = {
+    'extract': extract,
+    'index': index,
+    'train': train,
+    'score': score,
+    'fill': fill,
+    'publish': publish,
+}
+
+
+def run(options):
+    checkpoints = Checkpoints(options.data_dir)
+    if checkpoints.state.get('mode', 'explicit') != options.mode:
+        # index and following stages depend on training mode
+        checkpoints.state['mode'] = options.mode
+        checkpoints.invalidate_from(STAGES[STAGES.index('index'):])
+    if options.force:
+        checkpoints.invalidate_from(STAGES)
+    if options.from_stage:
+        checkpoints.invalidate_from(STAGES[STAGES.index(options.from_stage):])
+    last_stage = STAGES.index(options.to_stage) if options.to_stage else len(STAGES) - 1
+
+    # runs started in the same second by one process keep their own reports
+    run_id = '{}-{}-{}'.format(time.strftime('%Y%m%d-%H%M%S'), os.getpid(), uuid.uuid4().hex[:8])
+    runs_dir = os.path.join(checkpoints.data_dir, RUNS_DIR)
+    previous = latest_report(runs_dir)
+    report = {'run_id': run_id, 'started': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'mode': options.mode,
+              'options': vars(options), 'python': platform.python_version(), 'numpy': np.__version__,
+              'cpu_count': os.cpu_count(), 'status': 'failed', 'skipped': [], 'stages': {}}
+    if options.tracemalloc:
+        tracemalloc.start()
+    try:
+        for stage in STAGES[:last_stage + 1]:
+            if checkpoints.is_done(stage):
+                print('Stage {} is done, skipped'.format(stage))
+                report['skipped'].append(stage)
+                continue
+            print('Stage {}...'.format(stage))
+            profile_path = os.path.join(checkpoints.data_dir, PROFILES_DIR, '{}-{}.prof'.format(run_id, stage)) \
+                if options.cprofile else None
+            profile = StageProfile(stage, options.tracemalloc, profile_path)
+            try:
+                with profile:
+                    STAGE_FUNCTIONS[stage](checkpoints, options)
+            finally:
+                # failed stage is reported too
+                report['stages'][stage] = profile.result
+            checkpoints.mark_done(stage, profile.result['wall_seconds'])
+            print('Stage {} is done in {:.1f}s'.format(stage, profile.result['wall_seconds']))
+        if last_stage == len(STAGES) - 1:
+            # recommendations are published, next scheduled run builds them from fresh data
+            checkpoints.finish()
+        report['status'] = 'completed'
+    finally:
+        if options.tracemalloc:
+            tracemalloc.stop()
+        report['wall_seconds'] = round(sum(result.get('wall_seconds', 0) for result in report['stages'].values()), 3)
+        path = save_report(runs_dir, report)
+        print_report(report, previous)
+        print('Work time is', report['wall_seconds'])
+        print('Run report is saved to', path)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Build beer recommendations for all users. '
+                                                 'Each stage checkpoints its output, rerun of an interrupted run resumes '
+                                                 'after its last completed stage.')
+    parser.add_argument('--data-dir', default=PATH_TO_DATA, help='checkpoints and output files directory')
+    parser.add_argument('--from-stage', choices=STAGES, help='rerun this stage and all following ones')
+    parser.add_argument('--to-stage', choices=STAGES, help='stop after this stage')
+    parser.add_argument('--force', action='store_true', help='ignore checkpoints, run all stages')
+    parser.add_argument('--mode', choices=['explicit', 'implicit'], default='explicit',
+                        help='explicit: Spark ALS on overall scores, implicit: confidence weighted ALS on all review scores and recency')
+    parser.add_argument('--seed', type=int, default=0, help='seed for ALS and random fill')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='processes for fill stage')
+    parser.add_argument('--tracemalloc', type=int, default=0, metavar='N',
+                        help='trace Python allocations, report N largest allocation sites per stage (slows the run)')
+    parser.add_argument('--cprofile', action='store_true', help='dump cProfile stats of every stage to profiles directory')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    run(parse_args())
@@ -0,0 +1,325 @@
+# Offline evaluation of recommender configurations
+import argparse
+import itertools
+import json
+import os
+import resource
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import cron_job
+
+# Reviews are split by time: model is trained on older reviews and evaluated on the newest ones.
+# Ranking metrics count test reviews with overall >= relevant threshold as relevant beers.
+
+# Table Django creates for beer_app.models.RecommendationEvent
+EVENTS_TABLE = 'beer_app_recommendationevent'
+
+
+def split_by_time(data, test_fraction):
+    """ Train/test masks of extracted reviews, test part is the newest test_fraction of reviews """
+    cutoff = np.quantile(data['review_time'], 1 - test_fraction)
+    test = data['review_time'] >= cutoff
+    return ~test, test, cutoff
+
+
+def build_dataset(data, test_fraction, relevant_threshold, mode='explicit'):
+    """
+    Dense indices of training reviews (same filter as cron_job index stage) and
+    test reviews of users and beers known from training.
+    """
+    train_mask, test_mask, cutoff = split_by_time(data, test_fraction)
+    if mode == 'explicit':
+        train_mask &= data['review_overall'] >= 1
+    user_ids, user_index = np.unique(data['user_id'][train_mask], return_inverse=True)
+    beer_ids, beer_index = np.unique(data['beer_id'][train_mask], return_inverse=True)
+
+    test_users = np.searchsorted(user_ids, data['user_id'][test_mask])
+    test_beers = np.searchsorted(beer_ids, data['beer_id'][test_mask])
+    known = (test_users < user_ids.shape[0]) & (test_beers < beer_ids.shape[0])
+    known[known] = (user_ids[test_users[known]] == data['user_id'][test_mask][known]) & \
+                   (beer_ids[test_beers[known]] == data['beer_id'][test_mask][known])
+    return {
+        'cutoff': cutoff,
+        'n_users': user_ids.shape[0],
+        'n_beers': beer_ids.shape[0],
+        'user_index': user_index.astype(np.int32),
+        'beer_index': beer_index.astype(np.int32),
+        'rating': data['review_overall'][train_mask].astype(np.float32),
+        # recency is relative to newest training review
+        'weight': cron_job.review_weights(data, train_mask),
+        'review_time': data['review_time'][train_mask],
+        'test_user_index': test_users[known].astype(np.int32),
+        'test_beer_index': test_beers[known].astype(np.int32),
+        'test_rating': data['review_overall'][test_mask][known].astype(np.float32),
+        'test_relevant': data['review_overall'][test_mask][known] >= relevant_threshold,
+    }
+
+
+def ranking_metrics(top, users, relevant_users, relevant_beers, n_beers):
+    """ Mean precision, recall and NDCG of top beers of users with binary relevance, None without users """
+    if not users.shape[0]:
+        return {'precision_at_k': None, 'recall_at_k': None, 'ndcg_at_k': None}
+    k = top.shape[1]
+    relevant_keys = np.unique(relevant_users.astype(np.int64) * n_beers + relevant_beers)
+    top_keys = users[:, None].astype(np.int64) * n_beers + top
+    hits = (top >= 0) & np.isin(top_keys, relevant_keys)
+    relevant_counts = np.bincount(relevant_users, minlength=users.max() + 1)[users]
+
+    discounts = 1 / np.log2(np.arange(2, k + 2))
+    dcg = (hits * discounts).sum(axis=1)
+    ideal_dcg = np.cumsum(discounts)[np.minimum(relevant_counts, k) - 1]
+    return {
+        'precision_at_k': float((hits.sum(axis=1) / k).mean()),
+        'recall_at_k': float((hits.sum(axis=1) / relevant_counts).mean()),
+        'ndcg_at_k': float((dcg / ideal_dcg).mean()),
+    }
+
+
+def process_tree_rss_mb():
+    """
+    Resident memory of this process and all its descendants (Spark JVM), None where /proc is not available.
+    """
+    try:
+        pids = [int(name) for name in os.listdir('/proc') if name.isdigit()]
+    except OSError:
+        return None
+    children = defaultdict(list)
+    rss_pages = {}
+    for pid in pids:
+        try:
+            with open('/proc/{}/stat'.format(pid)) as f:
+                # fields after command name, which may contain spaces: state, ppid, ..., rss is 22nd of them
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            # process has exited meanwhile
+            continue
+        children[int(fields[1])].append(pid)
+        rss_pages[pid] = int(fields[21])
+    total = 0
+    pending = [os.getpid()]
+    while pending:
+        pid = pending.pop()
+        total += rss_pages.get(pid, 0)
+        pending.extend(children[pid])
+    return total * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+class PeakMemory:
+    """
+    Peak resident memory of this process and its descendants sampled while in context.
+    Spark JVM keeps running until the worker exits, so rusage of children would never count it.
+    """
+
+    def __enter__(self):
+        self.peak = process_tree_rss_mb()
+        self.sampling = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+        return self
+
+    def sample(self):
+        while not self.sampling.wait(cron_job.RSS_SAMPLE_SECONDS):
+            self.peak = max(self.peak or 0.0, process_tree_rss_mb() or 0.0)
+
+    def __exit__(self, *exc_info):
+        self.sampling.set()
+        self.sampler.join()
+        if self.peak is not None:
+            self.peak = max(self.peak, process_tree_rss_mb() or 0.0)
+        return False
+
+    def peak_mb(self):
+        if self.peak is None:
+            # without /proc only this process is measured, ru_maxrss is in kilobytes on Linux
+            return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        return round(self.peak, 1)
+
+
+def evaluate_config(descriptions, names, scalars, config, k, seed):
+    """ Train one configuration and compute its metrics, run in a separate worker process """
+    segments, arrays = cron_job.attach_arrays(descriptions)
+    try:
+        dataset = dict(zip(names, arrays), **scalars)
+        params = {name: value for name, value in config.items() if name != 'mode'}
+        with PeakMemory() as memory:
+            start = time.perf_counter()
+            if config['mode'] == 'implicit':
+                user_factors, beer_factors = cron_job.fit_implicit_als(dataset['user_index'], dataset['beer_index'], dataset['weight'],
+                                                                       dataset['n_users'], dataset['n_beers'], seed=seed, **params)
+            else:
+                user_factors, beer_factors = cron_job.fit_als(dataset['user_index'], dataset['beer_index'], dataset['rating'],
+                                                              dataset['n_users'], dataset['n_beers'], seed=seed, **params)
+            train_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            rmse = None
+            # implicit scores predict preference, not review score, mean of no test reviews is NaN
+            if config['mode'] == 'explicit' and dataset['test_rating'].shape[0]:
+                predictions = (user_factors[dataset['test_user_index']] * beer_factors[dataset['test_beer_index']]).sum(axis=1)
+                rmse = float(np.sqrt(np.mean((predictions - dataset['test_rating']) ** 2)))
+            relevant_users = dataset['test_user_index'][dataset['test_relevant']]
+            relevant_beers = dataset['test_beer_index'][dataset['test_relevant']]
+            users = np.unique(relevant_users)
+            top = cron_job.top_unseen_matrix(user_factors, beer_factors, dataset['user_index'], dataset['beer_index'],
+                                             users=users, count=k)
+            metrics = ranking_metrics(top, users, relevant_users, relevant_beers, dataset['n_beers'])
+            eval_seconds = time.perf_counter() - start
+        return dict(config=config, rmse=rmse, **metrics,
+                    train_seconds=round(train_seconds, 3),
+                    eval_seconds=round(eval_seconds, 3),
+                    peak_rss_mb=memory.peak_mb())
+    finally:
+        for segment in segments:
+            segment.close()
+
+
+def extract_events():
+    """ Impressions and reviews logged by the web app (beer_app.event_log) """
+    conn = cron_job.connect(cron_job.db_params('DATABASE_REPLICA_'))
+    column_names = ['user_id', 'beer_id', 'event', 'source', 'position', 'created']
+    events = cron_job.postgresql_to_dataframe(conn, 'SELECT user_id, beer_id, event, source, COALESCE(position, 0), EXTRACT(EPOCH FROM created) FROM {}'.format(EVENTS_TABLE), column_names)
+    conn.close()
+    if isinstance(events, int):
+        raise SystemExit(1)
+    events['created'] = events['created'].astype(np.float64)
+    return events[events.event == 'impression'], events[events.event == 'review']
+
+
+def exposure_report(impressions, reviews, window_days):
+    """
+    Share of served (user, beer) pairs reviewed within window_days after their first impression,
+    per serving endpoint and per position.
+    """
+    first = impressions.sort_values('created', kind='stable').drop_duplicates(['user_id', 'beer_id', 'source'])
+    first_reviews = reviews.groupby(['user_id', 'beer_id'], as_index=False)['created'].min().rename(columns={'created': 'reviewed'})
+    served = first.merge(first_reviews, on=['user_id', 'beer_id'], how='left')
+    delay = served['reviewed'] - served['created']
+    served['hit'] = (delay >= 0) & (delay <= window_days * 86400)
+    return {
+        'window_days': window_days,
+        'sources': {source: {'impressions': int(group.shape[0]), 'users': int(group['user_id'].nunique()),
+                             'review_rate': float(group['hit'].mean())}
+                    for source, group in served.groupby('source')},
+        'positions': {int(position): float(rate) for position, rate in served.groupby('position')['hit'].mean().items()},
+    }
+
+
+def make_configs(options):
+    if options.mode == 'implicit':
+        return [{'mode': 'implicit', 'rank': rank, 'max_iter': max_iter, 'reg_param': reg_param, 'alpha': alpha,
+                 'cg_steps': cron_job.IMPLICIT_PARAMS['cg_steps']}
+                for rank, max_iter, reg_param, alpha in itertools.product(options.rank, options.max_iter,
+                                                                          options.reg_param, options.alpha)]
+    return [{'mode': 'explicit', 'rank': rank, 'max_iter': max_iter, 'reg_param': reg_param}
+            for rank, max_iter, reg_param in itertools.product(options.rank, options.max_iter, options.reg_param)]
+
+
+def run(options):
+    # own checkpoints, stage state of cron_job data directory is only read
+    checkpoints = cron_job.Checkpoints(options.data_dir)
+    if not checkpoints.is_done('extract') or options.extract:
+        start = time.perf_counter()
+        source = cron_job.Checkpoints(options.cron_job_data_dir) if options.cron_job_data_dir else None
+        if source is not None and source.has_output('extract') and not options.extract:
+            checkpoints.save('extract', **source.load('extract'))
+        else:
+            cron_job.extract(checkpoints, options)
+        checkpoints.mark_done('extract', time.perf_counter() - start)
+    dataset = build_dataset(checkpoints.load('extract'), options.test_fraction, options.relevant_threshold, options.mode)
+    print('Train: {} reviews, {} users, {} beers. Test: {} known reviews after {}'.format(
+        dataset['user_index'].shape[0], dataset['n_users'], dataset['n_beers'],
+        dataset['test_rating'].shape[0], time.strftime('%Y-%m-%d %H:%M', time.gmtime(dataset['cutoff']))))
+
+    exposure = None
+    if options.exposure:
+        exposure = exposure_report(*extract_events(), options.window_days)
+        print('{:<20}{:>12}{:>10}{:>14}'.format('served by', 'impressions', 'users', 'review rate'))
+        for source, summary in exposure['sources'].items():
+            print('{:<20}{:>12}{:>10}{:>14.4f}'.format(source, summary['impressions'], summary['users'], summary['review_rate']))
+
+    configs = make_configs(options)
+    workers = max(1, min(options.workers, len(configs)))
+    # cores are shared between configurations trained at the same time
+    os.environ.setdefault('SPARK_MASTER', 'local[{}]'.format(max(1, (os.cpu_count() or 1) // workers)))
+    names = [name for name, value in dataset.items() if isinstance(value, np.ndarray)]
+    scalars = {name: value for name, value in dataset.items() if not isinstance(value, np.ndarray)}
+    segments = []
+    try:
+        descriptions = [cron_job.share_array(dataset[name], segments) for name in names]
+        # new process per configuration, so peak memory is measured per configuration
+        with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1) as executor:
+            futures = [executor.submit(evaluate_config, descriptions, names, scalars, config, options.k, options.seed)
+                       for config in configs]
+            results = [future.result() for future in futures]
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+
+    print('{:<72}{:>8}{:>8}{:>8}{:>8}{:>10}{:>10}'.format('config', 'rmse', 'p@{}'.format(options.k), 'r@{}'.format(options.k),
+                                                          'ndcg', 'train s', 'peak MB'))
+    def metric(value):
+        return '-' if value is None else '{:.4f}'.format(value)
+
+    for result in results:
+        print('{:<72}{:>8}{:>8}{:>8}{:>8}{:>10.1f}{:>10.1f}'.format(
+            json.dumps(result['config'], separators=(',', ':')).replace('"', ''),
+            metric(result['rmse']), metric(result['precision_at_k']), metric(result['recall_at_k']),
+            metric(result['ndcg_at_k']), result['train_seconds'], result['peak_rss_mb']))
+    if not dataset['test_rating'].shape[0]:
+        print('No test reviews of known users and beers, rmse is not computed')
+    if not dataset['test_relevant'].any():
+        print('No relevant test reviews of known users and beers, ranking metrics are not computed')
+
+    chosen = None
+    passing = [result for result in results if result['ndcg_at_k'] is not None and result['ndcg_at_k'] >= options.min_ndcg]
+    if passing:
+        chosen = min(passing, key=lambda result: result['train_seconds'])
+        print('Cheapest config with NDCG@{} >= {}: {}'.format(options.k, options.min_ndcg, chosen['config']))
+    report = {
+        'test_fraction': options.test_fraction,
+        'cutoff': dataset['cutoff'],
+        'k': options.k,
+        'relevant_threshold': options.relevant_threshold,
+        'train_reviews': int(dataset['user_index'].shape[0]),
+        'test_reviews': int(dataset['test_rating'].shape[0]),
+        'results': results,
+        'chosen': chosen,
+        'exposure': exposure,
+    }
+    with open(options.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Train recommender configurations on older reviews in parallel and '
+                                                 'report RMSE, precision/recall/NDCG@k, training time and peak memory on newest ones.')
+    parser.add_argument('--data-dir', default=os.path.join(cron_job.PATH_TO_DATA, 'eval'),
+                        help='checkpoint directory of evaluation, separate from cron_job stages')
+    parser.add_argument('--cron-job-data-dir', help='copy completed extract checkpoint of cron_job from this directory '
+                                                    'instead of querying database, its state is not changed')
+    parser.add_argument('--extract', action='store_true', help='extract reviews from database again even if checkpoint exists')
+    parser.add_argument('--test-fraction', type=float, default=0.2, help='newest fraction of reviews used for evaluation')
+    parser.add_argument('--relevant-threshold', type=float, default=4.0, help='test review overall counted as relevant')
+    parser.add_argument('--k', type=int, default=10, help='recommendation list length')
+    parser.add_argument('--mode', choices=['explicit', 'implicit'], default='explicit', help='cron_job training mode')
+    parser.add_argument('--rank', type=int, nargs='+', default=[cron_job.ALS_PARAMS['rank']])
+    parser.add_argument('--max-iter', type=int, nargs='+', default=[cron_job.ALS_PARAMS['max_iter']])
+    parser.add_argument('--reg-param', type=float, nargs='+', default=[cron_job.ALS_PARAMS['reg_param']])
+    parser.add_argument('--alpha', type=float, nargs='+', default=[cron_job.IMPLICIT_PARAMS['alpha']],
+                        help='confidence scale of implicit mode')
+    parser.add_argument('--min-ndcg', type=float, default=0.0, help='quality bar for picking the cheapest configuration')
+    parser.add_argument('--workers', type=int, default=2, help='configurations trained at the same time')
+    parser.add_argument('--exposure', action='store_true', help='report review rate of served recommendations from event log')
+    parser.add_argument('--window-days', type=float, default=30, help='review counts for impression within this many days')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='eval_report.json', help='JSON report path')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    run(parse_args())